@@ -2,8 +2,17 @@ from .base import BaseAgent, ConversationAgent
 from .chat_agent import ChatAgent
 from .memory_agent import MemoryAgent
 from .system_prompt_agent import SystemPromptAgent
+from .scheduler import AdmissionScheduler, AdmissionRejected
+from .resumable import StreamRegistry, StreamGone
+from .batch import BatchRunner
+from .jobs import JobQueue
+from .ingestion import DocumentIngester
+from .retrieval import Retriever
 
 __all__ = [
     "BaseAgent", "ConversationAgent",
-    "ChatAgent", "MemoryAgent", "SystemPromptAgent"
+    "ChatAgent", "MemoryAgent", "SystemPromptAgent",
+    "AdmissionScheduler", "AdmissionRejected",
+    "StreamRegistry", "StreamGone",
+    "BatchRunner", "JobQueue", "DocumentIngester", "Retriever"
 ]
\ No newline at end of file
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import logging
+from typing import Any, AsyncGenerator, AsyncIterable, Dict, Iterable, Optional, Union
+from .scheduler import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner:
+    """Runs many chat requests through an agent with bounded concurrency
+
+    Jobs are dicts with index, custom_id and either messages + context or a
+    parse error, from an iterable or async iterable that is read lazily. A
+    fixed pool of workers pulls jobs as they free up, so the number of
+    requests in flight never exceeds `concurrency` and throughput follows
+    upstream capacity. Results are yielded as they finish, followed by a
+    summary; workers stop taking jobs while `concurrency` results wait to be
+    consumed, so a slow reader holds back the input too.
+    """
+
+    def __init__(self, agent: Any, concurrency: int = 8, max_retries: int = 3):
+        self.agent = agent
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    async def run(
+        self,
+        jobs: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        results: asyncio.Queue = asyncio.Queue()
+        started = time.perf_counter()
+        summary = {"total": 0, "succeeded": 0, "failed": 0, "usage": {}}
+
+        if isinstance(jobs, AsyncIterable):
+            pending = jobs.__aiter__()
+            # An async generator can't be advanced by two workers at once
+            lock = asyncio.Lock()
+
+            async def next_job() -> Optional[Dict[str, Any]]:
+                async with lock:
+                    return await anext(pending, None)
+        else:
+            pending = iter(jobs)
+
+            async def next_job() -> Optional[Dict[str, Any]]:
+                return next(pending, None)
+
+        unread = asyncio.Semaphore(self.concurrency)
+
+        async def worker() -> None:
+            try:
+                while True:
+                    await unread.acquire()
+                    job = await next_job()
+                    if job is None:
+                        break
+                    await results.put(await self._run_job(job))
+            finally:
+                await results.put(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            remaining = len(workers)
+            while remaining:
+                result = await results.get()
+                if result is None:
+                    remaining -= 1
+                    continue
+
+                summary["total"] += 1
+                summary[result["status"]] += 1
+                for key, value in (result.get("usage") or {}).items():
+                    if isinstance(value, (int, float)):
+                        summary["usage"][key] = summary["usage"].get(key, 0) + value
+                yield result
+                unread.release()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if hasattr(pending, "aclose"):
+                await pending.aclose()
+
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield {"summary": summary}
+
+    async def _run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        record = {"index": job["index"], "custom_id": job.get("custom_id")}
+        if job.get("error"):
+            return {**record, "status": "failed", "error": job["error"], "attempts": 0}
+
+        started = time.perf_counter()
+        attempts = 0
+        error: Optional[str] = None
+        while attempts <= self.max_retries:
+            attempts += 1
+            try:
+                result = await self.agent.process_messages(job["messages"], job["context"])
+            except AdmissionRejected as e:
+                # Upstream is saturated: back off and let it drain
+                error = str(e)
+                if attempts <= self.max_retries:
+                    await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                error = str(e)
+                break
+
+            return {
+                **record,
+                "status": "succeeded",
+                "response": {
+                    "message": result["message"].model_dump(mode="json"),
+                    "conversation_id": result["conversation_id"],
+                    "provider": result["provider"].value,
+                    "model": result["model"]
+                },
+                "usage": result.get("usage"),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "attempts": attempts
+            }
+
+        logger.warning(f"Batch item {job['index']} failed after {attempts} attempt(s): {error}")
+        return {
+            **record,
+            "status": "failed",
+            "error": error,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "attempts": attempts
+        }
@@ -1,45 +1,98 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncGenerator
+import asyncio
 import uuid
-from datetime import datetime
+import time
+import weakref
+import logging
 from app.models import Message, Role, Provider
-from app.providers import PROVIDER_MAP
+from app.providers import PROVIDER_MAP, LoadBalancedLlamaCppProvider, http_pools
 from app.config import settings
 from .base import ConversationAgent
+from .coalescing import SingleFlight, request_fingerprint
+from .response_cache import ResponseCache
+from .scheduler import AdmissionScheduler, Permit
+from .resumable import StreamRegistry
+from .token_counter import TokenCounter, LlamaCppTokenCounter
+from .summarizer import ConversationSummarizer
 from .memory_agent import MemoryAgent
 from .system_prompt_agent import SystemPromptAgent
 
+logger = logging.getLogger(__name__)
 
 class ChatAgent(ConversationAgent):
     """Main chat agent that orchestrates conversation flow"""
     
     def __init__(self, name: str = "ChatAgent", config: Optional[Dict[str, Any]] = None):
         super().__init__(name, config)
-        self.memory_agent = MemoryAgent()
+        self.memory_agent = MemoryAgent(config={
+            "token_counter": self._build_token_counter(),
+            "summarizer": ConversationSummarizer(self._summarize) if settings.summarization_enabled else None
+        })
         self.prompt_agent = SystemPromptAgent()
         self.providers = {}
-        self.conversations = {}
+        self.store = self.memory_agent.store
+        self.single_flight = SingleFlight()
+        self.response_cache = None
+        self.retriever = None  # set when retrieval over uploaded documents is enabled
+        self.scheduler = AdmissionScheduler(
+            max_concurrency=settings.max_concurrent_generations,
+            max_queue=settings.max_queued_generations,
+            queue_timeout=settings.generation_queue_timeout,
+            retry_after=settings.admission_retry_after,
+            limits=settings.generation_concurrency_limits
+        )
+        self.streams = StreamRegistry(
+            buffer_size=settings.stream_replay_buffer,
+            idle_timeout=settings.stream_resume_timeout
+        )
+        self.stream_metrics = {
+            "completed": 0,
+            "cancelled": 0,
+            "failed": 0,
+            "tokens_saved": 0,
+            "stored": 0
+        }
     
     async def initialize(self) -> None:
         """Initialize the chat agent and its dependencies"""
         await self.memory_agent.initialize()
         await self.prompt_agent.initialize()
         
+        if settings.response_cache_enabled:
+            self.response_cache = ResponseCache(
+                max_entries=settings.response_cache_max_entries,
+                ttl=settings.response_cache_ttl,
+                path=settings.response_cache_path
+            )
+        
         # Initialize providers
         if settings.ollama_base_url:
             self.providers[Provider.OLLAMA] = PROVIDER_MAP[Provider.OLLAMA](
                 base_url=settings.ollama_base_url
             )
         
-        if settings.llamacpp_base_url:
+        if settings.llamacpp_base_urls:
+            balancer = LoadBalancedLlamaCppProvider(
+                base_urls=settings.llamacpp_base_urls,
+                strategy=settings.llamacpp_balance_strategy,
+                health_check_interval=settings.llamacpp_health_check_interval
+            )
+            balancer.start_health_checks()
+            self.providers[Provider.LLAMACPP] = balancer
+        elif settings.llamacpp_base_url:
             self.providers[Provider.LLAMACPP] = PROVIDER_MAP[Provider.LLAMACPP](
                 base_url=settings.llamacpp_base_url
             )
     
     async def cleanup(self) -> None:
         """Cleanup resources"""
+        await self.streams.close()
         await self.memory_agent.cleanup()
         await self.prompt_agent.cleanup()
         
+        if self.response_cache:
+            self.response_cache.close()
+        
         for provider in self.providers.values():
             if hasattr(provider, '__aexit__'):
                 await provider.__aexit__(None, None, None)
@@ -70,16 +123,19 @@ class ChatAgent(ConversationAgent):
         model = context.get("model") or settings.default_model
         system_prompt_id = context.get("system_prompt_id")
         
-        # Get or create conversation
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = {
-                "id": conversation_id,
-                "messages": [],
-                "created_at": datetime.utcnow(),
-                "metadata": {}
-            }
+        # One-off requests (e.g. batch items) can skip conversation storage
+        persist = context.get("persist", True) or context.get("delta")
         
-        conversation = self.conversations[conversation_id]
+        if context.get("delta"):
+            # The client only sent the new turn; rebuild the rest from storage
+            conversation = await self.store.get_or_create(conversation_id)
+            new_messages = list(messages)
+            messages = conversation["messages"] + new_messages
+        elif persist:
+            await self.store.get_or_create(conversation_id)
+            new_messages = messages[-1:]
+        else:
+            new_messages = None
         
         # Apply system prompt if needed
         if system_prompt_id:
@@ -90,42 +146,120 @@ class ChatAgent(ConversationAgent):
             if system_message and not self._has_system_message(messages):
                 messages = [system_message] + messages
         
+        # Find excerpts of uploaded documents, leaving room for them in the context
+        max_context_length = context.get("max_context_length", settings.max_context_length)
+        retrieved = None
+        if self.retriever and context.get("retrieval", True):
+            retrieved = await self.retriever.context_message(
+                messages,
+                min(settings.retrieval_token_budget, max_context_length // 2),
+                file_ids=context.get("file_ids")
+            )
+        
         # Manage conversation memory
         messages = await self.memory_agent.manage_context(
             messages,
-            max_tokens=context.get("max_context_length", settings.max_context_length)
+            max_tokens=max_context_length - (retrieved["tokens"] if retrieved else 0),
+            conversation_id=conversation_id if persist else None
         )
         
+        sources = None
+        if retrieved:
+            # Swapped in after trimming, so stored history (and its token index) stays as sent
+            messages = [retrieved["message"] if m is retrieved["question"] else m for m in messages]
+            sources = retrieved["sources"]
+        
         # Get provider and send request
         if provider not in self.providers:
             raise ValueError(f"Provider {provider} not available")
         
         provider_instance = self.providers[provider]
         
+        sampling = {
+            "temperature": context.get("temperature", settings.default_temperature),
+            "top_p": context.get("top_p", settings.default_top_p),
+            "top_k": context.get("top_k", settings.default_top_k),
+            "max_tokens": context.get("max_tokens")
+        }
+        key = request_fingerprint(provider.value, model, messages, **sampling)
+        
+        # Only deterministic generations are safe to serve from cache
+        cache = self.response_cache if sampling["temperature"] == 0 else None
+        cached = await cache.get(key) if cache else None
+        
+        priority = context.get("priority") or 0
+        queue_timeout = context.get("queue_timeout")
+        
         # Stream or regular chat
         if context.get("stream", False):
-            return {
-                "stream": provider_instance.chat_stream(
+            permit = None
+            if cached:
+                stream = cache.replay_stream(cached)
+            else:
+                # Held for the whole stream; raises AdmissionRejected when overloaded
+                permit = await self.scheduler.acquire(
+                    provider.value, model, priority, queue_timeout
+                )
+                stream = provider_instance.chat_stream(
                     messages=messages,
                     model=model,
-                    temperature=context.get("temperature", settings.default_temperature),
-                    top_p=context.get("top_p", settings.default_top_p),
-                    top_k=context.get("top_k", settings.default_top_k),
-                    max_tokens=context.get("max_tokens")
-                ),
+                    conversation_id=conversation_id,
+                    **sampling
+                )
+                if cache:
+                    stream = cache.record_stream(key, stream)
+            
+            tracked = self._track_stream(
+                stream,
+                conversation_id,
+                sampling["max_tokens"] or settings.default_max_tokens,
+                permit,
+                new_messages=new_messages,
+                metadata={"provider": provider.value, "model": model, "cached": bool(cached)},
+                # Background jobs are rerun when interrupted, so they only store finished turns
+                store_partial=context.get("store_partial", True)
+            )
+            if permit:
+                # Release even if the stream is dropped without ever being iterated
+                weakref.finalize(tracked, permit.release)
+            
+            return {
+                "stream": tracked,
                 "conversation_id": conversation_id,
                 "provider": provider,
-                "model": model
+                "model": model,
+                "sources": sources
             }
         else:
-            response = await provider_instance.chat(
-                messages=messages,
-                model=model,
-                temperature=context.get("temperature", settings.default_temperature),
-                top_p=context.get("top_p", settings.default_top_p),
-                top_k=context.get("top_k", settings.default_top_k),
-                max_tokens=context.get("max_tokens")
-            )
+            async def call_provider():
+                permit = await self.scheduler.acquire(
+                    provider.value, model, priority, queue_timeout
+                )
+                try:
+                    result = await provider_instance.chat(
+                        messages=messages,
+                        model=model,
+                        conversation_id=conversation_id,
+                        **sampling
+                    )
+                finally:
+                    permit.release()
+                if cache:
+                    await cache.set(key, {
+                        "content": result["content"],
+                        "chunks": None,
+                        "usage": result.get("usage")
+                    })
+                return result
+            
+            if cached:
+                response = cached
+            elif settings.request_coalescing and sampling["temperature"] == 0:
+                # Identical concurrent deterministic requests share one upstream call;
+                # sampled ones must each get their own reply
+                response = await self.single_flight.do(key, call_provider)
+            else:
+                response = await call_provider()
             
             # Create assistant message
             assistant_message = Message(
@@ -133,25 +267,140 @@ class ChatAgent(ConversationAgent):
                 content=response["content"]
             )
             
-            # Update conversation
-            conversation["messages"].extend(messages[-1:])  # Add user message
-            conversation["messages"].append(assistant_message)
-            conversation["updated_at"] = datetime.utcnow()
-            
-            # Store in memory
-            await self.memory_agent.store_conversation(
-                conversation_id,
-                conversation["messages"]
-            )
+            # Store the user message and the reply
+            if persist:
+                await self.memory_agent.store_conversation(
+                    conversation_id,
+                    new_messages + [assistant_message]
+                )
             
             return {
                 "message": assistant_message,
                 "conversation_id": conversation_id,
                 "provider": provider,
                 "model": model,
-                "usage": response.get("usage")
+                "usage": response.get("usage"),
+                "sources": sources
             }
     
+    async def _track_stream(
+        self,
+        stream: AsyncGenerator[str, None],
+        conversation_id: str,
+        max_tokens: int,
+        permit: Optional[Permit] = None,
+        new_messages: Optional[List[Message]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        store_partial: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """Count streamed chunks, record abandoned generations and store the turn
+        
+        Chunks are only collected while streaming; the user and assistant
+        messages are written once the stream completes or, unless
+        store_partial is off, is cancelled.
+        """
+        
+        chunks = 0
+        parts = []
+        status = "failed"
+        started = time.perf_counter()
+        first_chunk_at = None
+        try:
+            async for chunk in stream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                chunks += 1
+                parts.append(chunk)
+                yield chunk
+            status = "completed"
+            self.stream_metrics["completed"] += 1
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "cancelled"
+            # Each upstream chunk is roughly one token
+            saved = max(max_tokens - chunks, 0)
+            self.stream_metrics["cancelled"] += 1
+            self.stream_metrics["tokens_saved"] += saved
+            logger.info(
+                f"Generation cancelled for conversation {conversation_id} "
+                f"after {chunks} chunks (~{saved} tokens saved)"
+            )
+            raise
+        except Exception:
+            self.stream_metrics["failed"] += 1
+            raise
+        finally:
+            # Close the upstream request right away so the backend slot is freed
+            try:
+                await stream.aclose()
+            finally:
+                if permit:
+                    permit.release()
+            
+            if new_messages is not None and (status == "completed" or status == "cancelled" and store_partial):
+                finished = time.perf_counter()
+                await self._store_streamed_turn(conversation_id, new_messages, "".join(parts), {
+                    **(metadata or {}),
+                    "status": status,
+                    # Each upstream chunk is roughly one token
+                    "usage": {"completion_tokens": chunks},
+                    "timing": {
+                        "time_to_first_chunk_ms": round((first_chunk_at - started) * 1000, 1)
+                        if first_chunk_at else None,
+                        "duration_ms": round((finished - started) * 1000, 1)
+                    }
+                })
+    
+    async def _store_streamed_turn(
+        self,
+        conversation_id: str,
+        new_messages: List[Message],
+        content: str,
+        metadata: Dict[str, Any]
+    ) -> None:
+        """Append a streamed turn to the conversation history"""
+        
+        messages = list(new_messages)
+        if content:
+            messages.append(Message(role=Role.ASSISTANT, content=content, metadata=metadata))
+        try:
+            await self.memory_agent.store_conversation(conversation_id, messages)
+            self.stream_metrics["stored"] += 1
+        except Exception as e:
+            logger.error(f"Failed to store streamed reply for conversation {conversation_id}: {e}")
+    
+    async def _summarize(self, messages: List[Message]) -> str:
+        """Generate a conversation summary with the (small) summarization model"""
+        
+        provider = Provider(settings.summarization_provider or settings.default_provider)
+        model = settings.summarization_model or settings.default_model
+        
+        if provider not in self.providers:
+            raise ValueError(f"Provider {provider} not available")
+        
+        # Below any request priority, so queued user requests always go first
+        permit = await self.scheduler.acquire(provider.value, model, priority=-1)
+        try:
+            result = await self.providers[provider].chat(
+                messages=messages,
+                model=model,
+                temperature=0.2,
+                top_p=settings.default_top_p,
+                top_k=settings.default_top_k,
+                max_tokens=settings.summarization_max_tokens
+            )
+        finally:
+            permit.release()
+        
+        return result["content"]
+    
+    def _build_token_counter(self) -> TokenCounter:
+        """Use llama.cpp's tokenizer for exact counts when configured"""
+        
+        if settings.token_counter == "llamacpp":
+            base_url = (settings.llamacpp_base_urls or [settings.llamacpp_base_url])[0]
+            return TokenCounter(backend=LlamaCppTokenCounter(base_url))
+        return TokenCounter()
+    
     def _get_default_model(self, provider: Provider) -> str:
         """Get default model for provider"""
         if provider == Provider.OLLAMA:
@@ -166,20 +415,7 @@ class ChatAgent(ConversationAgent):
     
     async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
         """Get conversation by ID"""
-        if conversation_id in self.conversations:
-            return self.conversations[conversation_id]
-        
-        # Try to load from memory
-        messages = await self.memory_agent.get_conversation(conversation_id)
-        if messages:
-            return {
-                "id": conversation_id,
-                "messages": messages,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-        
-        return None
+        return await self.store.get(conversation_id)
     
     async def list_models(self) -> List[Dict[str, Any]]:
         """List all available models from all providers"""
@@ -218,4 +454,26 @@ class ChatAgent(ConversationAgent):
                     "error": "Provider not configured"
                 })
         
-        return status_list
\ No newline at end of file
+        return status_list
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Collect runtime metrics from the agent and its providers"""
+        
+        metrics = {
+            "pools": http_pools.get_stats(),
+            "conversations": self.store.get_stats(),
+            "coalescing": self.single_flight.get_stats(),
+            "response_cache": self.response_cache.get_stats() if self.response_cache else None,
+            "streams": dict(self.stream_metrics),
+            "resumable_streams": self.streams.get_stats(),
+            "admission": self.scheduler.get_stats(),
+            "token_counter": self.memory_agent.token_counter.get_stats(),
+            "summarizer": self.memory_agent.summarizer.get_stats() if self.memory_agent.summarizer else None,
+            "providers": {}
+        }
+        
+        for provider_type, provider_instance in self.providers.items():
+            if hasattr(provider_instance, "get_stats"):
+                metrics["providers"][provider_type.value] = provider_instance.get_stats()
+        
+        return metrics
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, List
+from app.models import Message
+
+
+def request_fingerprint(
+    provider: str,
+    model: str,
+    messages: List[Message],
+    **params: Any
+) -> str:
+    """Canonical hash of everything that determines a provider's output"""
+
+    canonical = {
+        "provider": provider,
+        "model": model,
+        "messages": [
+            {"role": msg.role.value if hasattr(msg.role, "value") else msg.role, "content": msg.content}
+            for msg in messages
+        ],
+        "params": params
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Collapses concurrent identical calls into a single upstream call
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight await the same result. Nothing is kept once the call finishes.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.inflight.get(key)
+
+        if task is None:
+            # Run as its own task so one caller going away doesn't cancel the rest
+            task = asyncio.ensure_future(func())
+            self.inflight[key] = task
+            self.upstream_calls += 1
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.inflight)
+        }
@@ -0,0 +1,77 @@
+from bisect import bisect_left
+from typing import List, Tuple
+from app.models import Message, Role
+
+
+def prefix_hash(messages: List[Message], seed: int = 0) -> int:
+    """Hash of a message sequence, extending the hash of the messages before it
+
+    str caches its hash, so rehashing a history the server already holds
+    costs one tuple hash per message.
+    """
+    value = seed
+    for msg in messages:
+        value = hash((value, msg.role, msg.content))
+    return value
+
+
+class ContextIndex:
+    """Cumulative token counts for one conversation's history
+
+    System messages are tracked separately; for everything else the index
+    keeps prefix sums of token counts (and of user messages) so the trim
+    point for any budget is a binary search, and rolling hashes so a summary
+    of the first n of them can be checked against the current history. Appending a turn only costs the
+    new messages, as long as the history the caller sends still starts with
+    the indexed one, which is checked against a rolling hash of every
+    indexed message.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.prefix_hash = 0
+        self.system_positions: List[int] = []
+        self.system_tokens = 0
+        self.other_positions: List[int] = []
+        self.prefix_tokens: List[int] = [0]
+        self.prefix_users: List[int] = [0]
+        self.prefix_hashes: List[int] = [0]
+
+    def matches(self, messages: List[Message]) -> bool:
+        """Whether messages extend the indexed history"""
+        if self.size > len(messages):
+            return False
+        return prefix_hash(messages[:self.size]) == self.prefix_hash
+
+    def extend(self, messages: List[Message], counts: List[int]) -> None:
+        """Index messages[self.size:], given their token counts"""
+
+        for offset, (msg, count) in enumerate(zip(messages[self.size:], counts)):
+            position = self.size + offset
+            if msg.role == Role.SYSTEM:
+                self.system_positions.append(position)
+                self.system_tokens += count
+            else:
+                self.other_positions.append(position)
+                self.prefix_tokens.append(self.prefix_tokens[-1] + count)
+                self.prefix_users.append(self.prefix_users[-1] + (msg.role == Role.USER))
+                self.prefix_hashes.append(prefix_hash([msg], self.prefix_hashes[-1]))
+
+        self.prefix_hash = prefix_hash(messages[self.size:], self.prefix_hash)
+        self.size = len(messages)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.system_tokens + self.prefix_tokens[-1]
+
+    def cut_point(self, budget: float) -> int:
+        """Index into other_positions of the oldest message to keep
+
+        The kept suffix is the longest one whose tokens fit in the budget.
+        """
+        cut = bisect_left(self.prefix_tokens, self.prefix_tokens[-1] - budget)
+        return min(cut, len(self.other_positions))
+
+    def dropped_counts(self, cut: int) -> Tuple[int, int]:
+        """(messages, user messages) dropped before the cut point"""
+        return cut, self.prefix_users[cut]
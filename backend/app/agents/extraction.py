@@ -0,0 +1,222 @@
+import csv
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Tuple
+from .token_counter import HeuristicTokenCounter
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# These run in worker processes, so they take and return plain picklable data
+
+# A section is a labelled piece of a document: a page, a sheet, or the whole text
+Section = Tuple[str, str]
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+TEXT_TYPES = {"text/plain", "text/csv", "application/json", "text/markdown"}
+EXTRACTABLE_TYPES = TEXT_TYPES | {PDF, DOCX, XLSX}
+
+SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+
+
+class UnsupportedDocument(Exception):
+    """No extractor handles this content type"""
+    pass
+
+
+def read_text(path: str) -> str:
+    with open(path, "rb") as file:
+        data = file.read()
+    # utf-8-sig drops the BOM some editors write
+    return data.decode("utf-8-sig", errors="replace")
+
+
+def extract_csv(path: str) -> List[Section]:
+    # One row per line, cells separated by " | ", so rows stay readable in a chunk
+    rows = csv.reader(io.StringIO(read_text(path)))
+    return [("rows", "\n".join(" | ".join(cell.strip() for cell in row) for row in rows if any(row)))]
+
+
+def extract_docx(path: str) -> List[Section]:
+    with zipfile.ZipFile(path) as archive:
+        root = ET.fromstring(archive.read("word/document.xml"))
+
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NS}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{WORD_NS}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{WORD_NS}tab":
+                parts.append("\t")
+            elif node.tag in (f"{WORD_NS}br", f"{WORD_NS}cr"):
+                parts.append("\n")
+        text = "".join(parts).strip()
+        if text:
+            paragraphs.append(text)
+    return [("document", "\n\n".join(paragraphs))]
+
+
+def extract_xlsx(path: str) -> List[Section]:
+    with zipfile.ZipFile(path) as archive:
+        names = set(archive.namelist())
+        shared: List[str] = []
+        if "xl/sharedStrings.xml" in names:
+            for item in ET.fromstring(archive.read("xl/sharedStrings.xml")).iter(f"{SHEET_NS}si"):
+                shared.append("".join(t.text or "" for t in item.iter(f"{SHEET_NS}t")))
+
+        targets = {}
+        if "xl/_rels/workbook.xml.rels" in names:
+            for rel in ET.fromstring(archive.read("xl/_rels/workbook.xml.rels")).iter(f"{PACKAGE_REL_NS}Relationship"):
+                target = rel.get("Target", "").lstrip("/")
+                targets[rel.get("Id")] = target if target.startswith("xl/") else f"xl/{target}"
+
+        sections = []
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        for index, sheet in enumerate(workbook.iter(f"{SHEET_NS}sheet"), start=1):
+            target = targets.get(sheet.get(f"{REL_NS}id"), f"xl/worksheets/sheet{index}.xml")
+            if target not in names:
+                continue
+            lines = []
+            for row in ET.fromstring(archive.read(target)).iter(f"{SHEET_NS}row"):
+                cells = []
+                for cell in row.iter(f"{SHEET_NS}c"):
+                    kind = cell.get("t")
+                    if kind == "inlineStr":
+                        value = "".join(t.text or "" for t in cell.iter(f"{SHEET_NS}t"))
+                    else:
+                        node = cell.find(f"{SHEET_NS}v")
+                        value = node.text if node is not None and node.text else ""
+                        if kind == "s" and value:
+                            value = shared[int(value)]
+                    cells.append(value.strip())
+                if any(cells):
+                    lines.append(" | ".join(cells))
+            sections.append((f"sheet {sheet.get('name', index)}", "\n".join(lines)))
+        return sections
+
+
+def pdf_page_count(path: str) -> int:
+    if pypdf is None:
+        raise UnsupportedDocument("PDF extraction needs the pypdf package (pip install pypdf)")
+    return len(pypdf.PdfReader(path).pages)
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> List[Section]:
+    """Text of pages start..end-1, labelled with 1-based page numbers"""
+
+    if pypdf is None:
+        raise UnsupportedDocument("PDF extraction needs the pypdf package (pip install pypdf)")
+    reader = pypdf.PdfReader(path)
+    return [
+        (f"page {number + 1}", reader.pages[number].extract_text() or "")
+        for number in range(start, min(end, len(reader.pages)))
+    ]
+
+
+def extract_sections(path: str, content_type: str) -> List[Section]:
+    """Text of a non-PDF document (PDFs are extracted a few pages at a time)"""
+
+    if content_type == "text/csv":
+        return extract_csv(path)
+    if content_type in TEXT_TYPES:
+        return [("document", read_text(path))]
+    if content_type == DOCX:
+        return extract_docx(path)
+    if content_type == XLSX:
+        return extract_xlsx(path)
+    raise UnsupportedDocument(f"Can't extract text from {content_type}")
+
+
+def split_units(text: str, max_tokens: int, counter: HeuristicTokenCounter) -> List[Tuple[str, int]]:
+    """Split text into (piece, tokens) no longer than max_tokens
+
+    Paragraphs are kept whole where they fit, then sentences, then words;
+    a single word longer than the limit is cut by characters.
+    """
+
+    units = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = counter.count(paragraph)
+        if tokens <= max_tokens:
+            units.append((paragraph, tokens))
+            continue
+        for sentence in SENTENCE_END.split(paragraph):
+            tokens = counter.count(sentence)
+            if tokens <= max_tokens:
+                units.append((sentence, tokens))
+                continue
+            piece: List[str] = []
+            piece_tokens = 0
+            for word in sentence.split():
+                word_tokens = counter.count(word) + 1
+                while word_tokens > max_tokens:
+                    # No spaces to split on (long identifiers, unspaced scripts)
+                    cut = max(len(word) * max_tokens // word_tokens, 1)
+                    units.append((word[:cut], counter.count(word[:cut])))
+                    word = word[cut:]
+                    word_tokens = counter.count(word) + 1
+                if piece and piece_tokens + word_tokens > max_tokens:
+                    units.append((" ".join(piece), piece_tokens))
+                    piece, piece_tokens = [], 0
+                piece.append(word)
+                piece_tokens += word_tokens
+            if piece:
+                units.append((" ".join(piece), piece_tokens))
+    return units
+
+
+def chunk_sections(sections: List[Section], max_tokens: int, overlap_tokens: int = 0) -> List[Dict[str, Any]]:
+    """Pack sections into chunks of at most max_tokens (estimated) tokens
+
+    Each chunk records the section it starts in. Consecutive chunks share
+    up to overlap_tokens of trailing text, so a passage cut at a boundary
+    is still whole in one of them.
+    """
+
+    counter = HeuristicTokenCounter()
+    chunks: List[Dict[str, Any]] = []
+    # (text, tokens, section label)
+    current: List[Tuple[str, int, str]] = []
+    current_tokens = 0
+
+    def emit() -> None:
+        chunks.append({
+            "content": "\n\n".join(text for text, _, _ in current),
+            "tokens": current_tokens,
+            "section": current[0][2]
+        })
+
+    for label, text in sections:
+        for unit, tokens in split_units(text, max_tokens, counter):
+            if current and current_tokens + tokens > max_tokens:
+                emit()
+                # Carry the tail of this chunk into the next one
+                carried: List[Tuple[str, int, str]] = []
+                carried_tokens = 0
+                for previous in reversed(current):
+                    if carried_tokens + previous[1] > min(overlap_tokens, max_tokens - tokens):
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous[1]
+                current, current_tokens = carried, carried_tokens
+            current.append((unit, tokens, label))
+            current_tokens += tokens
+
+    if current:
+        emit()
+    return chunks
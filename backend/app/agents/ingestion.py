@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+from app.storage import FileStore
+from .extraction import (
+    PDF, UnsupportedDocument,
+    chunk_sections, extract_pdf_pages, extract_sections, pdf_page_count
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentIngester:
+    """Extracts and chunks the text of uploaded documents in the background
+
+    Parsing runs in a process pool, so large PDFs and spreadsheets never
+    block the event loop or hold the GIL. PDFs are extracted a batch of
+    pages at a time, which gives progress to report. Results are stored
+    per content digest, so uploading the same document again costs nothing.
+    """
+
+    def __init__(
+        self,
+        store: FileStore,
+        workers: int = 2,
+        chunk_tokens: int = 512,
+        chunk_overlap: int = 64,
+        pdf_batch_pages: int = 16,
+        on_ready: Optional[Callable[[str], None]] = None
+    ):
+        self.store = store
+        self.workers = workers
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.pdf_batch_pages = pdf_batch_pages
+        self.on_ready = on_ready  # called with the digest of each newly ingested document
+        self.pool: Optional[ProcessPoolExecutor] = None
+        # Bounds the single-worker pools that retry calls after a worker died
+        self.isolated = asyncio.Semaphore(workers)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {"ingested": 0, "failed": 0, "unsupported": 0, "cached": 0, "chunks": 0, "pool_restarts": 0}
+
+    async def start(self) -> None:
+        """Resume documents whose ingestion was interrupted by a restart"""
+
+        for record in await self.store.pending_documents():
+            logger.info(f"Resuming ingestion of {record['filename']} ({record['digest'][:12]})")
+            self._schedule(record)
+
+    async def close(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _new_pool(self, workers: int) -> ProcessPoolExecutor:
+        # A fresh interpreter per worker rather than a fork of this threaded process
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            self.pool = self._new_pool(self.workers)
+        return self.pool
+
+    async def _call(self, fn, *args) -> Any:
+        """Run fn in the pool, retrying it alone if a worker died
+
+        A worker that dies (out of memory, a crash in a parser) breaks the
+        whole pool and every call on it, so the pool is replaced and each
+        failed call is retried in a worker of its own. Calls that were merely
+        caught up in it succeed there; the document that kills its worker
+        again fails on its own.
+        """
+
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+
+        async with self.isolated:
+            isolated = self._new_pool(1)
+            try:
+                return await loop.run_in_executor(isolated, fn, *args)
+            finally:
+                isolated.shutdown(wait=False, cancel_futures=True)
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        # Calls that failed together only replace the pool once
+        if self.pool is pool:
+            logger.warning("An ingestion worker process died; starting a new pool")
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+            self.stats["pool_restarts"] += 1
+
+    async def submit(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Start ingesting an uploaded document and return its status"""
+
+        if await self.store.begin_document(record["digest"]):
+            self._schedule(record)
+        else:
+            self.stats["cached"] += 1
+        return await self.store.get_document(record["digest"])
+
+    def _schedule(self, record: Dict[str, Any]) -> None:
+        digest = record["digest"]
+        if digest not in self.tasks:
+            task = asyncio.create_task(self._ingest(record))
+            self.tasks[digest] = task
+            task.add_done_callback(lambda _: self.tasks.pop(digest, None))
+
+    async def _ingest(self, record: Dict[str, Any]) -> None:
+        digest = record["digest"]
+        path = str(record["path"])
+        started = time.perf_counter()
+        try:
+            await self.store.update_document(digest, status="extracting")
+            if record["content_type"] == PDF:
+                sections = await self._extract_pdf(digest, path)
+            else:
+                await self.store.update_document(digest, progress_total=1)
+                sections = await self._call(extract_sections, path, record["content_type"])
+                await self.store.update_document(digest, progress_done=1)
+
+            await self.store.update_document(digest, status="chunking")
+            chunks = await self._call(chunk_sections, sections, self.chunk_tokens, self.chunk_overlap)
+            await self.store.save_chunks(digest, chunks)
+        except asyncio.CancelledError:
+            # Left pending, so it's resumed on the next start
+            raise
+        except UnsupportedDocument as e:
+            self.stats["unsupported"] += 1
+            await self.store.update_document(digest, status="unsupported", error=str(e))
+            return
+        except Exception as e:
+            logger.warning(f"Ingestion of {record['filename']} failed: {e}")
+            self.stats["failed"] += 1
+            await self.store.update_document(digest, status="failed", error=str(e))
+            return
+
+        self.stats["ingested"] += 1
+        self.stats["chunks"] += len(chunks)
+        logger.info(
+            f"Ingested {record['filename']}: {len(chunks)} chunks "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        if self.on_ready:
+            self.on_ready(digest)
+
+    async def _extract_pdf(self, digest: str, path: str) -> List:
+        pages = await self._call(pdf_page_count, path)
+        await self.store.update_document(digest, progress_total=pages)
+
+        batches = [
+            asyncio.ensure_future(self._call(extract_pdf_pages, path, start, start + self.pdf_batch_pages))
+            for start in range(0, pages, self.pdf_batch_pages)
+        ]
+        try:
+            done = 0
+            for batch in asyncio.as_completed(batches):
+                done += len(await batch)
+                await self.store.update_document(digest, progress_done=done)
+        finally:
+            for batch in batches:
+                batch.cancel()
+
+        # as_completed doesn't keep order, the futures do
+        return [section for batch in batches for section in batch.result()]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self.tasks),
+            **self.stats
+        }
@@ -0,0 +1,249 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set
+from app.models import Message
+from app.storage.jobs import FINISHED
+from .scheduler import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Runs chat requests as background jobs on a pool of workers
+
+    Jobs are stored by a broker (SQLite or Redis), so they outlive the
+    request that submitted them and the process running them. Each worker
+    streams the generation, saving the partial reply and renewing its lease
+    every progress_interval seconds; if the process dies, the lease runs out
+    and another worker (or this one after a restart) runs the job again.
+    """
+
+    def __init__(
+        self,
+        agent: Any,
+        broker: Any,
+        workers: int = 2,
+        lease: float = 60.0,
+        poll_interval: float = 1.0,
+        progress_interval: float = 1.0
+    ):
+        self.agent = agent
+        self.broker = broker
+        self.concurrency = workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers: List[asyncio.Task] = []
+        self.running: Dict[str, asyncio.Task] = {}
+        self.cancelled: Set[str] = set()
+        self.wakeup = asyncio.Event()
+        self.updated = asyncio.Event()
+        self.last_purge = 0.0
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "retried": 0}
+
+    async def start(self) -> None:
+        """Open the broker and start the workers"""
+
+        await self.broker.initialize()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        logger.info(f"Job queue started with {self.concurrency} workers ({self.worker_id})")
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running are picked up after a restart"""
+
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        await self.broker.close()
+
+    def _notify(self) -> None:
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def submit(self, messages: List[Message], context: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        """Queue a chat request and return the job"""
+
+        job = await self.broker.submit({
+            "messages": [m.model_dump(mode="json") for m in messages],
+            "context": context
+        }, priority)
+        self.stats["submitted"] += 1
+        self.wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.broker.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a job; one running in another process stops at its next progress update"""
+
+        job = await self.broker.cancel(job_id)
+        task = self.running.get(job_id)
+        if task:
+            self.cancelled.add(job_id)
+            task.cancel()
+        self._notify()
+        return job
+
+    async def watch(self, job_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Yield the job whenever it changes, until it finishes
+
+        Updates from this process are seen right away; jobs run by other
+        processes are polled every poll_interval seconds.
+        """
+
+        last = None
+        while True:
+            updated = self.updated
+            job = await self.broker.get(job_id)
+            if job is None:
+                return
+            state = (job["status"], job["progress"].get("chunks"), job["cancel_requested"])
+            if state != last:
+                last = state
+                yield job
+            if job["status"] in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(updated.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await self.broker.claim(self.worker_id, self.lease)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+
+            if job is None:
+                await self._purge()
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._notify()
+            task = asyncio.create_task(self._run(job))
+            self.running[job["id"]] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    # Shutting down: stop the job but leave it to be resumed
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+            finally:
+                self.running.pop(job["id"], None)
+                self.cancelled.discard(job["id"])
+                self._notify()
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        progress = {"content": "", "chunks": 0}
+        parts: List[str] = []
+        stopping = False
+
+        async def heartbeat() -> None:
+            nonlocal stopping
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                progress["content"] = "".join(parts)
+                progress["chunks"] = len(parts)
+                try:
+                    alive = await self.broker.heartbeat(job_id, self.worker_id, dict(progress), self.lease)
+                except Exception as e:
+                    logger.warning(f"Could not renew lease of job {job_id}: {e}")
+                    continue
+                self._notify()
+                if not alive:
+                    stopping = True
+                    generation.cancel()
+                    return
+
+        async def generate() -> Dict[str, Any]:
+            request = job["request"]
+            messages = [Message(**m) for m in request["messages"]]
+            # An interrupted job runs again from the start, so a partial reply must not be stored
+            result = await self.agent.process_messages(
+                messages, {**request["context"], "stream": True, "store_partial": False}
+            )
+            stream = result["stream"]
+            try:
+                async for chunk in stream:
+                    parts.append(chunk)
+            finally:
+                await stream.aclose()
+            content = "".join(parts)
+            return {
+                "message": Message(role="assistant", content=content).model_dump(mode="json"),
+                "conversation_id": result["conversation_id"],
+                "provider": result["provider"].value,
+                "model": result["model"],
+                # Each streamed chunk is roughly one token
+                "usage": {"completion_tokens": len(parts)}
+            }
+
+        generation = asyncio.create_task(generate())
+        beats = asyncio.create_task(heartbeat())
+        try:
+            result = await generation
+        except AdmissionRejected as e:
+            # The model is busy: try again once it has drained
+            self.stats["retried"] += 1
+            await self.broker.retry(job_id, self.worker_id, e.retry_after)
+            return
+        except asyncio.CancelledError:
+            if stopping or job_id in self.cancelled:
+                self.stats["cancelled"] += 1
+                await self.broker.fail(job_id, self.worker_id, "Cancelled", cancelled=True)
+                return
+            # Shutting down: hand the job back so it runs again after the restart
+            await self.broker.retry(job_id, self.worker_id, 0)
+            raise
+        except Exception as e:
+            logger.warning(f"Job {job_id} failed: {e}")
+            self.stats["failed"] += 1
+            await self.broker.fail(job_id, self.worker_id, str(e))
+            return
+        finally:
+            beats.cancel()
+            if not generation.done():
+                generation.cancel()
+            await asyncio.gather(generation, beats, return_exceptions=True)
+
+        self.stats["succeeded"] += 1
+        await self.broker.complete(job_id, self.worker_id, result, {
+            "content": result["message"]["content"],
+            "chunks": len(parts)
+        })
+
+    async def _purge(self) -> None:
+        # Old finished jobs are cleared at most once a minute
+        now = time.monotonic()
+        if now - self.last_purge < 60:
+            return
+        self.last_purge = now
+        try:
+            purged = await self.broker.purge()
+            if purged:
+                logger.info(f"Purged {purged} finished jobs")
+        except Exception as e:
+            logger.error(f"Error purging jobs: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self.workers),
+            "running": len(self.running),
+            **self.stats
+        }
@@ -1,8 +1,12 @@
-from typing import List, Dict, Any, Optional
-import json
-from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
 from app.models import Message, Role
+from app.config import settings
+from app.storage import ConversationStore
 from .base import ConversationAgent
+from .token_counter import TokenCounter
+from .context_index import ContextIndex
+from .summarizer import ConversationSummarizer
 
 
 class MemoryAgent(ConversationAgent):
@@ -10,19 +14,29 @@ class MemoryAgent(ConversationAgent):
     
     def __init__(self, name: str = "MemoryAgent", config: Optional[Dict[str, Any]] = None):
         super().__init__(name, config)
-        self.conversations = {}
-        self.max_memory_size = config.get("max_memory_size", 100) if config else 100
+        self.store = ConversationStore(
+            config.get("database_url", settings.database_url) if config else settings.database_url,
+            cache_size=settings.conversation_cache_size,
+            flush_interval=settings.conversation_flush_interval,
+            flush_batch_size=settings.conversation_flush_batch_size,
+            validate_cache=settings.conversation_cache_validate
+        )
         self.summarization_threshold = config.get("summarization_threshold", 0.8) if config else 0.8
+        self.token_counter = config.get("token_counter") if config and config.get("token_counter") else TokenCounter()
+        self.max_context_indexes = config.get("max_context_indexes", 1000) if config else 1000
+        self.context_indexes: "OrderedDict[str, ContextIndex]" = OrderedDict()
+        self.summarizer: Optional[ConversationSummarizer] = config.get("summarizer") if config else None
     
     async def initialize(self) -> None:
         """Initialize memory agent"""
-        # Could load persistent conversations from database here
-        pass
+        await self.store.initialize()
     
     async def cleanup(self) -> None:
         """Cleanup resources"""
-        # Could save conversations to database here
-        pass
+        if self.summarizer:
+            await self.summarizer.cleanup()
+        # Flushes any writes still queued
+        await self.store.close()
     
     async def process(self, input_data: Any, context: Optional[Dict[str, Any]] = None) -> Any:
         """Process memory-related operations"""
@@ -41,53 +55,114 @@ class MemoryAgent(ConversationAgent):
     async def manage_context(
         self, 
         messages: List[Message], 
-        max_tokens: int = 4096
+        max_tokens: int = 4096,
+        conversation_id: Optional[str] = None
     ) -> List[Message]:
         """Manage conversation context to fit within token limits"""
         
-        # Estimate tokens (rough approximation: 1 token ≈ 4 characters)
-        total_tokens = sum(len(msg.content) // 4 for msg in messages)
+        index = self._get_context_index(conversation_id, messages)
         
-        if total_tokens <= max_tokens:
-            return messages
+        # Only messages not indexed yet need counting
+        if index.size < len(messages):
+            new_messages = messages[index.size:]
+            counts = await self.token_counter.count_messages(new_messages)
+            index.extend(messages, counts)
         
-        # Keep system message and recent messages
-        system_messages = [msg for msg in messages if msg.role == Role.SYSTEM]
-        other_messages = [msg for msg in messages if msg.role != Role.SYSTEM]
+        # Keep system messages and the longest recent suffix that fits
+        available_tokens = max_tokens - index.system_tokens
         
-        # Calculate how many recent messages we can keep
-        system_tokens = sum(len(msg.content) // 4 for msg in system_messages)
-        available_tokens = max_tokens - system_tokens
+        if index.total_tokens <= max_tokens:
+            # Nearing the limit: summarize what would be dropped ahead of time
+            if index.total_tokens > max_tokens * self.summarization_threshold:
+                cut = index.cut_point(available_tokens * self.summarization_threshold)
+                self._schedule_summary(conversation_id, messages, index, cut)
+            return messages
         
-        # Keep messages from the end until we hit the limit
-        kept_messages = []
-        current_tokens = 0
+        cut = index.cut_point(available_tokens * self.summarization_threshold)
         
-        for msg in reversed(other_messages):
-            msg_tokens = len(msg.content) // 4
-            if current_tokens + msg_tokens <= available_tokens * self.summarization_threshold:
-                kept_messages.insert(0, msg)
-                current_tokens += msg_tokens
-            else:
-                break
+        system_messages = [messages[i] for i in index.system_positions]
         
         # If we had to truncate, add a summary message
-        if len(kept_messages) < len(other_messages):
-            summary = await self._create_summary(
-                other_messages[:len(other_messages) - len(kept_messages)]
-            )
-            if summary:
-                kept_messages.insert(0, summary)
+        start, summary = cut, None
+        if cut > 0:
+            self._schedule_summary(conversation_id, messages, index, cut)
+            start, summary = await self._create_summary(conversation_id, index, cut, available_tokens)
+        
+        kept_messages = [messages[i] for i in index.other_positions[start:]]
+        if summary:
+            kept_messages.insert(0, summary)
         
         return system_messages + kept_messages
     
-    async def _create_summary(self, messages: List[Message]) -> Optional[Message]:
-        """Create a summary of truncated messages"""
+    def _schedule_summary(
+        self,
+        conversation_id: Optional[str],
+        messages: List[Message],
+        index: ContextIndex,
+        cut: int
+    ) -> None:
+        """Kick off background summarization of the messages before cut"""
+        
+        if not self.summarizer or not conversation_id or cut <= 0:
+            return
+        
+        positions = index.other_positions
+        self.summarizer.schedule(
+            conversation_id,
+            cut,
+            index.prefix_hashes,
+            lambda start, end: [messages[i] for i in positions[start:end]]
+        )
+    
+    def _get_context_index(
+        self,
+        conversation_id: Optional[str],
+        messages: List[Message]
+    ) -> ContextIndex:
+        """Get the conversation's token index, rebuilding it if history diverged"""
+        
+        if not conversation_id:
+            return ContextIndex()
+        
+        index = self.context_indexes.get(conversation_id)
+        if index is None or not index.matches(messages):
+            index = ContextIndex()
+            self.context_indexes[conversation_id] = index
         
-        # Simple summary implementation
-        num_messages = len(messages)
-        user_messages = len([m for m in messages if m.role == Role.USER])
-        assistant_messages = len([m for m in messages if m.role == Role.ASSISTANT])
+        self.context_indexes.move_to_end(conversation_id)
+        while len(self.context_indexes) > self.max_context_indexes:
+            self.context_indexes.popitem(last=False)
+        
+        return index
+    
+    async def _create_summary(
+        self,
+        conversation_id: Optional[str],
+        index: ContextIndex,
+        cut: int,
+        available_tokens: int
+    ) -> Tuple[int, Optional[Message]]:
+        """Create a summary of truncated messages
+        
+        Returns the position of the first message to keep after the summary,
+        which is before cut when a background summary ends there.
+        """
+        
+        # Use the latest background summary if one is ready and the messages
+        # after it still fit, so nothing is dropped unsummarized
+        if self.summarizer and conversation_id:
+            earliest = index.cut_point(available_tokens)
+            cached = self.summarizer.get(conversation_id, cut, index.prefix_hashes, earliest)
+            if cached:
+                end, content = cached
+                return end, Message(
+                    role=Role.SYSTEM,
+                    content=f"[Summary of the first {end} messages of this conversation]\n{content}"
+                )
+        
+        # Otherwise fall back to a simple placeholder
+        num_messages, user_messages = index.dropped_counts(cut)
+        assistant_messages = num_messages - user_messages
         
         summary_content = (
             f"[Previous conversation summary: {num_messages} messages "
@@ -95,7 +170,7 @@ class MemoryAgent(ConversationAgent):
             f"The conversation covered various topics that have been truncated to fit context limits.]"
         )
         
-        return Message(
+        return cut, Message(
             role=Role.SYSTEM,
             content=summary_content
         )
@@ -105,31 +180,28 @@ class MemoryAgent(ConversationAgent):
         conversation_id: str, 
         messages: List[Message]
     ) -> None:
-        """Store conversation in memory"""
+        """Append new messages to a stored conversation"""
         
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = deque(maxlen=self.max_memory_size)
-        
-        # Store messages
-        for message in messages:
-            if message not in self.conversations[conversation_id]:
-                self.conversations[conversation_id].append(message)
+        await self.store.append_messages(conversation_id, messages)
     
     async def get_conversation(
         self, 
         conversation_id: str
     ) -> Optional[List[Message]]:
-        """Retrieve conversation from memory"""
+        """Retrieve conversation messages from storage"""
         
-        if conversation_id in self.conversations:
-            return list(self.conversations[conversation_id])
+        conversation = await self.store.get(conversation_id)
+        if conversation is not None:
+            return list(conversation["messages"])
         return None
     
-    async def clear_conversation(self, conversation_id: str) -> None:
-        """Clear a specific conversation from memory"""
+    async def clear_conversation(self, conversation_id: str) -> bool:
+        """Delete a conversation and drop its cached context"""
         
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
+        self.context_indexes.pop(conversation_id, None)
+        if self.summarizer:
+            self.summarizer.forget(conversation_id)
+        return await self.store.delete(conversation_id)
     
     async def get_conversation_summary(
         self, 
@@ -137,32 +209,25 @@ class MemoryAgent(ConversationAgent):
     ) -> Optional[Dict[str, Any]]:
         """Get summary statistics for a conversation"""
         
-        if conversation_id not in self.conversations:
+        messages = await self.get_conversation(conversation_id)
+        if messages is None:
             return None
         
-        messages = self.conversations[conversation_id]
-        
         return {
             "conversation_id": conversation_id,
             "total_messages": len(messages),
             "user_messages": len([m for m in messages if m.role == Role.USER]),
             "assistant_messages": len([m for m in messages if m.role == Role.ASSISTANT]),
             "system_messages": len([m for m in messages if m.role == Role.SYSTEM]),
-            "estimated_tokens": sum(len(m.content) // 4 for m in messages)
+            "estimated_tokens": sum(await self.token_counter.count_messages(messages))
         }
     
     def get_memory_usage(self) -> Dict[str, Any]:
         """Get current memory usage statistics"""
         
-        total_conversations = len(self.conversations)
-        total_messages = sum(len(msgs) for msgs in self.conversations.values())
-        
         return {
-            "total_conversations": total_conversations,
-            "total_messages": total_messages,
-            "max_memory_size": self.max_memory_size,
-            "conversations": {
-                conv_id: len(msgs) 
-                for conv_id, msgs in self.conversations.items()
-            }
-        }
\ No newline at end of file
+            "store": self.store.get_stats(),
+            "context_indexes": len(self.context_indexes),
+            "token_counter": self.token_counter.get_stats(),
+            "summarizer": self.summarizer.get_stats() if self.summarizer else None
+        }
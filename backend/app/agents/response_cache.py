@@ -0,0 +1,149 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+
+class ResponseCache:
+    """Size-bounded LRU + TTL cache of chat completions
+
+    Entries hold the full content plus the streamed chunks so a cached
+    stream can be replayed chunk for chunk. An optional SQLite file keeps
+    entries across restarts; the in-memory LRU sits in front of it.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_accessed "
+                "ON response_cache (accessed_at)"
+            )
+            self.db.commit()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached response, or None if missing or expired"""
+
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+
+        if self.db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                expires_at, value = row
+                self._remember(key, expires_at, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Cache a response"""
+
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, value)
+
+        if self.db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self.db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+        return row[1], json.loads(row[0])
+
+    def _disk_set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        now = time.time()
+        with self.db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+            )
+            self.db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            # Keep only the most recently used max_entries rows
+            self.db.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    async def record_stream(
+        self,
+        key: str,
+        generator: AsyncGenerator[str, None]
+    ) -> AsyncGenerator[str, None]:
+        """Pass a stream through, caching it if it completes"""
+
+        chunks: List[str] = []
+        async for chunk in generator:
+            chunks.append(chunk)
+            yield chunk
+
+        await self.set(key, {"content": "".join(chunks), "chunks": chunks, "usage": None})
+
+    async def replay_stream(self, value: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """Replay a cached response as a stream"""
+
+        for chunk in value.get("chunks") or [value["content"]]:
+            yield chunk
+
+    def close(self) -> None:
+        with self.db_lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "persistent": self.db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,158 @@
+import asyncio
+import uuid
+import logging
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncGenerator, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StreamGone(Exception):
+    """The stream is unknown, or the requested events left its replay buffer"""
+    pass
+
+
+class ResumableStream:
+    """A generation that runs in the background and can be re-attached to
+
+    Events from the source are numbered from 1 and the latest buffer_size of
+    them are kept, so a client that reconnects with the last id it saw gets
+    everything after it, then follows the live generation.
+    """
+
+    def __init__(self, stream_id: str, source: AsyncGenerator[bytes, None], buffer_size: int):
+        self.id = stream_id
+        self.events: Deque[Tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self.last_id = 0
+        self.done = False
+        self.subscribers = 0
+        self.idle_since = asyncio.get_running_loop().time()
+        self.updated = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncGenerator[bytes, None]) -> None:
+        try:
+            async for payload in source:
+                self.last_id += 1
+                self.events.append((self.last_id, payload))
+                self._notify()
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def can_resume(self, after: int) -> bool:
+        """Whether every event after `after` is still buffered"""
+        if after >= self.last_id:
+            return True
+        return bool(self.events) and self.events[0][0] <= after + 1
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """Yield (event id, payload) for events after `after`, live until done"""
+
+        self.subscribers += 1
+        position = after
+        try:
+            while True:
+                updated = self.updated
+                if self.events and position < self.last_id:
+                    first_id = self.events[0][0]
+                    if position + 1 < first_id:
+                        # This reader fell further behind than the buffer holds
+                        raise StreamGone(f"Reader fell behind stream {self.id}")
+                    for event in list(islice(self.events, position + 1 - first_id, None)):
+                        yield event
+                        position = event[0]
+                    continue
+
+                if self.done:
+                    return
+                await updated.wait()
+        finally:
+            self.subscribers -= 1
+            self.idle_since = asyncio.get_running_loop().time()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+
+class StreamRegistry:
+    """Resumable streams by id, with eviction of abandoned ones
+
+    A stream nobody is reading is kept for idle_timeout seconds so the
+    client can reconnect; after that it's dropped and, if it's still
+    generating, cancelled.
+    """
+
+    def __init__(self, buffer_size: int = 1024, idle_timeout: float = 30.0):
+        self.buffer_size = buffer_size
+        self.idle_timeout = idle_timeout
+        self.streams: Dict[str, ResumableStream] = {}
+        self.sweeper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.resumes = 0
+        self.abandoned = 0
+
+    def create(self, source: AsyncGenerator[bytes, None]) -> ResumableStream:
+        """Start running source in the background under a new stream id"""
+
+        stream = ResumableStream(uuid.uuid4().hex, source, self.buffer_size)
+        self.streams[stream.id] = stream
+        self.created += 1
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.create_task(self._sweep())
+        return stream
+
+    def attach(self, stream_id: str, after: int = 0) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """Follow a stream from the event after `after`
+
+        Raises StreamGone when the stream expired or those events were
+        already dropped from its buffer.
+        """
+
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            raise StreamGone(f"Stream {stream_id} not found or expired")
+        if not stream.can_resume(after):
+            raise StreamGone(f"Events after {after} of stream {stream_id} are no longer available")
+        if after:
+            self.resumes += 1
+        return stream.subscribe(after)
+
+    async def _sweep(self) -> None:
+        interval = max(self.idle_timeout / 2, 0.1)
+        while self.streams:
+            await asyncio.sleep(interval)
+            now = asyncio.get_running_loop().time()
+            for stream_id, stream in list(self.streams.items()):
+                if stream.subscribers or now - stream.idle_since < self.idle_timeout:
+                    continue
+                if not stream.done:
+                    self.abandoned += 1
+                    logger.info(f"Cancelling abandoned stream {stream_id}")
+                    stream.cancel()
+                del self.streams[stream_id]
+
+    async def close(self) -> None:
+        """Cancel every stream still running"""
+
+        if self.sweeper:
+            self.sweeper.cancel()
+        for stream in self.streams.values():
+            stream.cancel()
+        await asyncio.gather(*(s.task for s in self.streams.values()), return_exceptions=True)
+        self.streams.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active": sum(1 for s in self.streams.values() if not s.done),
+            "buffered": len(self.streams),
+            "detached": sum(1 for s in self.streams.values() if not s.subscribers),
+            "resumes": self.resumes,
+            "created": self.created,
+            "abandoned": self.abandoned
+        }
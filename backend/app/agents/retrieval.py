@@ -0,0 +1,251 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+import logging
+from typing import Any, Dict, List, Optional
+from app.models import Message, Role
+from app.storage import FileStore
+from app.storage.vectors import VectorIndex
+from .token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+
+class Retriever:
+    """Finds the passages of uploaded documents most relevant to a question
+
+    Once a document is ingested its chunks are embedded with the provider's
+    embedding model and appended to a VectorIndex, keyed by chunk id. A
+    question is embedded the same way and matched against every chunk (or
+    only those of the files a request names); the chunk text is read back
+    from the file store, so chunks of deleted documents simply stop matching.
+
+    Every worker embeds documents, but each one is claimed in the file store
+    first, so only one worker adds a document's chunks to the shared index.
+    A claim is renewed after each batch and runs out after lease seconds if
+    its worker stops; every lease seconds each worker looks for documents
+    nobody embedded.
+    """
+
+    def __init__(
+        self,
+        store: FileStore,
+        index: VectorIndex,
+        provider: Any,
+        model: str,
+        batch_size: int = 32,
+        top_k: int = 8,
+        min_score: float = 0.0,
+        token_counter: Optional[TokenCounter] = None,
+        lease: float = 120.0
+    ):
+        self.store = store
+        self.index = index
+        self.provider = provider
+        self.model = model
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.min_score = min_score
+        self.token_counter = token_counter or TokenCounter()
+        self.lease = lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.sweeper: Optional[asyncio.Task] = None
+        self.stats = {"embedded": 0, "chunks": 0, "failed": 0, "skipped": 0, "searches": 0, "search_errors": 0}
+
+    async def start(self) -> None:
+        """Open the index and embed documents ingested while retrieval was off"""
+
+        await asyncio.to_thread(self.index.open)
+        # Vectors from another model aren't comparable, so those are dropped
+        if await asyncio.to_thread(self.index.use_model, self.model):
+            await self.store.clear_embeddings()
+        self.sweeper = asyncio.create_task(self._sweep())
+
+    async def close(self) -> None:
+        if self.sweeper:
+            self.sweeper.cancel()
+            await asyncio.gather(self.sweeper, return_exceptions=True)
+            self.sweeper = None
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        await asyncio.to_thread(self.index.close)
+
+    async def _sweep(self) -> None:
+        # Documents ingested while retrieval was off, or whose worker stopped
+        while True:
+            try:
+                for digest in await self.store.unembedded_documents(self.model):
+                    self.submit(digest)
+            except Exception as e:
+                logger.error(f"Error looking for documents to embed: {e}")
+            await asyncio.sleep(self.lease)
+
+    def submit(self, digest: str) -> None:
+        """Embed a ready document's chunks in the background"""
+
+        if digest not in self.tasks:
+            task = asyncio.create_task(self._embed_document(digest))
+            self.tasks[digest] = task
+            task.add_done_callback(lambda _: self.tasks.pop(digest, None))
+
+    async def _embed_document(self, digest: str) -> None:
+        started = time.perf_counter()
+        count = 0
+        try:
+            if not await self.store.claim_embedding(digest, self.model, self.worker_id, self.lease):
+                # Embedded already, or another worker is on it
+                return
+
+            # A previous attempt may have stopped halfway
+            ids = [chunk["id"] for chunk in await self.store.get_chunks(digest)]
+            await asyncio.to_thread(self.index.remove, ids)
+
+            while True:
+                chunks = await self.store.get_chunks(digest, offset=count, limit=self.batch_size)
+                if not chunks:
+                    break
+                vectors = await self.provider.embed([chunk["content"] for chunk in chunks], self.model)
+                if not await self.store.renew_embedding(digest, self.worker_id, self.lease):
+                    # The claim ran out and another worker took the document over
+                    self.stats["skipped"] += 1
+                    return
+                await asyncio.to_thread(
+                    self.index.add, [chunk["id"] for chunk in chunks], vectors, self.model
+                )
+                count += len(chunks)
+            if not await self.store.mark_embedded(digest, self.worker_id, count):
+                self.stats["skipped"] += 1
+                return
+        except asyncio.CancelledError:
+            # Not marked embedded, so it's redone by the next sweep
+            await self._release(digest)
+            raise
+        except Exception as e:
+            logger.warning(f"Embedding document {digest[:12]} failed: {e}")
+            self.stats["failed"] += 1
+            await self._release(digest)
+            return
+
+        self.stats["embedded"] += 1
+        self.stats["chunks"] += count
+        logger.info(f"Embedded {count} chunks of {digest[:12]} in {time.perf_counter() - started:.2f}s")
+
+    async def _release(self, digest: str) -> None:
+        try:
+            await self.store.release_embedding(digest, self.worker_id)
+        except Exception as e:
+            # The claim runs out by itself
+            logger.warning(f"Could not release embedding claim on {digest[:12]}: {e}")
+
+    async def search(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        file_ids: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """The chunks closest to query, best first, each with its score"""
+
+        within = await self.store.chunk_ids(file_ids) if file_ids is not None else None
+        if within is not None and not within:
+            return []
+
+        self.stats["searches"] += 1
+        [vector] = await self.provider.embed([query], self.model)
+        [matches] = await asyncio.to_thread(self.index.search, [vector], k or self.top_k, within)
+        matches = [(chunk_id, score) for chunk_id, score in matches if score >= self.min_score]
+
+        chunks = await self.store.get_chunks_by_id([chunk_id for chunk_id, _ in matches])
+        if len(chunks) < len(matches):
+            # Chunks of deleted or re-ingested documents
+            stale = [chunk_id for chunk_id, _ in matches if chunk_id not in chunks]
+            await asyncio.to_thread(self.index.remove, stale)
+        return [
+            {**chunks[chunk_id], "score": score}
+            for chunk_id, score in matches if chunk_id in chunks
+        ]
+
+    async def context_message(
+        self,
+        messages: List[Message],
+        token_budget: int,
+        file_ids: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Excerpts relevant to the last user message, packed into token_budget
+
+        Returns the excerpts as a user message to put in place of the last
+        one, with the chunks used and the tokens the message adds to the
+        question it replaces, or None if nothing relevant fits. Failures only
+        skip retrieval, they never fail the chat.
+        """
+
+        question = next((m for m in reversed(messages) if m.role == Role.USER), None)
+        if question is None or token_budget <= 0:
+            return None
+        try:
+            chunks = await self.search(question.content, file_ids=file_ids)
+        except Exception as e:
+            logger.warning(f"Retrieval failed, answering without documents: {e}")
+            self.stats["search_errors"] += 1
+            return None
+
+        # The framing and the repeated question take part of the budget
+        question_tokens = await self.token_counter.count_message(question)
+        framing = question.model_copy(update={"content": context_content(question, [])})
+        tokens = await self.token_counter.count_message(framing) - question_tokens
+        used = []
+        for chunk in chunks:
+            if tokens + chunk["tokens"] > token_budget:
+                continue
+            used.append(chunk)
+            tokens += chunk["tokens"]
+
+        # Counted as sent, since the question's own tokens are already in the
+        # context; excerpt headings can push it over, so the weakest go first
+        while used:
+            message = question.model_copy(update={"content": context_content(question, used)})
+            tokens = await self.token_counter.count_message(message) - question_tokens
+            if tokens <= token_budget:
+                break
+            used.pop()
+        if not used:
+            return None
+
+        return {
+            "question": question,
+            "message": message,
+            "tokens": tokens,
+            "sources": [
+                {key: chunk[key] for key in ("id", "filename", "section", "score")}
+                for chunk in used
+            ]
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "embedding": len(self.tasks),
+            "index": await asyncio.to_thread(self.index.get_stats),
+            **self.stats
+        }
+
+
+def context_content(question: Message, chunks: List[Dict[str, Any]]) -> str:
+    """The question with numbered excerpts to answer it from"""
+
+    excerpts = "\n\n".join(
+        f"[{number}] {chunk['filename']}" + (f" ({chunk['section']})" if chunk["section"] else "")
+        + f"\n{chunk['content']}"
+        for number, chunk in enumerate(chunks, start=1)
+    )
+    return (
+        "Excerpts from the user's documents:\n\n"
+        f"{excerpts}\n\n"
+        "Answer from these excerpts where they are relevant and cite them by number. "
+        "If they do not contain the answer, say so.\n\n"
+        f"Question: {question.content}"
+    )
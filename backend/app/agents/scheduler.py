@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class AdmissionRejected(Exception):
+    """Raised when a generation can't be admitted; maps to 503 + Retry-After"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Permit:
+    """A granted generation slot; releasing it more than once is a no-op"""
+
+    def __init__(self, scheduler: "AdmissionScheduler", key: Tuple[str, str]):
+        self.scheduler = scheduler
+        self.key = key
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self.key)
+
+
+class Lane:
+    """Concurrency cap and wait queue for one (provider, model)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # Heap of (-priority, deadline, sequence, future)
+        self.waiters: List[Tuple[int, float, int, asyncio.Future]] = []
+        self.abandoned = 0  # entries of waiters that gave up, still in the heap
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def queued(self) -> int:
+        return len(self.waiters) - self.abandoned
+
+    def abandon(self, future: asyncio.Future) -> None:
+        """Drop a waiter that gave up
+
+        Its heap entry is skipped when popped; once most entries are dead
+        the heap is rebuilt, so a stalled lane doesn't keep every rejected
+        request's entry.
+        """
+        future.cancel()
+        self.abandoned += 1
+        if self.abandoned * 2 > len(self.waiters):
+            self.waiters = [w for w in self.waiters if not w[3].done()]
+            heapq.heapify(self.waiters)
+            self.abandoned = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued(),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2)
+        }
+
+
+class AdmissionScheduler:
+    """Caps concurrent generations per (provider, model)
+
+    Requests over the cap wait in a bounded queue ordered by priority (higher
+    first) and then by deadline (earliest first). A full queue or a missed
+    deadline fails fast with AdmissionRejected instead of piling onto the
+    upstream server.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        queue_timeout: float = 30.0,
+        retry_after: int = 5,
+        limits: Optional[Dict[str, int]] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.limits = limits or {}
+        self.lanes: Dict[Tuple[str, str], Lane] = {}
+        self.sequence = itertools.count()
+
+    def _lane(self, key: Tuple[str, str]) -> Lane:
+        lane = self.lanes.get(key)
+        if lane is None:
+            # Overrides are keyed "provider:model" or just "provider"
+            limit = self.limits.get(f"{key[0]}:{key[1]}", self.limits.get(key[0], self.max_concurrency))
+            lane = self.lanes[key] = Lane(limit)
+        return lane
+
+    async def acquire(
+        self,
+        provider: str,
+        model: str,
+        priority: int = 0,
+        timeout: Optional[float] = None
+    ) -> Permit:
+        """Wait for a generation slot, or raise AdmissionRejected"""
+
+        key = (provider, model)
+        lane = self._lane(key)
+
+        if lane.active < lane.limit and not lane.queued():
+            lane.active += 1
+            lane.admitted += 1
+            return Permit(self, key)
+
+        if lane.queued() >= self.max_queue:
+            lane.rejected += 1
+            raise AdmissionRejected(
+                f"Too many concurrent requests for {provider}/{model}",
+                self.retry_after
+            )
+
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.waiters, (-priority, started + timeout, next(self.sequence), future))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted just as we timed out; give the slot back
+                self.release(key)
+            else:
+                lane.abandon(future)
+            lane.timed_out += 1
+            raise AdmissionRejected(
+                f"Timed out waiting for {provider}/{model}",
+                self.retry_after
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(key)
+            else:
+                lane.abandon(future)
+            raise
+
+        waited = time.monotonic() - started
+        lane.admitted += 1
+        lane.total_wait += waited
+        lane.max_wait = max(lane.max_wait, waited)
+        return Permit(self, key)
+
+    def release(self, key: Tuple[str, str]) -> None:
+        """Free a slot, handing it straight to the next live waiter"""
+
+        lane = self.lanes[key]
+        while lane.waiters:
+            future = heapq.heappop(lane.waiters)[3]
+            if future.done():
+                lane.abandoned -= 1
+                continue
+            # The slot passes to the waiter, so active stays the same
+            future.set_result(None)
+            return
+        lane.active -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            f"{provider}:{model}": lane.stats()
+            for (provider, model), lane in self.lanes.items()
+        }
@@ -0,0 +1,88 @@
+import asyncio
+from typing import AsyncGenerator, List, Optional
+
+
+async def coalesce_chunks(
+    stream: AsyncGenerator[str, None],
+    interval: float,
+    max_bytes: int
+) -> AsyncGenerator[str, None]:
+    """Merge small chunks so each yielded piece covers up to `interval` seconds
+
+    The first chunk is passed through immediately to keep time to first
+    token low. After that, buffered text is yielded when `interval` seconds
+    have passed since the first unflushed chunk or when it reaches
+    `max_bytes` (UTF-8) bytes, whichever happens first. The upstream stream
+    is read by a separate task, so a consumer that is briefly slow doesn't
+    hold up generation; its text is just merged into fewer, larger pieces.
+    Once `max_bytes` are waiting, reading stops until the consumer takes
+    them, so a stalled client doesn't buffer a whole generation.
+    """
+
+    if interval <= 0:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        return
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    drained = asyncio.Event()
+    buffer: List[str] = []
+    state = {"size": 0, "first": True, "done": False, "error": None}
+    timer: Optional[asyncio.TimerHandle] = None
+
+    async def pump() -> None:
+        nonlocal timer
+        try:
+            async for chunk in stream:
+                buffer.append(chunk)
+                state["size"] += len(chunk.encode())
+                if state["first"] or state["size"] >= max_bytes:
+                    state["first"] = False
+                    ready.set()
+                    if state["size"] >= max_bytes:
+                        # Backpressure: wait for the consumer to take it
+                        drained.clear()
+                        await drained.wait()
+                elif timer is None:
+                    timer = loop.call_later(interval, ready.set)
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["done"] = True
+            ready.set()
+
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if timer is not None:
+                timer.cancel()
+                timer = None
+
+            if buffer:
+                text = "".join(buffer)
+                buffer.clear()
+                state["size"] = 0
+                drained.set()
+                yield text
+
+            if state["done"] and not buffer:
+                break
+
+        if state["error"] is not None:
+            raise state["error"]
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if not reader.done():
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+        await stream.aclose()
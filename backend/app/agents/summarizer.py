@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.models import Message, Role
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the existing summary with the new messages. Keep names, facts, decisions, "
+    "open questions and any legal references. Reply with the updated summary only, "
+    "in the language(s) the conversation uses, in at most a few short paragraphs."
+)
+
+
+class ConversationSummarizer:
+    """Summarizes the older part of long conversations in the background
+
+    A conversation's summary covers its first `end` non-system messages and
+    is stored with the rolling hash of those messages, so it is only reused
+    while the history still starts with them; an edited or replaced history
+    starts over. It is refreshed once the trimmed range moves on by at least
+    min_new_messages, folding the newly dropped messages into the previous
+    summary. Nothing here is ever awaited on a request.
+
+    prefix_hashes[n] is the rolling hash of a history's first n non-system
+    messages (see ContextIndex).
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[List[Message]], Awaitable[str]],
+        min_new_messages: int = 6,
+        max_input_chars: int = 12000,
+        max_conversations: int = 1000
+    ):
+        self.generate = generate
+        self.min_new_messages = min_new_messages
+        self.max_input_chars = max_input_chars
+        self.max_conversations = max_conversations
+        self.summaries: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.generated = 0
+        self.failed = 0
+        self.reused = 0
+
+    def get(
+        self,
+        conversation_id: str,
+        cut: int,
+        prefix_hashes: List[int],
+        earliest: int = 0
+    ) -> Optional[Tuple[int, str]]:
+        """Latest (end, summary) of this history with earliest <= end <= cut
+
+        The caller keeps every message from end on, so none are dropped
+        without being summarized; earliest is as far back as it can afford.
+        """
+
+        entry = self._matching(conversation_id, cut, prefix_hashes)
+        if entry is None or entry[0] < earliest:
+            return None
+        self.summaries.move_to_end(conversation_id)
+        self.reused += 1
+        return entry
+
+    def schedule(
+        self,
+        conversation_id: str,
+        cut: int,
+        prefix_hashes: List[int],
+        segment: Callable[[int, int], List[Message]]
+    ) -> None:
+        """Start summarizing messages [0, cut) unless a usable summary exists
+
+        segment(start, end) returns the non-system messages in that range.
+        """
+
+        task = self.tasks.get(conversation_id)
+        if task is not None and not task.done():
+            return
+
+        entry = self._matching(conversation_id, cut, prefix_hashes)
+        if entry is not None:
+            start, previous = entry
+            if cut - start < self.min_new_messages:
+                return
+        else:
+            # No summary yet, or history was rewritten behind it
+            start, previous = 0, None
+
+        if cut <= start:
+            return
+
+        messages = segment(start, cut)
+        self.tasks[conversation_id] = asyncio.create_task(
+            self._summarize(conversation_id, previous, messages, cut, prefix_hashes[cut])
+        )
+
+    def forget(self, conversation_id: str) -> None:
+        """Drop a conversation's summary and stop any summary in progress"""
+
+        self.summaries.pop(conversation_id, None)
+        task = self.tasks.pop(conversation_id, None)
+        if task is not None:
+            task.cancel()
+
+    def _matching(self, conversation_id: str, cut: int, prefix_hashes: List[int]) -> Optional[Tuple[int, str]]:
+        """The cached (end, summary) if it covers a prefix of this history"""
+
+        entry = self.summaries.get(conversation_id)
+        if entry is None:
+            return None
+        end, digest, summary = entry
+        if end > cut or prefix_hashes[end] != digest:
+            return None
+        return end, summary
+
+    async def _summarize(
+        self,
+        conversation_id: str,
+        previous: Optional[str],
+        messages: List[Message],
+        end: int,
+        digest: int
+    ) -> None:
+        try:
+            summary = previous
+            for batch in self._batches(messages):
+                summary = await self._fold(summary, batch)
+
+            self.summaries[conversation_id] = (end, digest, summary)
+            self.summaries.move_to_end(conversation_id)
+            while len(self.summaries) > self.max_conversations:
+                self.summaries.popitem(last=False)
+            self.generated += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Summarization failed for conversation {conversation_id}: {e}")
+        finally:
+            # A forgotten conversation may already have a newer task
+            if self.tasks.get(conversation_id) is asyncio.current_task():
+                del self.tasks[conversation_id]
+
+    def _batches(self, messages: List[Message]) -> List[List[Message]]:
+        """Split messages so each model call stays within max_input_chars"""
+
+        batches, batch, size = [], [], 0
+        for msg in messages:
+            if batch and size + len(msg.content) > self.max_input_chars:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(msg)
+            size += len(msg.content)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _fold(self, previous: Optional[str], messages: List[Message]) -> str:
+        """Fold a batch of messages into the running summary"""
+
+        transcript = "\n\n".join(
+            f"{msg.role.upper()}: {msg.content[:self.max_input_chars]}" for msg in messages
+        )
+        prompt = (
+            f"Existing summary:\n{previous or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        summary = await self.generate([
+            Message(role=Role.SYSTEM, content=SUMMARY_INSTRUCTIONS),
+            Message(role=Role.USER, content=prompt)
+        ])
+        return summary.strip()
+
+    async def cleanup(self) -> None:
+        """Cancel summaries still in progress"""
+        for task in list(self.tasks.values()):
+            task.cancel()
+        self.tasks.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "cached_summaries": len(self.summaries),
+            "in_progress": len(self.tasks),
+            "generated": self.generated,
+            "failed": self.failed,
+            "reused": self.reused
+        }
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from app.models import Message
+from app.providers import http_pools
+
+logger = logging.getLogger(__name__)
+
+# Approximate tokens per character for scripts that BPE vocabularies
+# trained mostly on English split much more finely than Latin text
+SCRIPT_RATIOS = [
+    (0x0B80, 0x0BFF, 1.0),    # Tamil
+    (0x0900, 0x0DFF, 0.8),    # Other Indic scripts
+    (0x0400, 0x052F, 0.4),    # Cyrillic
+    (0x0600, 0x06FF, 0.5),    # Arabic
+    (0x3040, 0x30FF, 1.0),    # Japanese kana
+    (0x4E00, 0x9FFF, 1.2),    # CJK ideographs
+    (0xAC00, 0xD7AF, 1.0),    # Hangul
+]
+LATIN_RATIO = 0.25            # ~4 characters per token
+MESSAGE_OVERHEAD = 4          # role and chat template tokens per message
+
+
+class HeuristicTokenCounter:
+    """Local token estimate weighted by the script of each character"""
+
+    def count(self, text: str) -> int:
+        if text.isascii():
+            return int(len(text) * LATIN_RATIO + 0.5)
+        
+        total = 0.0
+        for char in text:
+            code = ord(char)
+            if code < 0x0250:
+                total += LATIN_RATIO
+                continue
+            for start, end, ratio in SCRIPT_RATIOS:
+                if start <= code <= end:
+                    total += ratio
+                    break
+            else:
+                total += 0.5
+        return int(total + 0.5)
+
+
+class LlamaCppTokenCounter:
+    """Exact counts from llama.cpp's /tokenize endpoint"""
+
+    def __init__(self, base_url: str, max_concurrency: int = 8):
+        self.base_url = base_url
+        self.client = http_pools.acquire(base_url)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def count(self, text: str) -> int:
+        async with self.semaphore:
+            response = await self.client.post(
+                f"{self.base_url}/tokenize",
+                json={"content": text, "add_special": False}
+            )
+        response.raise_for_status()
+        return len(response.json()["tokens"])
+
+
+class TokenCounter:
+    """Counts message tokens once per distinct content
+
+    Counts come from the configured backend (llama.cpp /tokenize) when one is
+    set, falling back to the script-aware heuristic if it fails. Results are
+    cached by content hash so each message is only counted once.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[LlamaCppTokenCounter] = None,
+        cache_size: int = 50000,
+        retry_interval: float = 30.0
+    ):
+        self.backend = backend
+        self.retry_interval = retry_interval
+        self.backend_retry_at = 0.0
+        self.heuristic = HeuristicTokenCounter()
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _store(self, key: str, count: int) -> None:
+        self.cache[key] = count
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _cached(self, key: str) -> Optional[int]:
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        return cached
+
+    async def _count_uncached(self, key: str, text: str) -> int:
+        self.misses += 1
+
+        if self.backend is not None and time.monotonic() >= self.backend_retry_at:
+            try:
+                count = await self.backend.count(text)
+                self._store(key, count)
+                return count
+            except Exception as e:
+                # Don't hit a dead tokenizer on every request; retry later
+                self.fallbacks += 1
+                if time.monotonic() >= self.backend_retry_at:
+                    self.backend_retry_at = time.monotonic() + self.retry_interval
+                    logger.warning(f"Tokenizer unavailable, using heuristic counts: {e}")
+
+        return self._estimate(key, text)
+
+    def _estimate(self, key: str, text: str) -> int:
+        count = self.heuristic.count(text)
+        if self.backend is None:
+            # Estimates are only cached when there is no exact count to wait for
+            self._store(key, count)
+        return count
+
+    async def count_text(self, text: str) -> int:
+        """Count tokens in a piece of text"""
+
+        key = self._key(text)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        return await self._count_uncached(key, text)
+
+    async def count_message(self, message: Message) -> int:
+        """Count tokens in a message, including chat template overhead"""
+        return await self.count_text(message.content) + MESSAGE_OVERHEAD
+
+    async def count_messages(self, messages: List[Message]) -> List[int]:
+        """Count tokens for each message, tokenizing uncached ones concurrently"""
+
+        use_backend = self.backend is not None and time.monotonic() >= self.backend_retry_at
+        counts: List[Optional[int]] = []
+        missing = []
+        for index, msg in enumerate(messages):
+            text = msg.content
+            if not use_backend and text.isascii():
+                # Estimating ASCII text is cheaper than hashing it
+                counts.append(self.heuristic.count(text))
+                continue
+            key = self._key(text)
+            cached = self._cached(key)
+            counts.append(cached)
+            if cached is None:
+                missing.append((index, key, text))
+
+        if missing:
+            if use_backend:
+                results = await asyncio.gather(
+                    *(self._count_uncached(key, text) for _, key, text in missing)
+                )
+            else:
+                self.misses += len(missing)
+                results = [self._estimate(key, text) for _, key, text in missing]
+            for (index, _, _), count in zip(missing, results):
+                counts[index] = count
+
+        return [count + MESSAGE_OVERHEAD for count in counts]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "cached_counts": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks
+        }
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -22,12 +22,90 @@ class Settings(BaseSettings):
     llamacpp_base_url: str = Field(default="http://localhost:1234")
     llamacpp_model_path: str = Field(default="./models/")
     llamacpp_default_model: str = Field(default="mistral-7b-instruct")
+    # Multiple llama.cpp servers; when set, requests are load balanced across them
+    llamacpp_base_urls: List[str] = Field(default=[])
+    llamacpp_balance_strategy: str = Field(default="least_requests")  # or "least_tokens"
+    llamacpp_health_check_interval: float = Field(default=10.0)
+    # Prompt (KV) cache reuse; slots should match llama-server --parallel
+    llamacpp_cache_prompt: bool = Field(default=True)
+    llamacpp_slots: int = Field(default=4)
+    llamacpp_slot_wait_timeout: float = Field(default=5.0)  # then sent unpinned, for the server to place
+    
+    # HTTP Connection Pool (shared by providers, per upstream)
+    http_max_connections: int = Field(default=100)
+    http_max_keepalive_connections: int = Field(default=20)
+    http_keepalive_expiry: float = Field(default=30.0)
+    http_connect_timeout: float = Field(default=5.0)
+    http_read_timeout: float = Field(default=120.0)
+    http_write_timeout: float = Field(default=30.0)
+    http_pool_timeout: float = Field(default=10.0)
+    http2_enabled: bool = Field(default=False)
     
     # Agent Configuration
     max_context_length: int = Field(default=4096)
+    token_counter: str = Field(default="heuristic")  # or "llamacpp" to use the server's /tokenize
     default_temperature: float = Field(default=0.7)
     default_top_p: float = Field(default=0.9)
     default_top_k: int = Field(default=40)
+    request_coalescing: bool = Field(default=True)  # share one upstream call between identical concurrent temperature 0 requests
+    
+    # Background summarization of trimmed history (opt-in; costs an extra generation per trim)
+    summarization_enabled: bool = Field(default=False)
+    summarization_provider: Optional[str] = Field(default=None)  # defaults to default_provider
+    summarization_model: Optional[str] = Field(default=None)  # a small, cheap model; defaults to default_model
+    summarization_max_tokens: int = Field(default=256)
+    
+    # Admission control (per provider/model)
+    max_concurrent_generations: int = Field(default=4)
+    max_queued_generations: int = Field(default=32)
+    generation_queue_timeout: float = Field(default=30.0)
+    admission_retry_after: int = Field(default=5)
+    generation_concurrency_limits: Dict[str, int] = Field(default={})  # {"llamacpp:qwen/qwen3-4b": 8, "ollama": 2}
+    
+    # Response cache (opt-in, temperature 0 requests only)
+    response_cache_enabled: bool = Field(default=False)
+    response_cache_max_entries: int = Field(default=1000)
+    response_cache_ttl: int = Field(default=3600)
+    response_cache_path: Optional[str] = Field(default=None)  # SQLite file to keep entries across restarts
+    
+    # Streaming (SSE); tokens arriving within the window are sent as one event
+    stream_flush_interval_ms: int = Field(default=25)  # 0 sends every token as its own event
+    stream_flush_bytes: int = Field(default=1024)  # UTF-8 bytes; also the most text buffered for a slow client
+    stream_resume_timeout: float = Field(default=0.0)  # opt-in: seconds a disconnected generation keeps running for a resume; 0 cancels on disconnect
+    stream_replay_buffer: int = Field(default=1024)  # events kept per stream for Last-Event-ID resumes
+    websocket_max_streams: int = Field(default=16)  # concurrent generations per WebSocket
+    websocket_stream_window: int = Field(default=64)  # chunk messages a stream may send before the client grants more
+    
+    # Batch API
+    batch_max_items: int = Field(default=10000)
+    batch_max_concurrency: int = Field(default=8)  # requests in flight per batch
+    batch_max_retries: int = Field(default=3)  # retries when admission control rejects an item
+    
+    # Background jobs
+    job_broker: str = Field(default="sqlite")  # "sqlite" (local, no extra service) or "redis" (uses redis_url)
+    job_database_url: Optional[str] = Field(default=None)  # defaults to database_url
+    job_workers: int = Field(default=2)  # jobs run at once per API worker
+    job_lease: float = Field(default=60.0)  # seconds before a job whose worker stopped is run again
+    job_poll_interval: float = Field(default=1.0)
+    job_progress_interval: float = Field(default=1.0)  # how often progress is saved
+    job_max_attempts: int = Field(default=3)
+    job_retention: float = Field(default=86400)  # seconds finished jobs are kept
+    
+    # Document ingestion (text extraction from uploaded documents)
+    ingest_workers: int = Field(default=2)  # extraction processes
+    ingest_chunk_tokens: int = Field(default=512)
+    ingest_chunk_overlap: int = Field(default=64)  # tokens repeated between consecutive chunks
+    ingest_pdf_batch_pages: int = Field(default=16)  # PDF pages per extraction task
+    
+    # Retrieval over uploaded documents (opt-in; needs an embedding model on the provider)
+    retrieval_enabled: bool = Field(default=False)
+    embedding_provider: Optional[str] = Field(default=None)  # defaults to default_provider
+    embedding_model: str = Field(default="nomic-embed-text")
+    embedding_batch_size: int = Field(default=32)  # chunks per embedding request
+    vector_index_path: str = Field(default="./vector_index")  # directory of the memory-mapped index
+    retrieval_top_k: int = Field(default=8)  # chunks considered per question
+    retrieval_token_budget: int = Field(default=1536)  # most tokens of excerpts added to a prompt
+    retrieval_min_score: float = Field(default=0.0)  # cosine similarity; raise to drop weak matches
     
     # Default Model Configuration
     default_provider: str = Field(default="llamacpp")
@@ -41,6 +119,10 @@ class Settings(BaseSettings):
     
     # Database
     database_url: Optional[str] = Field(default="sqlite:///./swift_neethi.db")
+    conversation_cache_size: int = Field(default=500)  # conversations kept in memory
+    conversation_flush_interval: float = Field(default=0.5)
+    conversation_flush_batch_size: int = Field(default=500)
+    conversation_cache_validate: bool = Field(default=False)  # enable when running several workers
     
     # Redis
     redis_url: Optional[str] = Field(default=None)
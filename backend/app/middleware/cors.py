@@ -11,4 +11,5 @@ def setup_cors(app):
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", "Retry-After", "X-Stream-ID"],
     )
\ No newline at end of file
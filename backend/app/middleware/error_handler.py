@@ -18,7 +18,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "error": "HTTPException",
             "detail": exc.detail,
             "status_code": exc.status_code
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Dict, Any, Literal
 from datetime import datetime
 from enum import Enum
@@ -21,6 +21,12 @@ class Message(BaseModel):
     content: str
     timestamp: Optional[datetime] = Field(default_factory=datetime.utcnow)
     metadata: Optional[Dict[str, Any]] = None
+    
+    @field_validator("role", mode="before")
+    @classmethod
+    def role_value(cls, value: Any) -> Any:
+        # Accept Role members as well as plain strings
+        return value.value if isinstance(value, Role) else value
 
 
 class ChatRequest(BaseModel):
@@ -34,6 +40,21 @@ class ChatRequest(BaseModel):
     top_k: Optional[int] = Field(None, gt=0)
     system_prompt_id: Optional[str] = None
     conversation_id: Optional[str] = None
+    priority: int = Field(0, ge=0, le=9)  # higher is admitted first when the model is busy
+    queue_timeout: Optional[float] = Field(None, gt=0)  # seconds willing to wait for admission
+    delta: bool = False  # messages holds only the new turn; the server supplies the stored history
+    retrieval: Optional[bool] = None  # answer from uploaded documents (on by default when retrieval is enabled)
+    file_ids: Optional[List[str]] = None  # search only these uploaded files
+
+
+class BatchChatItem(ChatRequest):
+    custom_id: Optional[str] = None  # echoed back with the item's result
+    stream: bool = False
+
+
+class BatchChatRequest(BaseModel):
+    requests: List[BatchChatItem] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, gt=0)  # defaults to batch_max_concurrency
 
 
 class ChatResponse(BaseModel):
@@ -42,6 +63,7 @@ class ChatResponse(BaseModel):
     model: Optional[str] = None
     provider: Optional[str] = None
     usage: Optional[Dict[str, int]] = None
+    sources: Optional[List[Dict[str, Any]]] = None  # document excerpts the reply was given
 
 
 class StreamChunk(BaseModel):
@@ -1,6 +1,8 @@
 from .base import BaseProvider
 from .ollama import OllamaProvider
 from .llamacpp import LlamaCppProvider
+from .balancer import LoadBalancedLlamaCppProvider
+from .pool import HTTPPoolManager, http_pools
 from app.models import Provider
 from typing import Dict, Type
 
@@ -9,4 +11,7 @@ PROVIDER_MAP: Dict[Provider, Type[BaseProvider]] = {
     Provider.LLAMACPP: LlamaCppProvider
 }
 
-__all__ = ["BaseProvider", "OllamaProvider", "LlamaCppProvider", "PROVIDER_MAP"]
\ No newline at end of file
+__all__ = [
+    "BaseProvider", "OllamaProvider", "LlamaCppProvider", "PROVIDER_MAP",
+    "LoadBalancedLlamaCppProvider", "HTTPPoolManager", "http_pools"
+]
\ No newline at end of file
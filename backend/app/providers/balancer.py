@@ -0,0 +1,294 @@
+import httpx
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncGenerator
+import logging
+from app.models import Message, ModelInfo
+from .base import BaseProvider
+from .llamacpp import LlamaCppProvider
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("least_requests", "least_tokens")
+
+# Errors that mean the backend itself is unreachable or broken. Others, like
+# a read timeout on a long generation, fail the request but not the backend.
+BACKEND_DOWN = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class Backend:
+    """A single llama.cpp upstream and its load accounting"""
+
+    def __init__(self, provider: LlamaCppProvider):
+        self.provider = provider
+        self.healthy = True
+        self.outstanding_requests = 0
+        self.outstanding_tokens = 0
+        self.total_requests = 0
+        self.failures = 0
+        self.request_errors = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.provider.base_url
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding_requests": self.outstanding_requests,
+            "outstanding_tokens": self.outstanding_tokens,
+            "total_requests": self.total_requests,
+            "failures": self.failures,
+            "request_errors": self.request_errors,
+            "slots": self.provider.get_stats()
+        }
+
+
+class LoadBalancedLlamaCppProvider(BaseProvider):
+    """Spreads requests over several llama.cpp servers
+
+    Backends are picked by least outstanding requests or least queued tokens,
+    conversations stick to the backend that served them, and backends failing
+    health checks leave rotation until a later check succeeds.
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        strategy: str = "least_requests",
+        health_check_interval: float = 10.0,
+        max_sticky_conversations: int = 10000,
+        **kwargs
+    ):
+        if not base_urls:
+            raise ValueError("At least one llama.cpp backend URL is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+
+        super().__init__(", ".join(base_urls), **kwargs)
+        self.backends = [Backend(LlamaCppProvider(base_url=url, **kwargs)) for url in base_urls]
+        self.strategy = strategy
+        self.health_check_interval = health_check_interval
+        self.max_sticky_conversations = max_sticky_conversations
+        self.sticky: "OrderedDict[str, Backend]" = OrderedDict()
+        self.health_task: Optional[asyncio.Task] = None
+
+    def start_health_checks(self) -> None:
+        """Start the background health check loop"""
+        if self.health_task is None or self.health_task.done():
+            self.health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check_backends()
+            await asyncio.sleep(self.health_check_interval)
+
+    async def check_backends(self) -> None:
+        """Run health checks and update backend rotation"""
+        results = await asyncio.gather(
+            *(backend.provider.health_check() for backend in self.backends),
+            return_exceptions=True
+        )
+        for backend, result in zip(self.backends, results):
+            healthy = result is True
+            if healthy != backend.healthy:
+                logger.info(
+                    f"llama.cpp backend {backend.base_url} "
+                    f"{'back in rotation' if healthy else 'removed from rotation'}"
+                )
+            backend.healthy = healthy
+
+    def _load(self, backend: Backend) -> int:
+        if self.strategy == "least_tokens":
+            return backend.outstanding_tokens
+        return backend.outstanding_requests
+
+    def _estimate_tokens(self, messages: List[Message], max_tokens: Optional[int]) -> int:
+        """Rough cost of a request: prompt tokens plus tokens to generate"""
+        prompt_tokens = sum(len(msg.content) // 4 for msg in messages)
+        return prompt_tokens + (max_tokens or 0)
+
+    def select_backend(
+        self,
+        conversation_id: Optional[str] = None,
+        exclude: Optional[List[Backend]] = None
+    ) -> Backend:
+        """Pick a backend, preferring the one the conversation is pinned to"""
+        exclude = exclude or []
+
+        if conversation_id and conversation_id in self.sticky:
+            backend = self.sticky[conversation_id]
+            if backend.healthy and backend not in exclude:
+                self.sticky.move_to_end(conversation_id)
+                return backend
+
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # Everything looks down; try any backend rather than failing outright
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+
+        backend = min(candidates, key=self._load)
+
+        if conversation_id:
+            self.sticky[conversation_id] = backend
+            self.sticky.move_to_end(conversation_id)
+            while len(self.sticky) > self.max_sticky_conversations:
+                self.sticky.popitem(last=False)
+
+        return backend
+
+    def _mark_failed(self, backend: Backend, error: Exception) -> None:
+        backend.failures += 1
+        backend.healthy = False
+        logger.warning(f"llama.cpp backend {backend.base_url} failed, removed from rotation: {error}")
+
+    async def chat(
+        self,
+        messages: List[Message],
+        model: str,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Send chat completion request to the least loaded backend"""
+
+        conversation_id = kwargs.get("conversation_id")
+        cost = self._estimate_tokens(messages, max_tokens)
+        tried = []
+
+        while True:
+            backend = self.select_backend(conversation_id, exclude=tried)
+            backend.outstanding_requests += 1
+            backend.outstanding_tokens += cost
+            backend.total_requests += 1
+            try:
+                return await backend.provider.chat(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    top_p=top_p,
+                    top_k=top_k,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+            except BACKEND_DOWN as e:
+                self._mark_failed(backend, e)
+                tried.append(backend)
+                if len(tried) >= len(self.backends):
+                    raise
+            except httpx.TransportError:
+                backend.request_errors += 1
+                raise
+            finally:
+                backend.outstanding_requests -= 1
+                backend.outstanding_tokens -= cost
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        model: str,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """Stream chat completion response from the least loaded backend"""
+
+        conversation_id = kwargs.get("conversation_id")
+        cost = self._estimate_tokens(messages, max_tokens)
+        tried = []
+
+        while True:
+            backend = self.select_backend(conversation_id, exclude=tried)
+            backend.outstanding_requests += 1
+            backend.outstanding_tokens += cost
+            backend.total_requests += 1
+            started = False
+            try:
+                async for chunk in backend.provider.chat_stream(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    top_p=top_p,
+                    top_k=top_k,
+                    max_tokens=max_tokens,
+                    **kwargs
+                ):
+                    started = True
+                    yield chunk
+                return
+            except BACKEND_DOWN as e:
+                self._mark_failed(backend, e)
+                tried.append(backend)
+                # Only fail over if nothing has been sent to the client yet
+                if started or len(tried) >= len(self.backends):
+                    raise
+            except httpx.TransportError:
+                backend.request_errors += 1
+                raise
+            finally:
+                backend.outstanding_requests -= 1
+                backend.outstanding_tokens -= cost
+
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed texts on the least loaded backend"""
+
+        cost = sum(len(text) // 4 for text in texts)
+        tried = []
+
+        while True:
+            backend = self.select_backend(exclude=tried)
+            backend.outstanding_requests += 1
+            backend.outstanding_tokens += cost
+            backend.total_requests += 1
+            try:
+                return await backend.provider.embed(texts, model)
+            except BACKEND_DOWN as e:
+                self._mark_failed(backend, e)
+                tried.append(backend)
+                if len(tried) >= len(self.backends):
+                    raise
+            except httpx.TransportError:
+                backend.request_errors += 1
+                raise
+            finally:
+                backend.outstanding_requests -= 1
+                backend.outstanding_tokens -= cost
+
+    def _first_healthy(self) -> Backend:
+        return next((b for b in self.backends if b.healthy), self.backends[0])
+
+    async def list_models(self) -> List[ModelInfo]:
+        """List models served by the backends"""
+        return await self._first_healthy().provider.list_models()
+
+    async def get_model_info(self, model_name: str) -> Optional[ModelInfo]:
+        """Get information about the loaded model"""
+        return await self._first_healthy().provider.get_model_info(model_name)
+
+    async def health_check(self) -> bool:
+        """Healthy while at least one backend is in rotation"""
+        await self.check_backends()
+        return any(b.healthy for b in self.backends)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get load balancing statistics"""
+        return {
+            "strategy": self.strategy,
+            "sticky_conversations": len(self.sticky),
+            "backends": [b.stats() for b in self.backends]
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.health_task:
+            self.health_task.cancel()
+        for backend in self.backends:
+            await backend.provider.__aexit__(exc_type, exc_val, exc_tb)
@@ -54,6 +54,10 @@ class BaseProvider(ABC):
         """Check if the provider is healthy and accessible"""
         pass
     
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed texts with an embedding model, one vector per text"""
+        raise NotImplementedError(f"{type(self).__name__} does not support embeddings")
+    
     def format_messages(self, messages: List[Message]) -> List[Dict[str, str]]:
         """Format messages for the provider's API"""
         formatted = []
@@ -1,8 +1,10 @@
-import httpx
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import json
 from app.models import Message, ModelInfo, Provider
 from .base import BaseProvider
+from .pool import http_pools
+from .slots import SlotManager
+from app.config import settings
 
 
 class LlamaCppProvider(BaseProvider):
@@ -10,7 +12,12 @@ class LlamaCppProvider(BaseProvider):
     
     def __init__(self, base_url: str = "http://localhost:8080", **kwargs):
         super().__init__(base_url, **kwargs)
-        self.client = httpx.AsyncClient(timeout=120.0)
+        self.client = http_pools.acquire(base_url)
+        self.cache_prompt = kwargs.get("cache_prompt", settings.llamacpp_cache_prompt)
+        self.slots = SlotManager(
+            kwargs.get("slots", settings.llamacpp_slots),
+            kwargs.get("slot_wait_timeout", settings.llamacpp_slot_wait_timeout)
+        )
     
     async def chat(
         self,
@@ -38,8 +45,12 @@ class LlamaCppProvider(BaseProvider):
         
         if max_tokens:
             payload["max_tokens"] = max_tokens
-            
-        response = await self.client.post(url, json=payload)
+        
+        slot = await self._apply_slot(payload, kwargs.get("conversation_id"))
+        try:
+            response = await self.client.post(url, json=payload)
+        finally:
+            self.slots.release(slot)
         response.raise_for_status()
         
         result = response.json()
@@ -74,21 +85,41 @@ class LlamaCppProvider(BaseProvider):
         
         if max_tokens:
             payload["max_tokens"] = max_tokens
-            
-        async with self.client.stream("POST", url, json=payload) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    if line == "data: [DONE]":
-                        break
-                    try:
-                        chunk = json.loads(line[6:])
-                        if "choices" in chunk and chunk["choices"]:
-                            delta = chunk["choices"][0].get("delta", {})
-                            if "content" in delta:
-                                yield delta["content"]
-                    except json.JSONDecodeError:
-                        continue
+        
+        slot = await self._apply_slot(payload, kwargs.get("conversation_id"))
+        try:
+            async with self.client.stream("POST", url, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        if line == "data: [DONE]":
+                            break
+                        try:
+                            chunk = json.loads(line[6:])
+                            if "choices" in chunk and chunk["choices"]:
+                                delta = chunk["choices"][0].get("delta", {})
+                                if "content" in delta:
+                                    yield delta["content"]
+                        except json.JSONDecodeError:
+                            continue
+        finally:
+            self.slots.release(slot)
+    
+    async def _apply_slot(self, payload: Dict[str, Any], conversation_id: Optional[str]) -> Optional[int]:
+        """Enable prompt caching and pin the conversation to a server slot"""
+        
+        if not self.cache_prompt:
+            return None
+        
+        payload["cache_prompt"] = True
+        slot = await self.slots.acquire(conversation_id, self.slots.fingerprint(payload["messages"]))
+        if slot is not None:
+            payload["id_slot"] = slot
+        return slot
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get KV cache slot statistics"""
+        return self.slots.get_stats()
     
     async def list_models(self) -> List[ModelInfo]:
         """List available models from llama.cpp server"""
@@ -145,6 +176,16 @@ class LlamaCppProvider(BaseProvider):
         
         return None
     
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed texts (the server must be started with --embedding)"""
+        
+        url = f"{self.base_url}/v1/embeddings"
+        response = await self.client.post(url, json={"model": model, "input": texts})
+        response.raise_for_status()
+        
+        data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in data]
+    
     async def health_check(self) -> bool:
         """Check if llama.cpp server is running and accessible"""
         
@@ -168,4 +209,4 @@ class LlamaCppProvider(BaseProvider):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
\ No newline at end of file
+        await http_pools.release(self.base_url)
\ No newline at end of file
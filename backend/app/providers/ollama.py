@@ -1,8 +1,8 @@
-import httpx
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import json
 from app.models import Message, ModelInfo, Provider
 from .base import BaseProvider
+from .pool import http_pools
 
 
 class OllamaProvider(BaseProvider):
@@ -10,7 +10,7 @@ class OllamaProvider(BaseProvider):
     
     def __init__(self, base_url: str = "http://localhost:11434", **kwargs):
         super().__init__(base_url, **kwargs)
-        self.client = httpx.AsyncClient(timeout=120.0)
+        self.client = http_pools.acquire(base_url)
     
     async def chat(
         self,
@@ -132,6 +132,27 @@ class OllamaProvider(BaseProvider):
             context_length=model_data.get("parameters", {}).get("num_ctx")
         )
     
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed texts with an Ollama embedding model"""
+        
+        url = f"{self.base_url}/api/embed"
+        response = await self.client.post(url, json={"model": model, "input": texts})
+        
+        if response.status_code == 404 and "model" not in response.text:
+            # Ollama before 0.3 only has the one-text-per-request endpoint
+            embeddings = []
+            for text in texts:
+                response = await self.client.post(
+                    f"{self.base_url}/api/embeddings",
+                    json={"model": model, "prompt": text}
+                )
+                response.raise_for_status()
+                embeddings.append(response.json()["embedding"])
+            return embeddings
+        
+        response.raise_for_status()
+        return response.json()["embeddings"]
+    
     async def health_check(self) -> bool:
         """Check if Ollama is running and accessible"""
         
@@ -145,4 +166,4 @@ class OllamaProvider(BaseProvider):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
\ No newline at end of file
+        await http_pools.release(self.base_url)
\ No newline at end of file
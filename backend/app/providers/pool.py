@@ -0,0 +1,153 @@
+import httpx
+from typing import Dict, Any
+import logging
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """Wraps a transport to count requests in flight, until their body is closed"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.in_flight = 0
+        self.requests = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=CountedStream(response.stream, self),
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class CountedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, transport: CountingTransport):
+        self.stream = stream
+        self.transport = transport
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.transport.in_flight -= 1
+        await self.stream.aclose()
+
+
+class HTTPPoolManager:
+    """Shares one tuned httpx client (connection pool) per upstream across providers"""
+
+    def __init__(self):
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.refs: Dict[str, int] = {}
+        self.transports: Dict[str, CountingTransport] = {}
+        self.http2: Dict[str, bool] = {}
+
+    def _key(self, base_url: str) -> str:
+        return base_url.rstrip("/")
+
+    def _build_client(self, key: str) -> httpx.AsyncClient:
+        """Create a client using the pool settings"""
+
+        limits = httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        )
+        timeout = httpx.Timeout(
+            connect=settings.http_connect_timeout,
+            read=settings.http_read_timeout,
+            write=settings.http_write_timeout,
+            pool=settings.http_pool_timeout
+        )
+
+        http2 = settings.http2_enabled
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+                http2 = False
+
+        # Counts requests itself, so stats don't depend on httpcore internals
+        transport = CountingTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        self.transports[key] = transport
+        self.http2[key] = http2
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    def acquire(self, base_url: str) -> httpx.AsyncClient:
+        """Get the shared client for an upstream, creating it on first use"""
+
+        key = self._key(base_url)
+        client = self.clients.get(key)
+        if client is None or client.is_closed:
+            client = self._build_client(key)
+            self.clients[key] = client
+            self.refs[key] = 0
+        self.refs[key] += 1
+        return client
+
+    async def release(self, base_url: str) -> None:
+        """Drop a reference to an upstream client, closing it when unused"""
+
+        key = self._key(base_url)
+        if key not in self.clients:
+            return
+
+        self.refs[key] -= 1
+        if self.refs[key] <= 0:
+            client = self.clients.pop(key)
+            del self.refs[key]
+            self.transports.pop(key, None)
+            self.http2.pop(key, None)
+            await client.aclose()
+
+    async def close_all(self) -> None:
+        """Close every pooled client"""
+
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+        self.refs.clear()
+        self.transports.clear()
+        self.http2.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get per-upstream pool statistics (in use, waiting for a connection)"""
+
+        stats = {}
+        for key in self.clients:
+            transport = self.transports[key]
+            # Over HTTP/1.1 each request in flight holds a connection; the rest queue
+            stats[key] = {
+                "in_flight": transport.in_flight,
+                "in_use": min(transport.in_flight, settings.http_max_connections),
+                "waiting": max(transport.in_flight - settings.http_max_connections, 0),
+                "requests": transport.requests,
+                "max_connections": settings.http_max_connections,
+                "max_keepalive_connections": settings.http_max_keepalive_connections,
+                "http2": self.http2[key],
+                "providers": self.refs.get(key, 0)
+            }
+
+        return stats
+
+
+# Global pool manager shared by all providers
+http_pools = HTTPPoolManager()
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+
+class SlotManager:
+    """Pins conversations to llama.cpp server slots so their KV cache is reused
+
+    Each slot remembers which conversation's prompt prefix it holds. When
+    there are more conversations than slots, the least recently used idle
+    slot is handed to the new conversation. When every slot is generating,
+    a new conversation waits for one to go idle rather than being sent
+    unpinned: the server would queue it anyway, and would then put it in a
+    slot this manager thinks another conversation owns. After wait_timeout
+    seconds it is sent unpinned all the same, so long generations can't
+    hold it up indefinitely.
+    """
+
+    def __init__(self, num_slots: int, wait_timeout: float = 5.0):
+        self.num_slots = num_slots
+        self.wait_timeout = wait_timeout
+        self.assignments: "OrderedDict[str, int]" = OrderedDict()  # conversation -> slot, LRU order
+        self.owners: Dict[int, str] = {}
+        self.prefixes: Dict[int, List[str]] = {}
+        self.active: Dict[int, int] = {slot: 0 for slot in range(num_slots)}
+        self.waiters: List[asyncio.Future] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.waits = 0
+        self.wait_timeouts = 0
+        self.reused_messages = 0
+
+    def fingerprint(self, messages: List[Dict[str, str]]) -> List[str]:
+        """Hash each formatted message so prefixes can be compared cheaply"""
+        return [
+            hashlib.sha1(f"{m['role']}\x00{m['content']}".encode("utf-8")).hexdigest()
+            for m in messages
+        ]
+
+    def _free_slot(self) -> Optional[int]:
+        """Find an unowned slot, or evict the least recently used idle one"""
+        for slot in range(self.num_slots):
+            if slot not in self.owners:
+                return slot
+
+        for conversation_id, slot in self.assignments.items():
+            if self.active[slot] == 0:
+                del self.assignments[conversation_id]
+                del self.owners[slot]
+                self.prefixes.pop(slot, None)
+                self.evictions += 1
+                return slot
+
+        return None
+
+    async def acquire(self, conversation_id: Optional[str], fingerprint: List[str]) -> Optional[int]:
+        """Get the slot for a conversation, or None to let the server choose"""
+
+        if not conversation_id or self.num_slots <= 0:
+            return None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            slot = self.assignments.get(conversation_id)
+            if slot is not None:
+                self.assignments.move_to_end(conversation_id)
+                cached = self.prefixes.get(slot, [])
+                reused = 0
+                for cached_hash, new_hash in zip(cached, fingerprint):
+                    if cached_hash != new_hash:
+                        break
+                    reused += 1
+                if reused:
+                    self.hits += 1
+                    self.reused_messages += reused
+                else:
+                    self.misses += 1
+                break
+
+            slot = self._free_slot()
+            if slot is not None:
+                self.assignments[conversation_id] = slot
+                self.owners[slot] = conversation_id
+                self.misses += 1
+                break
+
+            # Every slot is generating; check again when one goes idle
+            self.waits += 1
+            try:
+                await asyncio.wait_for(self._wait_for_idle_slot(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                self.wait_timeouts += 1
+                return None
+
+        self.active[slot] += 1
+        self.prefixes[slot] = fingerprint
+        return slot
+
+    async def _wait_for_idle_slot(self) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Woken but not taking the slot; pass the wakeup on
+                self._wake()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def _wake(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def release(self, slot: Optional[int]) -> None:
+        """Mark a request on a slot as finished"""
+        if slot is not None:
+            self.active[slot] -= 1
+            if self.active[slot] == 0:
+                self._wake()
+
+    def forget(self, conversation_id: str) -> None:
+        """Drop a conversation's slot assignment"""
+        slot = self.assignments.pop(conversation_id, None)
+        if slot is not None:
+            del self.owners[slot]
+            self.prefixes.pop(slot, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.num_slots,
+            "pinned_conversations": len(self.assignments),
+            "active_requests": sum(self.active.values()),
+            "prefix_hits": self.hits,
+            "prefix_misses": self.misses,
+            "evictions": self.evictions,
+            "slot_waits": self.waits,
+            "slot_wait_timeouts": self.wait_timeouts,
+            "waiting_requests": len(self.waiters),
+            "reused_messages": self.reused_messages
+        }
@@ -2,5 +2,8 @@ from .chat import router as chat_router
 from .models import router as models_router
 from .prompts import router as prompts_router
 from .files import router as files_router
+from .metrics import router as metrics_router
+from .websocket import router as websocket_router
+from .jobs import router as jobs_router
 
-__all__ = ["chat_router", "models_router", "prompts_router", "files_router"]
\ No newline at end of file
+__all__ = ["chat_router", "models_router", "prompts_router", "files_router", "metrics_router", "websocket_router", "jobs_router"]
\ No newline at end of file
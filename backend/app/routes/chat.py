@@ -1,12 +1,26 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, UploadFile, File
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse, Response
-from typing import AsyncGenerator, List, Dict, Any
+from starlette.types import Send
+from pydantic import ValidationError
+from typing import AsyncGenerator, AsyncIterable, Iterable, List, Dict, Any, Optional, Tuple, Union
+import anyio
+import hashlib
 import json
-import datetime
-from app.models import ChatRequest, ChatResponse, Message, Conversation
-from app.agents import ChatAgent
+from app.models import ChatRequest, ChatResponse, Message, Conversation, BatchChatItem, BatchChatRequest
+from app.agents import ChatAgent, AdmissionRejected, StreamGone, BatchRunner
+from app.agents.streaming import coalesce_chunks
 from app.config import settings
 
+try:
+    import orjson
+    
+    def dumps(data: Any) -> bytes:
+        return orjson.dumps(data)
+except ImportError:
+    def dumps(data: Any) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 # Global chat agent instance
@@ -22,6 +36,39 @@ async def get_chat_agent() -> ChatAgent:
     return chat_agent
 
 
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    """Turn an admission rejection into 503 with Retry-After"""
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+def request_context(request: ChatRequest, stream: bool) -> Dict[str, Any]:
+    """Build the ChatAgent context for a request
+    
+    Options the client left out are omitted, so the agent's defaults apply.
+    """
+    context = {
+        "conversation_id": request.conversation_id,
+        "provider": request.provider.value if request.provider else None,
+        "model": request.model,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "top_k": request.top_k,
+        "max_tokens": request.max_tokens,
+        "system_prompt_id": request.system_prompt_id,
+        "priority": request.priority,
+        "queue_timeout": request.queue_timeout,
+        "delta": request.delta,
+        "retrieval": request.retrieval,
+        "file_ids": request.file_ids,
+        "stream": stream
+    }
+    return {key: value for key, value in context.items() if value is not None}
+
+
 @router.post("/", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -30,17 +77,7 @@ async def chat(
     """Send a chat message and get response"""
     
     try:
-        context = {
-            "conversation_id": request.conversation_id,
-            "provider": request.provider.value if request.provider else None,
-            "model": request.model,
-            "temperature": request.temperature,
-            "top_p": request.top_p,
-            "top_k": request.top_k,
-            "max_tokens": request.max_tokens,
-            "system_prompt_id": request.system_prompt_id,
-            "stream": False
-        }
+        context = request_context(request, stream=False)
         
         result = await agent.process_messages(request.messages, context)
         
@@ -49,24 +86,82 @@ async def chat(
             provider=result["provider"],
             model=result["model"],
             conversation_id=result["conversation_id"],
-            usage=result.get("usage")
+            usage=result.get("usage"),
+            sources=result.get("sources")
         )
         
+    except AdmissionRejected as e:
+        raise admission_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def generate_stream(generator: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
-    """Generate SSE stream from chat response"""
+class CancellableStreamingResponse(StreamingResponse):
+    """Streaming response that closes its body iterator as soon as streaming stops
+
+    Starlette cancels the send loop when the client disconnects but leaves the
+    generator suspended until it is garbage collected. Closing it here tears
+    down the upstream request immediately.
+    """
+    
+    async def stream_response(self, send: Send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            if hasattr(self.body_iterator, "aclose"):
+                # Shielded, since the surrounding scope is already cancelled
+                with anyio.CancelScope(shield=True):
+                    await self.body_iterator.aclose()
+
+
+async def sse_payloads(generator: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+    """Encode a chat response as SSE data payloads, ending with [DONE]
+    
+    Tokens arriving within the flush window are sent as one event.
+    """
+    generator = coalesce_chunks(
+        generator,
+        settings.stream_flush_interval_ms / 1000,
+        settings.stream_flush_bytes
+    )
     try:
         async for chunk in generator:
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        yield "data: [DONE]\n\n"
+            yield dumps({"content": chunk})
+        yield b"[DONE]"
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
         print(f"Streaming error: {error_detail}")
-        yield f"data: {json.dumps({'error': str(e), 'detail': error_detail})}\n\n"
+        yield dumps({"error": str(e), "detail": error_detail})
+    finally:
+        await generator.aclose()
+
+
+async def generate_stream(generator: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+    """Generate SSE stream from chat response"""
+    payloads = sse_payloads(generator)
+    try:
+        async for payload in payloads:
+            yield b"data: " + payload + b"\n\n"
+    finally:
+        await payloads.aclose()
+
+
+async def follow_stream(
+    events: AsyncGenerator[Tuple[int, bytes], None],
+    header: Optional[Dict[str, Any]] = None
+) -> AsyncGenerator[bytes, None]:
+    """SSE stream with event ids from a resumable stream"""
+    try:
+        if header:
+            # No id, so it doesn't move the client's Last-Event-ID
+            yield b"data: " + dumps(header) + b"\n\n"
+        async for event_id, payload in events:
+            yield b"id: %d\ndata: %s\n\n" % (event_id, payload)
+    except StreamGone as e:
+        yield b"data: " + dumps({"error": str(e)}) + b"\n\n"
+    finally:
+        await events.aclose()
 
 
 @router.post("/stream")
@@ -80,29 +175,186 @@ async def chat_stream(
         request.stream = True
     
     try:
-        context = {
-            "conversation_id": request.conversation_id,
-            "provider": request.provider.value if request.provider else None,
-            "model": request.model,
-            "temperature": request.temperature,
-            "top_p": request.top_p,
-            "top_k": request.top_k,
-            "max_tokens": request.max_tokens,
-            "system_prompt_id": request.system_prompt_id,
-            "stream": True
-        }
+        context = request_context(request, stream=True)
         
         result = await agent.process_messages(request.messages, context)
         
-        return StreamingResponse(
-            generate_stream(result["stream"]),
-            media_type="text/event-stream"
+        if settings.stream_resume_timeout <= 0:
+            return CancellableStreamingResponse(
+                generate_stream(result["stream"]),
+                media_type="text/event-stream"
+            )
+        
+        # Generation runs in the background, so a dropped client can resume
+        stream = agent.streams.create(sse_payloads(result["stream"]))
+        return CancellableStreamingResponse(
+            follow_stream(
+                agent.streams.attach(stream.id),
+                {"stream_id": stream.id, "conversation_id": result["conversation_id"]}
+            ),
+            media_type="text/event-stream",
+            headers={"X-Stream-ID": stream.id}
         )
         
+    except AdmissionRejected as e:
+        raise admission_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def batch_job(index: int, item: BatchChatItem) -> Dict[str, Any]:
+    context = request_context(item, stream=False)
+    # Below every interactive request, keeping the items' relative priority
+    context["priority"] = item.priority - 10
+    # Only items that continue a conversation are stored
+    context["persist"] = bool(item.conversation_id or item.delta)
+    return {
+        "index": index,
+        "custom_id": item.custom_id,
+        "messages": item.messages,
+        "context": context
+    }
+
+
+def batch_response(
+    agent: ChatAgent,
+    jobs: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+    concurrency: Optional[int]
+) -> CancellableStreamingResponse:
+    """Run jobs and stream one JSON line per result as it finishes"""
+    
+    runner = BatchRunner(
+        agent,
+        concurrency=min(concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency),
+        max_retries=settings.batch_max_retries
+    )
+    
+    async def lines() -> AsyncGenerator[bytes, None]:
+        results = runner.run(jobs)
+        try:
+            async for result in results:
+                yield dumps(result) + b"\n"
+        finally:
+            await results.aclose()
+    
+    return CancellableStreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/batch")
+async def chat_batch(
+    batch: BatchChatRequest,
+    agent: ChatAgent = Depends(get_chat_agent)
+):
+    """Run many chat requests; results stream back as JSON lines
+    
+    Each line has the item's index, custom_id, status and either the
+    response with usage or the error. The last line is a summary.
+    """
+    
+    if len(batch.requests) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.batch_max_items} requests per batch"
+        )
+    
+    jobs = (batch_job(index, item) for index, item in enumerate(batch.requests))
+    return batch_response(agent, jobs, batch.concurrency)
+
+
+async def upload_lines(file: UploadFile, chunk_size: int = 64 * 1024) -> AsyncGenerator[bytes, None]:
+    """Lines of an uploaded file, without its newlines, read a chunk at a time"""
+    
+    partial: List[bytes] = []
+    while chunk := await file.read(chunk_size):
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            partial.append(chunk[start:end])
+            yield b"".join(partial)
+            partial.clear()
+            start = end + 1
+        partial.append(chunk[start:])
+    if any(partial):
+        yield b"".join(partial)
+
+
+@router.post("/batch/upload")
+async def chat_batch_upload(
+    file: UploadFile = File(...),
+    concurrency: Optional[int] = Query(None, gt=0),
+    agent: ChatAgent = Depends(get_chat_agent)
+):
+    """Run a JSONL file of chat requests (one per line) as a batch
+    
+    The file is read a chunk at a time as workers take requests, never
+    whole. Lines that aren't valid requests are reported as failed items.
+    """
+    
+    # A first pass only counts, so an oversized batch is refused up front
+    count = 0
+    async for line in upload_lines(file):
+        if line.strip():
+            count += 1
+            if count > settings.batch_max_items:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"At most {settings.batch_max_items} requests per batch"
+                )
+    if not count:
+        raise HTTPException(status_code=400, detail="Batch file is empty")
+    await file.seek(0)
+    
+    async def jobs() -> AsyncGenerator[Dict[str, Any], None]:
+        index = number = 0
+        async for line in upload_lines(file):
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                yield batch_job(index, BatchChatItem.model_validate_json(line))
+            except ValidationError as e:
+                yield {"index": index, "error": f"Invalid request on line {number}: {e}"}
+            index += 1
+    
+    return batch_response(agent, jobs(), concurrency)
+
+
+@router.get("/stream/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    request: Request,
+    last_event_id: Optional[int] = Query(None, ge=0),
+    agent: ChatAgent = Depends(get_chat_agent)
+):
+    """Resume a stream after the last event the client received
+    
+    The position comes from the Last-Event-ID header (or last_event_id).
+    """
+    
+    if last_event_id is None:
+        header = request.headers.get("last-event-id", "0")
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid Last-Event-ID: {header}")
+    
+    try:
+        events = agent.streams.attach(stream_id, last_event_id)
+    except StreamGone as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    
+    return CancellableStreamingResponse(
+        follow_stream(events),
+        media_type="text/event-stream",
+        headers={"X-Stream-ID": stream_id}
+    )
+
+
+def conversation_title(conversation: Dict[str, Any]) -> str:
+    """Stored title, or a default one based on the ID"""
+    metadata = conversation.get("metadata") or {}
+    return metadata.get("title", f"Conversation {conversation['id']}")
+
+
 @router.get("/conversations/{conversation_id}", response_model=Conversation)
 async def get_conversation(
     conversation_id: str,
@@ -117,6 +369,7 @@ async def get_conversation(
     
     return Conversation(
         id=conversation["id"],
+        title=conversation_title(conversation),
         messages=conversation["messages"],
         created_at=conversation["created_at"],
         updated_at=conversation["updated_at"],
@@ -131,10 +384,7 @@ async def delete_conversation(
 ):
     """Delete a conversation"""
     
-    # For now, just remove from memory
-    if conversation_id in agent.conversations:
-        del agent.conversations[conversation_id]
-        await agent.memory_agent.clear_conversation(conversation_id)
+    if await agent.memory_agent.clear_conversation(conversation_id):
         return {"message": "Conversation deleted successfully"}
     
     raise HTTPException(status_code=404, detail="Conversation not found")
@@ -152,13 +402,7 @@ async def rename_conversation(
     if not new_title:
         raise HTTPException(status_code=400, detail="Title cannot be empty")
     
-    # For now, just update in memory
-    if conversation_id in agent.conversations:
-        if "metadata" not in agent.conversations[conversation_id]:
-            agent.conversations[conversation_id]["metadata"] = {}
-        agent.conversations[conversation_id]["metadata"]["title"] = new_title
-        agent.conversations[conversation_id]["updated_at"] = datetime.datetime.utcnow()
-        
+    if await agent.store.update_metadata(conversation_id, title=new_title):
         return {"message": "Conversation renamed successfully", "title": new_title}
     
     raise HTTPException(status_code=404, detail="Conversation not found")
@@ -172,28 +416,33 @@ async def export_conversation(
 ):
     """Export conversation in different formats"""
     
-    if conversation_id not in agent.conversations:
+    conversation = await agent.get_conversation(conversation_id)
+    if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conversation = agent.conversations[conversation_id]
-    title = conversation.get("metadata", {}).get("title", f"Conversation {conversation_id}")
+    title = conversation_title(conversation)
+    messages = conversation["messages"]
     
     if format == "json":
-        content = json.dumps(conversation, indent=2, default=str)
+        content = json.dumps(
+            {**conversation, "messages": [msg.model_dump() for msg in messages]},
+            indent=2,
+            default=str
+        )
         media_type = "application/json"
         filename = f"{title.replace(' ', '_')}.json"
     
     elif format == "markdown":
         content = f"# {title}\n\n"
-        for msg in conversation.get("messages", []):
-            content += f"## {msg['role'].upper()}\n{msg['content']}\n\n"
+        for msg in messages:
+            content += f"## {msg.role.upper()}\n{msg.content}\n\n"
         media_type = "text/markdown"
         filename = f"{title.replace(' ', '_')}.md"
     
     elif format == "txt":
         content = f"{title}\n{'=' * len(title)}\n\n"
-        for msg in conversation.get("messages", []):
-            content += f"{msg['role'].upper()}: {msg['content']}\n\n"
+        for msg in messages:
+            content += f"{msg.role.upper()}: {msg.content}\n\n"
         media_type = "text/plain"
         filename = f"{title.replace(' ', '_')}.txt"
     
@@ -208,55 +457,73 @@ async def export_conversation(
 async def search_conversations(
     query: str = Query(..., min_length=1),
     chat_id: str = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
     agent: ChatAgent = Depends(get_chat_agent)
 ):
-    """Search within conversations"""
+    """Search within conversations, best matches first"""
     
-    results = []
-    query_lower = query.lower()
+    results = await agent.store.search_messages(query, chat_id, limit, offset)
+    total = await agent.store.count_messages(query, chat_id)
     
-    conversations_to_search = [chat_id] if chat_id else agent.conversations.keys()
-    
-    for conv_id in conversations_to_search:
-        if conv_id in agent.conversations:
-            conversation = agent.conversations[conv_id]
-            conv_title = conversation.get("metadata", {}).get("title", f"Conversation {conv_id}")
-            
-            for msg in conversation.get("messages", []):
-                if query_lower in msg.get("content", "").lower():
-                    results.append({
-                        "conversation_id": conv_id,
-                        "conversation_title": conv_title,
-                        "message_id": msg.get("id"),
-                        "content": msg.get("content", ""),
-                        "role": msg.get("role"),
-                        "timestamp": msg.get("timestamp")
-                    })
-    
-    return {"results": results, "total": len(results)}
+    return {
+        "results": results,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "has_more": offset + len(results) < total
+    }
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 
 @router.get("/conversations")
 async def list_conversations(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
     agent: ChatAgent = Depends(get_chat_agent)
 ):
-    """List all conversations"""
+    """List conversations, most recently updated first
+    
+    Pass the returned next_cursor to get the following page. Responses carry
+    an ETag, so an unchanged page costs a 304 with no body.
+    """
     
-    conversations = []
-    for conv_id, conversation in agent.conversations.items():
-        title = conversation.get("metadata", {}).get("title", f"Conversation {conv_id}")
-        message_count = len(conversation.get("messages", []))
+    try:
+        # The ETag comes from the store's version, so a 304 never reads the page
+        updated_at, count = await agent.store.list_version(cursor)
+        version = f"{updated_at}:{count}:{limit}:{cursor}"
+        etag = f'"{hashlib.sha1(version.encode()).hexdigest()}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
         
-        conversations.append({
-            "id": conv_id,
-            "title": title,
-            "message_count": message_count,
-            "created_at": conversation.get("created_at"),
-            "updated_at": conversation.get("updated_at"),
-            "last_message": conversation.get("messages", [])[-1] if conversation.get("messages") else None
-        })
-    
-    # Sort by updated_at descending
-    conversations.sort(key=lambda x: x.get("updated_at", datetime.datetime.min), reverse=True)
-    
-    return {"conversations": conversations}
\ No newline at end of file
+        page, next_cursor = await agent.store.list_conversations(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    conversations = [
+        {
+            "id": conversation["id"],
+            "title": conversation_title(conversation),
+            "message_count": conversation["message_count"],
+            "created_at": conversation["created_at"],
+            "updated_at": conversation["updated_at"],
+            "preview": conversation["preview"]
+        }
+        for conversation in page
+    ]
+    
+    body = json.dumps(
+        jsonable_encoder({"conversations": conversations, "next_cursor": next_cursor}),
+        ensure_ascii=False
+    ).encode()
+    return Response(content=body, media_type="application/json", headers=headers)
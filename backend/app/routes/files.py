@@ -1,12 +1,25 @@
 import os
 import uuid
 import base64
-from typing import List
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+import mimetypes
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import FileResponse, Response
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.types import Receive, Scope, Send
+import anyio
 import shutil
 from pathlib import Path
 import logging
+from app.config import settings
+from app.models import Provider
+from app.storage import FileStore, FileTooLarge
+from app.storage.vectors import VectorIndex
+from app.agents import DocumentIngester, Retriever
+from .chat import etag_matches, get_chat_agent
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +47,87 @@ ALLOWED_TYPES = {
 }
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_FILES = 10  # per upload-multiple request
+MAX_PART_OVERHEAD = 16 * 1024  # boundary and part headers allowed per file in the body size limit
+
+# Shown in the browser rather than downloaded (SVG can carry scripts, so it isn't)
+INLINE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "application/pdf", "text/plain"}
+INLINE_PREFIXES = ("video/", "audio/")
+
+MAX_RANGES = 16  # more than this in one request is served as the whole file
+
+# Global file store, document ingester and retriever instances
+file_store = None
+document_ingester = None
+retriever = None
+
+
+async def get_file_store() -> FileStore:
+    """Get or create the file store"""
+    global file_store
+    if not file_store:
+        file_store = FileStore(UPLOAD_DIR, settings.database_url)
+        await file_store.initialize()
+    return file_store
+
+
+async def get_document_ingester() -> DocumentIngester:
+    """Get or create the document ingester, resuming interrupted work"""
+    global document_ingester
+    if not document_ingester:
+        document_ingester = DocumentIngester(
+            await get_file_store(),
+            workers=settings.ingest_workers,
+            chunk_tokens=settings.ingest_chunk_tokens,
+            chunk_overlap=settings.ingest_chunk_overlap,
+            pdf_batch_pages=settings.ingest_pdf_batch_pages,
+            on_ready=document_ready
+        )
+        await document_ingester.start()
+    return document_ingester
+
+
+async def get_retriever() -> Optional[Retriever]:
+    """Get or create the document retriever; None when retrieval is disabled"""
+    global retriever
+    if not retriever and settings.retrieval_enabled:
+        agent = await get_chat_agent()
+        provider = Provider(settings.embedding_provider or settings.default_provider)
+        if provider not in agent.providers:
+            logger.error(f"Retrieval disabled: embedding provider {provider.value} is not configured")
+            return None
+        retriever = Retriever(
+            await get_file_store(),
+            VectorIndex(Path(settings.vector_index_path)),
+            agent.providers[provider],
+            settings.embedding_model,
+            batch_size=settings.embedding_batch_size,
+            top_k=settings.retrieval_top_k,
+            min_score=settings.retrieval_min_score,
+            token_counter=agent.memory_agent.token_counter
+        )
+        await retriever.start()
+        agent.retriever = retriever
+    return retriever
+
+
+def document_ready(digest: str) -> None:
+    # Newly ingested documents become searchable once embedded
+    if retriever:
+        retriever.submit(digest)
+
+
+def document_view(document: Optional[dict]) -> Optional[dict]:
+    """Ingestion status of a document as returned by the API"""
+    if document is None:
+        return None
+    return {
+        "status": document["status"],
+        "error": document["error"],
+        "progress": {"done": document["progress_done"], "total": document["progress_total"]},
+        "chunks": document["chunk_count"],
+        "tokens": document["token_count"]
+    }
 
 
 def is_allowed_file_type(content_type: str) -> bool:
@@ -52,9 +146,200 @@ def get_file_category(content_type: str) -> str:
     return "unknown"
 
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """Upload a single file"""
+def file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB"
+    )
+
+
+def body_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB per file"
+    )
+
+
+class UploadPart:
+    """One file of a multipart upload, read straight from the request body"""
+    
+    def __init__(self, reader: "MultipartReader", name: str, filename: str, content_type: Optional[str]):
+        self.reader = reader
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.done = False
+    
+    async def read(self, size: int = -1) -> bytes:
+        """The next piece of the file, or b"" at its end"""
+        if self.done:
+            return b""
+        data = await self.reader.read_part(size)
+        if not data:
+            self.done = True
+        return data
+    
+    async def drain(self) -> None:
+        while await self.read(MAX_PART_OVERHEAD):
+            pass
+
+
+class MultipartReader:
+    """Files of a multipart/form-data request, parsed as the body arrives
+    
+    Starlette's form parser spools the whole body to temporary files before
+    the handler runs. Here each file is handed over while the body is still
+    being received, so it's written to disk once and a size limit stops the
+    upload as soon as it's passed. Parts must be read in order. Bodies
+    longer than max_size are refused from their Content-Length, or once
+    that much has arrived when it's sent chunked.
+    """
+    
+    def __init__(self, request: Request, max_size: int):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > max_size:
+            raise body_too_large()
+        self.max_size = max_size
+        self.size = 0
+        self.body = request.stream().__aiter__()
+        self.parser = MultipartParser(params[b"boundary"], {
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_end": self.on_end
+        })
+        self.events: Deque[Tuple[str, Any]] = deque()
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.received = False
+        self.complete = False
+    
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self.events.append(("data", data[start:end]))
+    
+    def on_part_end(self) -> None:
+        self.events.append(("part_end", None))
+    
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+    
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+    
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+    
+    def on_headers_finished(self) -> None:
+        self.events.append(("part", self.headers))
+        self.headers = {}
+    
+    def on_end(self) -> None:
+        self.complete = True
+    
+    async def next_event(self) -> Tuple[str, Any]:
+        while not self.events:
+            if self.received:
+                if not self.complete:
+                    raise HTTPException(status_code=400, detail="Incomplete multipart body")
+                return ("end", None)
+            try:
+                chunk = await self.body.__anext__()
+            except StopAsyncIteration:
+                self.received = True
+                self.parser.finalize()
+                continue
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise body_too_large()
+            try:
+                self.parser.write(chunk)
+            except MultipartParseError as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+        return self.events.popleft()
+    
+    async def read_part(self, size: int) -> bytes:
+        """Data of the current part, joining what's already parsed up to size bytes"""
+        kind, data = await self.next_event()
+        if kind != "data":
+            return b""
+        while self.events and self.events[0][0] == "data" and (size < 0 or len(data) < size):
+            data += self.events.popleft()[1]
+        return data
+    
+    async def files(self) -> AsyncIterator[UploadPart]:
+        """The file parts in order; form fields are skipped"""
+        while True:
+            kind, headers = await self.next_event()
+            if kind == "end":
+                return
+            if kind != "part":
+                continue
+            _, options = parse_options_header(headers.get(b"content-disposition", b""))
+            part = UploadPart(
+                self,
+                options.get(b"name", b"").decode("utf-8", "replace"),
+                options.get(b"filename", b"").decode("utf-8", "replace"),
+                headers[b"content-type"].decode("latin-1") if b"content-type" in headers else None
+            )
+            if b"filename" in options:
+                yield part
+            # Whatever the handler didn't read
+            await part.drain()
+
+
+# The body is parsed by the handlers, so the form is described here for the docs
+UPLOAD_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"]
+        }}}
+    }
+}
+UPLOAD_MULTIPLE_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+            "required": ["files"]
+        }}}
+    }
+}
+
+
+@router.post("/upload", openapi_extra=UPLOAD_SCHEMA)
+async def upload_file(
+    request: Request,
+    store: FileStore = Depends(get_file_store),
+    ingester: DocumentIngester = Depends(get_document_ingester)
+):
+    """Upload a single file
+    
+    The upload is streamed from the request body to disk in chunks and
+    hashed on the way; content that was uploaded before is stored only once.
+    Text is extracted from documents in the background; follow it with
+    GET /api/files/{id}/document.
+    """
+    async for file in MultipartReader(request, MAX_FILE_SIZE + MAX_PART_OVERHEAD).files():
+        if file.name == "file":
+            return await save_upload(file, store, ingester)
+    raise HTTPException(status_code=400, detail="No file uploaded")
+
+
+async def save_upload(file: UploadPart, store: FileStore, ingester: DocumentIngester) -> dict:
+    """Store one uploaded file, stopping as soon as it passes MAX_FILE_SIZE"""
     try:
         # Validate file type
         if not is_allowed_file_type(file.content_type):
@@ -63,50 +348,50 @@ async def upload_file(file: UploadFile = File(...)):
                 detail=f"File type {file.content_type} is not allowed"
             )
         
-        # Check file size
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB"
-            )
-        
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{file_id}{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        
         # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
+        try:
+            record = await store.put(file.read, file.filename, file.content_type, MAX_FILE_SIZE)
+        except FileTooLarge:
+            raise file_too_large()
+        
+        logger.info(f"File uploaded: {file.filename} -> {record['id']} ({record['digest'][:12]})")
         
-        logger.info(f"File uploaded: {file.filename} -> {unique_filename}")
+        category = get_file_category(file.content_type)
+        document = None
+        if category == "document":
+            document = await ingester.submit(record)
         
         return {
-            "id": file_id,
+            "id": record["id"],
             "filename": file.filename,
-            "url": f"/api/files/{file_id}",
-            "size": len(file_content),
+            "url": f"/api/files/{record['id']}",
+            "size": record["size"],
             "type": file.content_type,
-            "category": get_file_category(file.content_type)
+            "category": category,
+            "document": document_view(document)
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
 
-@router.post("/upload-multiple")
-async def upload_multiple_files(files: List[UploadFile] = File(...)):
+@router.post("/upload-multiple", openapi_extra=UPLOAD_MULTIPLE_SCHEMA)
+async def upload_multiple_files(
+    request: Request,
+    store: FileStore = Depends(get_file_store),
+    ingester: DocumentIngester = Depends(get_document_ingester)
+):
     """Upload multiple files"""
-    if len(files) > 10:  # Limit to 10 files per request
-        raise HTTPException(status_code=400, detail="Maximum 10 files allowed per request")
-    
     results = []
-    for file in files:
+    async for file in MultipartReader(request, MAX_FILES * (MAX_FILE_SIZE + MAX_PART_OVERHEAD)).files():
         try:
-            result = await upload_file(file)
+            # Files past the limit are skipped, not stored
+            if len(results) >= MAX_FILES:
+                raise HTTPException(status_code=400, detail=f"Maximum {MAX_FILES} files allowed per request")
+            result = await save_upload(file, store, ingester)
             results.append(result)
         except HTTPException as e:
             results.append({
@@ -115,70 +400,374 @@ async def upload_multiple_files(files: List[UploadFile] = File(...)):
                 "status_code": e.status_code
             })
     
+    if not results:
+        raise HTTPException(status_code=400, detail="No files uploaded")
     return {"files": results}
 
 
-@router.get("/{file_id}")
-async def get_file(file_id: str):
-    """Get a file by ID"""
+@router.get("/stats")
+async def get_file_stats(
+    store: FileStore = Depends(get_file_store),
+    ingester: DocumentIngester = Depends(get_document_ingester)
+):
+    """Storage statistics, including space saved by deduplication"""
+    return {
+        **await store.get_stats(),
+        "ingestion": ingester.get_stats(),
+        "retrieval": await retriever.get_stats() if retriever else None
+    }
+
+
+@router.get("/search")
+async def search_documents(
+    q: str = Query(..., min_length=1),
+    k: int = Query(8, ge=1, le=100),
+    file_id: Optional[List[str]] = Query(None)
+):
+    """Find the passages of uploaded documents closest in meaning to q
+    
+    Repeat file_id to search only those files. Needs RETRIEVAL_ENABLED.
+    """
+    searcher = await get_retriever()
+    if searcher is None:
+        raise HTTPException(status_code=503, detail="Retrieval is not enabled")
+    
+    chunks = await searcher.search(q, k, file_ids=file_id)
+    return {
+        "query": q,
+        "results": [
+            {
+                "chunk_id": chunk["id"],
+                "filename": chunk["filename"],
+                "section": chunk["section"],
+                "seq": chunk["seq"],
+                "score": round(chunk["score"], 4),
+                "tokens": chunk["tokens"],
+                "content": chunk["content"]
+            }
+            for chunk in chunks
+        ]
+    }
+
+
+@router.get("/{file_id}/document")
+async def get_document_status(file_id: str, store: FileStore = Depends(get_file_store)):
+    """Ingestion status and progress of an uploaded document"""
+    record = await store.get(file_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    document = await store.get_document(record["digest"])
+    if document is None:
+        raise HTTPException(status_code=404, detail="File is not a document")
+    return {"id": file_id, "filename": record["filename"], **document_view(document)}
+
+
+@router.get("/{file_id}/chunks")
+async def get_document_chunks(
+    file_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    store: FileStore = Depends(get_file_store)
+):
+    """Text chunks extracted from an uploaded document"""
+    record = await store.get(file_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    document = await store.get_document(record["digest"])
+    if document is None or document["status"] != "ready":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Document is {document['status']}" if document else "File is not a document"
+        )
+    
+    chunks = await store.get_chunks(record["digest"], offset, limit)
+    return {
+        "id": file_id,
+        "total": document["chunk_count"],
+        "chunks": [
+            {key: chunk[key] for key in ("seq", "section", "content", "tokens")}
+            for chunk in chunks
+        ]
+    }
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a Range header into sorted, merged (start, end) byte ranges, end inclusive
+    
+    Returns None when the header should be ignored (malformed, not bytes,
+    too many ranges) and raises RangeNotSatisfiable when no range overlaps
+    the file.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def modified_since(request: Request, header: str, modified_at: float) -> Optional[bool]:
+    """Compare a date header with modified_at; None when absent or unparseable"""
+    value = request.headers.get(header)
+    if not value:
+        return None
     try:
-        # Find file with this ID
-        for file_path in UPLOAD_DIR.glob(f"{file_id}.*"):
-            if file_path.is_file():
-                return FileResponse(
-                    path=str(file_path),
-                    filename=file_path.name,
-                    media_type="application/octet-stream"
-                )
+        return int(modified_at) > parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class FileRangeResponse(FileResponse):
+    """File response for the whole file or a set of byte ranges
+    
+    Several ranges are sent as multipart/byteranges. When the server
+    supports the ASGI path send or zero-copy send extensions, the file is
+    handed to the server to send with sendfile(); otherwise it's read in
+    large chunks from a worker thread.
+    """
+    
+    chunk_size = 1024 * 1024
+    
+    def __init__(
+        self,
+        path: Path,
+        size: int,
+        ranges: Optional[List[Tuple[int, int]]] = None,
+        **kwargs
+    ):
+        super().__init__(path, **kwargs)
+        self.size = size
+        self.ranges = ranges
+        self.parts: List[Tuple[bytes, int, int]] = []
+        self.closing = b""
         
-        raise HTTPException(status_code=404, detail="File not found")
+        if not ranges:
+            self.parts.append((b"", 0, size))
+            self.headers["content-length"] = str(size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.parts.append((b"", start, end - start + 1))
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            self.status_code = 206
+            boundary = uuid.uuid4().hex
+            media_type = self.media_type
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            for start, end in ranges:
+                preamble = (
+                    f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+                self.parts.append((preamble, start, end - start + 1))
+            self.closing = f"\r\n--{boundary}--\r\n".encode()
+            length = sum(len(preamble) + count for preamble, _, count in self.parts) + len(self.closing)
+            self.headers["content-length"] = str(length)
+    
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        # Length, ETag and Last-Modified come from the file's metadata
+        pass
     
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        
+        extensions = scope.get("extensions") or {}
+        if not self.ranges and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        
+        zerocopy = "http.response.zerocopysend" in extensions
+        
+        with open(self.path, "rb") as file:
+            for index, (preamble, offset, count) in enumerate(self.parts):
+                last = index == len(self.parts) - 1 and not self.closing
+                if preamble:
+                    await send({"type": "http.response.body", "body": preamble, "more_body": True})
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": offset,
+                        "count": count,
+                        "more_body": not last
+                    })
+                else:
+                    await self.send_chunks(send, file, offset, count, last)
+            if self.closing:
+                await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+    
+    async def send_chunks(self, send: Send, file, offset: int, count: int, last: bool) -> None:
+        if count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": not last})
+            return
+        while count > 0:
+            chunk = await anyio.to_thread.run_sync(os.pread, file.fileno(), min(self.chunk_size, count), offset)
+            if not chunk:
+                raise RuntimeError(f"File at path {self.path} is shorter than expected")
+            offset += len(chunk)
+            count -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": count > 0 or not last})
+
+
+def file_media_type(record: dict) -> str:
+    """The stored MIME type, or one guessed from the filename"""
+    content_type = record["content_type"]
+    if not content_type or content_type == "application/octet-stream":
+        content_type = mimetypes.guess_type(record["filename"])[0] or "application/octet-stream"
+    return content_type
+
+
+@router.api_route("/{file_id}", methods=["GET", "HEAD"])
+async def get_file(
+    file_id: str,
+    request: Request,
+    download: bool = Query(False),
+    store: FileStore = Depends(get_file_store)
+):
+    """Get a file by ID
+    
+    Supports byte ranges (206), conditional requests (304) and caching:
+    file contents never change, so the ETag is the content digest.
+    """
+    try:
+        record = await store.get(file_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        etag = f'"{record["digest"]}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(record["created_at"], usegmt=True),
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "Accept-Ranges": "bytes",
+            "X-Content-Type-Options": "nosniff"
+        }
+        
+        # If-Modified-Since only counts when there's no If-None-Match
+        if request.headers.get("if-none-match"):
+            not_modified = etag_matches(request, etag)
+        else:
+            not_modified = modified_since(request, "if-modified-since", record["created_at"]) is False
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        
+        ranges = None
+        range_header = request.headers.get("range")
+        if range_header:
+            # If-Range: only send the ranges if the file is the one the client has
+            if_range = request.headers.get("if-range")
+            if if_range is None or if_range.strip() == etag or (
+                not if_range.startswith(("\"", "W/")) and
+                modified_since(request, "if-range", record["created_at"]) is False
+            ):
+                try:
+                    ranges = parse_ranges(range_header, record["size"])
+                except RangeNotSatisfiable:
+                    return Response(
+                        status_code=416,
+                        headers={**headers, "Content-Range": f"bytes */{record['size']}"}
+                    )
+        
+        media_type = file_media_type(record)
+        inline = not download and (media_type in INLINE_TYPES or media_type.startswith(INLINE_PREFIXES))
+        return FileRangeResponse(
+            record["path"],
+            record["size"],
+            ranges,
+            headers=headers,
+            media_type=media_type,
+            filename=record["filename"],
+            method=request.method,
+            content_disposition_type="inline" if inline else "attachment"
+        )
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving file {file_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving file: {str(e)}")
 
 
 @router.delete("/{file_id}")
-async def delete_file(file_id: str):
+async def delete_file(file_id: str, store: FileStore = Depends(get_file_store)):
     """Delete a file by ID"""
     try:
-        # Find and delete file with this ID
-        deleted = False
-        for file_path in UPLOAD_DIR.glob(f"{file_id}.*"):
-            if file_path.is_file():
-                file_path.unlink()
-                deleted = True
-                logger.info(f"File deleted: {file_path.name}")
-        
-        if not deleted:
+        # The stored content goes with the last file that uses it
+        if not await store.delete(file_id):
             raise HTTPException(status_code=404, detail="File not found")
         
+        logger.info(f"File deleted: {file_id}")
         return {"message": "File deleted successfully"}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting file {file_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
 
 
 @router.get("/")
-async def list_files():
+async def list_files(store: FileStore = Depends(get_file_store)):
     """List all uploaded files"""
     try:
         files = []
-        for file_path in UPLOAD_DIR.glob("*"):
-            if file_path.is_file():
-                stat = file_path.stat()
-                file_id = file_path.stem
-                files.append({
-                    "id": file_id,
-                    "filename": file_path.name,
-                    "url": f"/api/files/{file_id}",
-                    "size": stat.st_size,
-                    "created_at": stat.st_ctime
-                })
+        for record in await store.list_files():
+            files.append({
+                "id": record["id"],
+                "filename": record["filename"],
+                "url": f"/api/files/{record['id']}",
+                "size": record["size"],
+                "type": record["content_type"],
+                "created_at": record["created_at"],
+                "document_status": record["document_status"]
+            })
         
         return {"files": files}
     
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
@@ -0,0 +1,142 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, AsyncGenerator, Dict
+from app.models import ChatRequest
+from app.agents import JobQueue
+from app.storage.jobs import create_job_broker, job_view, SUCCEEDED, FINISHED
+from app.config import settings
+from .chat import get_chat_agent, request_context, dumps
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# Global job queue instance
+job_queue = None
+
+
+async def get_job_queue() -> JobQueue:
+    """Get or create the job queue and start its workers"""
+    global job_queue
+    if not job_queue:
+        agent = await get_chat_agent()
+        broker = create_job_broker(
+            settings.job_broker,
+            database_url=settings.job_database_url or settings.database_url,
+            redis_url=settings.redis_url,
+            max_attempts=settings.job_max_attempts,
+            retention=settings.job_retention
+        )
+        job_queue = JobQueue(
+            agent,
+            broker,
+            workers=settings.job_workers,
+            lease=settings.job_lease,
+            poll_interval=settings.job_poll_interval,
+            progress_interval=settings.job_progress_interval
+        )
+        await job_queue.start()
+    return job_queue
+
+
+async def get_job(queue: JobQueue, job_id: str) -> Dict[str, Any]:
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post("/", status_code=202)
+async def submit_job(
+    request: ChatRequest,
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Queue a chat request and return its job id right away"""
+
+    context = request_context(request, stream=True)
+    # Below every interactive request, keeping the jobs' relative priority
+    context["priority"] = request.priority - 10
+
+    job = await queue.submit(request.messages, context, priority=request.priority)
+    return job_view(job)
+
+
+@router.get("/stats")
+async def get_job_stats(
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Get worker and queue statistics"""
+
+    return {**queue.get_stats(), "jobs": await queue.broker.counts()}
+
+
+@router.get("/{job_id}")
+async def get_job_status(
+    job_id: str,
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Get a job's status and progress (the reply so far)"""
+
+    return job_view(await get_job(queue, job_id))
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Stream a job's status and progress as Server-Sent Events until it finishes"""
+
+    await get_job(queue, job_id)
+
+    async def events() -> AsyncGenerator[bytes, None]:
+        updates = queue.watch(job_id)
+        try:
+            async for job in updates:
+                event = job_view(job)
+                if job["status"] == SUCCEEDED:
+                    event["result"] = job["result"]
+                yield b"data: " + dumps(jsonable_encoder(event)) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+        finally:
+            await updates.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Get a finished job's reply
+
+    Returns 202 with the job's status while it is still queued or running,
+    and 409 if it failed or was cancelled.
+    """
+
+    job = await get_job(queue, job_id)
+    if job["status"] == SUCCEEDED:
+        return job["result"]
+    if job["status"] in FINISHED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job {job_id} {job['status']}" + (f": {job['error']}" if job["error"] else "")
+        )
+    return JSONResponse(
+        jsonable_encoder(job_view(job)),
+        status_code=202,
+        headers={"Retry-After": str(max(int(settings.job_poll_interval), 1))}
+    )
+
+
+@router.delete("/{job_id}")
+async def cancel_job(
+    job_id: str,
+    queue: JobQueue = Depends(get_job_queue)
+):
+    """Cancel a queued or running job"""
+
+    job = await queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_view(job)
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from app.agents import ChatAgent
+from app.providers import http_pools
+from app.routes.chat import get_chat_agent
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("/")
+async def get_metrics(
+    agent: ChatAgent = Depends(get_chat_agent)
+):
+    """Get runtime metrics for sizing the backend against real load"""
+    
+    return agent.get_metrics()
+
+
+@router.get("/pools")
+async def get_pool_metrics():
+    """Get connection pool statistics per upstream"""
+    
+    return http_pools.get_stats()
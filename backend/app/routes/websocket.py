@@ -0,0 +1,196 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import logging
+from app.models import ChatRequest
+from app.agents import ChatAgent, AdmissionRejected
+from app.agents.streaming import coalesce_chunks
+from app.config import settings
+from .chat import get_chat_agent, request_context, dumps
+
+router = APIRouter(prefix="/api/chat", tags=["chat"])
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    """One stream on a WebSocket, with its flow control credits"""
+
+    def __init__(self, credits: int):
+        self.credits = credits
+        self.has_credit = asyncio.Event()
+        self.has_credit.set()
+        self.task: Optional[asyncio.Task] = None
+
+    def grant(self, credits: int) -> None:
+        self.credits += credits
+        if self.credits > 0:
+            self.has_credit.set()
+
+    async def spend(self) -> None:
+        """Wait until the client allows another message"""
+        while self.credits <= 0:
+            self.has_credit.clear()
+            await self.has_credit.wait()
+        self.credits -= 1
+
+
+class ChatSession:
+    """Chat generations multiplexed over one WebSocket
+
+    Client messages (JSON):
+        {"type": "start", "id": "s1", "request": {...ChatRequest...}}
+        {"type": "cancel", "id": "s1"}
+        {"type": "credit", "id": "s1", "credits": 32}
+
+    Server messages:
+        {"type": "started", "id": "s1", "conversation_id": "..."}
+        {"type": "chunk", "id": "s1", "content": "..."}
+        {"type": "done", "id": "s1"}
+        {"type": "error", "id": "s1", "error": "...", "retry_after": 5}
+
+    Each stream may have `window` chunk messages in flight; the client
+    returns credits as it consumes them. A stream out of credits waits until
+    more arrive; with token coalescing on, text generated in the meantime is
+    merged into the next chunk.
+    """
+
+    def __init__(self, websocket: WebSocket, agent: ChatAgent):
+        self.websocket = websocket
+        self.agent = agent
+        self.window = settings.websocket_stream_window
+        self.max_streams = settings.websocket_max_streams
+        self.generations: Dict[str, Generation] = {}
+        self.send_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    await self.send({"type": "error", "id": None, "error": "Invalid JSON"})
+                    continue
+                await self.handle(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # Cancelling stops and stores each generation like an SSE disconnect
+            tasks = [g.task for g in self.generations.values() if g.task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle(self, message: Any) -> None:
+        if not isinstance(message, dict):
+            await self.send({"type": "error", "id": None, "error": "Messages must be JSON objects"})
+            return
+
+        kind = message.get("type")
+        stream_id = message.get("id")
+        # Checked before the lookup: an unhashable id would end the session
+        if not isinstance(stream_id, str) or not stream_id:
+            await self.send({"type": "error", "id": None, "error": "Stream id must be a non-empty string"})
+            return
+        generation = self.generations.get(stream_id)
+
+        if kind == "start":
+            await self.start(stream_id, message.get("request"))
+        elif kind == "cancel":
+            if generation and generation.task:
+                generation.task.cancel()
+        elif kind == "credit":
+            credits = message.get("credits")
+            if not isinstance(credits, int) or credits < 0:
+                await self.send({"type": "error", "id": stream_id, "error": "credits must be a non-negative integer"})
+            elif generation:
+                generation.grant(credits)
+        else:
+            await self.send({"type": "error", "id": stream_id, "error": f"Unknown message type: {kind}"})
+
+    async def start(self, stream_id: str, data: Any) -> None:
+        if stream_id in self.generations:
+            await self.send({"type": "error", "id": stream_id, "error": "Stream id already in use"})
+            return
+        if len(self.generations) >= self.max_streams:
+            await self.send({
+                "type": "error",
+                "id": stream_id,
+                "error": f"At most {self.max_streams} concurrent streams per connection"
+            })
+            return
+
+        try:
+            request = ChatRequest.model_validate(data)
+        except ValidationError as e:
+            await self.send({"type": "error", "id": stream_id, "error": str(e)})
+            return
+
+        generation = Generation(self.window)
+        self.generations[stream_id] = generation
+        generation.task = asyncio.create_task(self.generate(stream_id, generation, request))
+
+    async def generate(self, stream_id: str, generation: Generation, request: ChatRequest) -> None:
+        stream = None
+        try:
+            result = await self.agent.process_messages(
+                request.messages,
+                request_context(request, stream=True)
+            )
+            await self.send({
+                "type": "started",
+                "id": stream_id,
+                "conversation_id": result["conversation_id"]
+            })
+
+            stream = coalesce_chunks(
+                result["stream"],
+                settings.stream_flush_interval_ms / 1000,
+                settings.stream_flush_bytes
+            )
+            async for chunk in stream:
+                await generation.spend()
+                await self.send({"type": "chunk", "id": stream_id, "content": chunk})
+
+            await self.send({"type": "done", "id": stream_id})
+        except asyncio.CancelledError:
+            await self.send_quietly({"type": "done", "id": stream_id, "cancelled": True})
+            raise
+        except AdmissionRejected as e:
+            await self.send_quietly({
+                "type": "error",
+                "id": stream_id,
+                "error": str(e),
+                "retry_after": e.retry_after
+            })
+        except Exception as e:
+            logger.error(f"WebSocket generation {stream_id} failed: {e}")
+            await self.send_quietly({"type": "error", "id": stream_id, "error": str(e)})
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            self.generations.pop(stream_id, None)
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        data = dumps(message)
+        async with self.send_lock:
+            await self.websocket.send_text(data.decode())
+
+    async def send_quietly(self, message: Dict[str, Any]) -> None:
+        """Send unless the socket is already gone"""
+        try:
+            await self.send(message)
+        except Exception:
+            pass
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Run any number of chat generations over one WebSocket"""
+
+    agent = await get_chat_agent()
+    await websocket.accept()
+    await ChatSession(websocket, agent).run()
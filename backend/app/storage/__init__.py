@@ -0,0 +1,5 @@
+from .conversations import ConversationStore
+from .files import FileStore, FileTooLarge
+from .jobs import SQLiteJobBroker, RedisJobBroker, create_job_broker
+
+__all__ = ["ConversationStore", "FileStore", "FileTooLarge", "SQLiteJobBroker", "RedisJobBroker", "create_job_broker"]
@@ -0,0 +1,635 @@
+import asyncio
+import base64
+import json
+import sqlite3
+import threading
+import unicodedata
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_TOKENS = 16
+PREVIEW_CHARS = 120
+# Failed flushes of a batch before its writes are retried one at a time
+MAX_BATCH_ATTEMPTS = 3
+# Errors of the database rather than of a statement (sqlite3 error names, 3.11+)
+DATABASE_ERRORS = ("SQLITE_BUSY", "SQLITE_LOCKED", "SQLITE_FULL", "SQLITE_IOERR", "SQLITE_READONLY", "SQLITE_CANTOPEN")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        metadata TEXT NOT NULL DEFAULT '{}'
+    )""",
+    # Listing walks this index newest first
+    "CREATE INDEX IF NOT EXISTS idx_conversations_recent ON conversations (updated_at DESC, id DESC)",
+    """CREATE TABLE IF NOT EXISTS messages (
+        pk INTEGER PRIMARY KEY,
+        conversation_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        id TEXT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp REAL,
+        metadata TEXT,
+        UNIQUE (conversation_id, seq)
+    )""",
+]
+
+# Combining vowel signs and viramas of the Indic scripts (Tamil, Devanagari, ...).
+# unicode61 treats them as separators by default, which splits every word
+# written in these scripts; as token characters they stay part of the word.
+INDIC_MARKS = "".join(
+    chr(code) for code in range(0x0900, 0x0E00)
+    if unicodedata.category(chr(code)) in ("Mn", "Mc")
+)
+
+# Full-text index over message content, kept in sync by triggers
+SEARCH_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        content='messages',
+        content_rowid='pk',
+        tokenize="unicode61 remove_diacritics 2 tokenchars '{INDIC_MARKS}'",
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.pk, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.pk, old.content);
+    END""",
+]
+
+
+def sqlite_path(database_url: str) -> str:
+    """Get the file path from a sqlite:/// URL"""
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        raise ValueError(f"Unsupported database URL (only SQLite is supported): {database_url}")
+    return database_url[len(prefix):] or ":memory:"
+
+
+def fts_query(query: str) -> str:
+    """Turn free text into an FTS5 query of quoted prefix terms"""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"*' for term in terms if term.strip('"'))
+
+
+def encode_cursor(updated_at: float, conversation_id: str) -> str:
+    raw = json.dumps([updated_at, conversation_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, conversation_id = json.loads(raw)
+        return float(updated_at), str(conversation_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def to_epoch(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def from_epoch(value: Optional[float]) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(value) if value is not None else None
+
+
+class ConversationStore:
+    """SQLite-backed conversation and message storage
+
+    The database runs in WAL mode so several workers can share it. Writes are
+    queued and committed in batches by a background task; a bounded LRU cache
+    of conversations sits in front of the database so active conversations
+    are served without a round trip. With more than one worker, set
+    validate_cache so cached conversations pick up other workers' writes.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        cache_size: int = 500,
+        flush_interval: float = 0.5,
+        flush_batch_size: int = 500,
+        validate_cache: bool = False
+    ):
+        self.path = sqlite_path(database_url)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.validate_cache = validate_cache
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.pending: List[Tuple[str, tuple, Optional[Tuple[str, int]]]] = []
+        self.flush_event: Optional[asyncio.Event] = None
+        self.flush_lock = asyncio.Lock()
+        self.writer_task: Optional[asyncio.Task] = None
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stale_reloads = 0
+        self.batches_written = 0
+        self.failed_flushes = 0
+        self.dropped_writes = 0
+        self.batch_attempts = 0
+
+    async def initialize(self) -> None:
+        """Open the database, create the schema and start the writer"""
+
+        self.db = await asyncio.to_thread(self._connect)
+        self.flush_event = asyncio.Event()
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        for statement in SCHEMA:
+            db.execute(statement)
+        indexed = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        for statement in SEARCH_SCHEMA:
+            db.execute(statement)
+        if not indexed:
+            # Index messages stored before search was added
+            db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        db.commit()
+        return db
+
+    async def close(self) -> None:
+        """Flush pending writes and close the database"""
+
+        if self.writer_task:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+            self.writer_task = None
+        await self.flush()
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+            self.db = None
+
+    # Writes
+
+    def _queue(self, sql: str, params: tuple, expected: Optional[Tuple[str, int]] = None) -> None:
+        self.pending.append((sql, params, expected))
+        if len(self.pending) >= self.flush_batch_size and self.flush_event:
+            self.flush_event.set()
+
+    async def _writer(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing conversations: {e}")
+
+    async def flush(self) -> None:
+        """Commit all queued writes in one transaction"""
+
+        if not self.pending or self.db is None:
+            return
+        # Serialize flushes so batches commit in the order they were queued
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            try:
+                stale = await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                self.failed_flushes += 1
+                self.batch_attempts += 1
+                if self.batch_attempts < MAX_BATCH_ATTEMPTS:
+                    # Put the batch back so it's retried with the next flush
+                    self.pending = batch + self.pending
+                    raise
+                # Keeps failing, likely on one bad write: don't let it hold up the rest
+                stale, unwritten = await asyncio.to_thread(self._write_each, batch)
+                self.pending = unwritten + self.pending
+            self.batch_attempts = 0
+            self.batches_written += 1
+            # Another worker appended to these first; reload them on next use
+            for conversation_id in stale:
+                self.cache.pop(conversation_id, None)
+                self.stale_reloads += 1
+
+    def _write_batch(self, batch: List[Tuple[str, tuple, Optional[Tuple[str, int]]]]) -> set:
+        """Run a batch in one transaction
+
+        Returns the conversations whose messages got other positions than
+        the cached copy expected.
+        """
+
+        stale = set()
+        with self.db_lock:
+            with self.db:
+                for sql, params, expected in batch:
+                    cursor = self.db.execute(sql, params)
+                    if expected is not None:
+                        conversation_id, seq = expected
+                        if cursor.fetchone()[0] != seq:
+                            stale.add(conversation_id)
+        return stale
+
+    def _write_each(
+        self,
+        batch: List[Tuple[str, tuple, Optional[Tuple[str, int]]]]
+    ) -> Tuple[set, List[Tuple[str, tuple, Optional[Tuple[str, int]]]]]:
+        """Write a batch one statement at a time, dropping the ones that fail
+
+        Stops at an error of the database itself (locked, disk full) rather
+        than of a statement, returning what is left unwritten to try later.
+        Conversations that lost a message are reloaded on next use.
+        """
+
+        stale = set()
+        for position, (sql, params, expected) in enumerate(batch):
+            try:
+                stale |= self._write_batch([(sql, params, expected)])
+            except sqlite3.OperationalError as e:
+                if getattr(e, "sqlite_errorname", "SQLITE_BUSY").startswith(DATABASE_ERRORS):
+                    return stale, batch[position:]
+                self._drop(e, expected, stale)
+            except Exception as e:
+                self._drop(e, expected, stale)
+        return stale, []
+
+    def _drop(self, error: Exception, expected: Optional[Tuple[str, int]], stale: set) -> None:
+        self.dropped_writes += 1
+        logger.error(f"Dropping a conversation write that keeps failing: {error}")
+        if expected is not None:
+            stale.add(expected[0])
+
+    def _queue_conversation(self, conversation: Dict[str, Any]) -> None:
+        self._queue(
+            "INSERT INTO conversations (id, created_at, updated_at, message_count, metadata) "
+            "VALUES (?, ?, ?, "
+            "COALESCE((SELECT MAX(seq) FROM messages WHERE conversation_id = ?), -1) + 1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET "
+            "updated_at = excluded.updated_at, message_count = excluded.message_count, "
+            "metadata = excluded.metadata",
+            (
+                conversation["id"],
+                to_epoch(conversation["created_at"]),
+                to_epoch(conversation["updated_at"]),
+                conversation["id"],
+                json.dumps(conversation["metadata"], ensure_ascii=False)
+            )
+        )
+
+    def _remember(self, conversation: Dict[str, Any]) -> None:
+        self.cache[conversation["id"]] = conversation
+        self.cache.move_to_end(conversation["id"])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # Reads
+
+    async def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Get a conversation with its messages"""
+
+        if self.validate_cache and conversation_id in self.cache:
+            # Writing our own queued messages may show the copy is stale
+            await self.flush()
+        conversation = self.cache.get(conversation_id)
+        if conversation is not None:
+            self.cache.move_to_end(conversation_id)
+            self.cache_hits += 1
+            if self.validate_cache:
+                await self._refresh(conversation)
+            return conversation
+
+        self.cache_misses += 1
+        await self.flush()
+        conversation = await asyncio.to_thread(self._load, conversation_id)
+        # Another request may have loaded or created it while we waited
+        if conversation_id in self.cache:
+            return self.cache[conversation_id]
+        if conversation is not None:
+            self._remember(conversation)
+        return conversation
+
+    def _load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT id, created_at, updated_at, metadata FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self.db.execute(
+                "SELECT id, role, content, timestamp, metadata FROM messages "
+                "WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,)
+            ).fetchall()
+
+        return {
+            "id": row[0],
+            "messages": [self._message(r) for r in rows],
+            "created_at": from_epoch(row[1]),
+            "updated_at": from_epoch(row[2]),
+            "metadata": json.loads(row[3])
+        }
+
+    def _message(self, row: tuple) -> Message:
+        return Message(
+            id=row[0],
+            role=row[1],
+            content=row[2],
+            timestamp=from_epoch(row[3]),
+            metadata=json.loads(row[4]) if row[4] else None
+        )
+
+    async def _refresh(self, conversation: Dict[str, Any]) -> None:
+        """Pick up messages other workers added to a cached conversation"""
+
+        await self.flush()
+        known = len(conversation["messages"])
+        update = await asyncio.to_thread(self._load_since, conversation["id"], known)
+        if update is None:
+            return
+        updated_at, metadata, rows = update
+        conversation["messages"].extend(self._message(r) for r in rows)
+        conversation["updated_at"] = from_epoch(updated_at)
+        conversation["metadata"] = json.loads(metadata)
+
+    def _load_since(self, conversation_id: str, known: int) -> Optional[tuple]:
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT updated_at, metadata, message_count FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+            if row is None or row[2] <= known:
+                return None
+            rows = self.db.execute(
+                "SELECT id, role, content, timestamp, metadata FROM messages "
+                "WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+                (conversation_id, known)
+            ).fetchall()
+        return row[0], row[1], rows
+
+    # Conversation operations
+
+    async def get_or_create(self, conversation_id: str) -> Dict[str, Any]:
+        """Get a conversation, creating an empty one if it doesn't exist
+
+        A new conversation is only cached; its row is written with its first
+        messages, so reads never leave empty conversations behind.
+        """
+
+        conversation = await self.get(conversation_id)
+        if conversation is None:
+            now = datetime.utcnow()
+            conversation = {
+                "id": conversation_id,
+                "messages": [],
+                "created_at": now,
+                "updated_at": now,
+                "metadata": {}
+            }
+            self._remember(conversation)
+        return conversation
+
+    async def append_messages(self, conversation_id: str, messages: List[Message]) -> Dict[str, Any]:
+        """Append messages to a conversation
+
+        Positions are assigned when the batch is written, after whatever
+        other workers stored first; if that differs from the cached copy,
+        the conversation is dropped from the cache and reloaded on next use.
+        """
+
+        conversation = await self.get_or_create(conversation_id)
+        known = len(conversation["messages"])
+
+        for offset, message in enumerate(messages):
+            if not message.id:
+                message.id = str(uuid.uuid4())
+            self._queue(
+                "INSERT INTO messages "
+                "(conversation_id, seq, id, role, content, timestamp, metadata) "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ?, ?, ? "
+                "FROM messages WHERE conversation_id = ? RETURNING seq",
+                (
+                    conversation_id,
+                    message.id,
+                    message.role,
+                    message.content,
+                    to_epoch(message.timestamp),
+                    json.dumps(message.metadata, ensure_ascii=False) if message.metadata else None,
+                    conversation_id
+                ),
+                (conversation_id, known + offset)
+            )
+
+        conversation["messages"].extend(messages)
+        conversation["updated_at"] = datetime.utcnow()
+        self._queue_conversation(conversation)
+        return conversation
+
+    async def update_metadata(self, conversation_id: str, **values: Any) -> Optional[Dict[str, Any]]:
+        """Update metadata fields (e.g. title) of an existing conversation"""
+
+        conversation = await self.get(conversation_id)
+        if conversation is None:
+            return None
+        conversation["metadata"].update(values)
+        conversation["updated_at"] = datetime.utcnow()
+        self._queue_conversation(conversation)
+        return conversation
+
+    async def delete(self, conversation_id: str) -> bool:
+        """Delete a conversation and its messages"""
+
+        if await self.get(conversation_id) is None:
+            return False
+        self.cache.pop(conversation_id, None)
+        self._queue("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        self._queue("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        await self.flush()
+        return True
+
+    async def list_conversations(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of conversation summaries, most recently updated first
+
+        Returns the page and the cursor of the next one (None on the last
+        page). Raises ValueError for a cursor this store didn't issue.
+        """
+
+        after = decode_cursor(cursor) if cursor else None
+        await self.flush()
+        rows = await asyncio.to_thread(self._list, limit + 1, after)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+
+        return [
+            {
+                "id": row[0],
+                "created_at": from_epoch(row[1]),
+                "updated_at": from_epoch(row[2]),
+                "message_count": row[3],
+                "metadata": json.loads(row[4]),
+                "preview": row[5]
+            }
+            for row in rows
+        ], next_cursor
+
+    async def list_version(self, cursor: Optional[str] = None) -> Tuple[Optional[float], int]:
+        """Latest update time and number of conversations
+
+        Every change that shows in a listing moves one of these, so together
+        with the page parameters they identify a page without reading it.
+        Raises ValueError like list_conversations.
+        """
+
+        if cursor:
+            decode_cursor(cursor)
+        await self.flush()
+        return await asyncio.to_thread(self._version)
+
+    def _version(self) -> Tuple[Optional[float], int]:
+        with self.db_lock:
+            updated_at, = self.db.execute(
+                "SELECT updated_at FROM conversations ORDER BY updated_at DESC, id DESC LIMIT 1"
+            ).fetchone() or (None,)
+            count, = self.db.execute("SELECT count(*) FROM conversations").fetchone()
+        return updated_at, count
+
+    def _list(self, limit: int, after: Optional[Tuple[float, str]]) -> List[tuple]:
+        sql = (
+            "SELECT c.id, c.created_at, c.updated_at, c.message_count, c.metadata, "
+            "substr(m.content, 1, ?) "
+            "FROM conversations c LEFT JOIN messages m "
+            "ON m.conversation_id = c.id AND m.seq = c.message_count - 1"
+        )
+        params: tuple = (PREVIEW_CHARS,)
+        if after:
+            sql += " WHERE (c.updated_at, c.id) < (?, ?)"
+            params += after
+        sql += " ORDER BY c.updated_at DESC, c.id DESC LIMIT ?"
+        params += (limit,)
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    async def search_messages(
+        self,
+        query: str,
+        conversation_id: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Full-text search over messages, best matches first
+
+        Every word of the query must match the start of a word in the
+        message, so "நீதி" also finds "நீதிமன்றத்தில்".
+        """
+
+        match = fts_query(query)
+        if not match:
+            return []
+        await self.flush()
+        rows = await asyncio.to_thread(self._search, match, conversation_id, limit, offset)
+        return [
+            {
+                "conversation_id": row[0],
+                "conversation_title": json.loads(row[1]).get("title", f"Conversation {row[0]}"),
+                "message_id": row[2],
+                "content": row[4],
+                "snippet": row[6],
+                "score": -row[7],
+                "role": row[3],
+                "timestamp": from_epoch(row[5])
+            }
+            for row in rows
+        ]
+
+    def _search(
+        self,
+        match: str,
+        conversation_id: Optional[str],
+        limit: int,
+        offset: int
+    ) -> List[tuple]:
+        sql = (
+            "SELECT m.conversation_id, c.metadata, m.id, m.role, m.content, m.timestamp, "
+            "snippet(messages_fts, 0, ?, ?, '…', ?), messages_fts.rank "
+            "FROM messages_fts "
+            "JOIN messages m ON m.pk = messages_fts.rowid "
+            "JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE messages_fts MATCH ?"
+        )
+        params: tuple = (HIGHLIGHT_START, HIGHLIGHT_END, SNIPPET_TOKENS, match)
+        if conversation_id:
+            sql += " AND m.conversation_id = ?"
+            params += (conversation_id,)
+        sql += " ORDER BY messages_fts.rank LIMIT ? OFFSET ?"
+        params += (limit, offset)
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    async def count_messages(self, query: str, conversation_id: Optional[str] = None) -> int:
+        """How many messages search_messages would find over all pages"""
+
+        match = fts_query(query)
+        if not match:
+            return 0
+        await self.flush()
+        return await asyncio.to_thread(self._count, match, conversation_id)
+
+    def _count(self, match: str, conversation_id: Optional[str]) -> int:
+        sql = (
+            "SELECT count(*) FROM messages_fts "
+            "JOIN messages m ON m.pk = messages_fts.rowid "
+            "JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE messages_fts MATCH ?"
+        )
+        params: tuple = (match,)
+        if conversation_id:
+            sql += " AND m.conversation_id = ?"
+            params += (conversation_id,)
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "cached_conversations": len(self.cache),
+            "cache_size": self.cache_size,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "stale_reloads": self.stale_reloads,
+            "pending_writes": len(self.pending),
+            "batches_written": self.batches_written,
+            "failed_flushes": self.failed_flushes,
+            "dropped_writes": self.dropped_writes
+        }
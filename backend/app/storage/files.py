@@ -0,0 +1,558 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .conversations import sqlite_path
+
+logger = logging.getLogger(__name__)
+
+FILE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS files (
+        id TEXT PRIMARY KEY,
+        digest TEXT NOT NULL REFERENCES blobs (digest),
+        filename TEXT NOT NULL,
+        content_type TEXT,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_files_created_at ON files (created_at DESC)",
+    # Extracted text, by content, so every upload of a document shares it
+    """CREATE TABLE IF NOT EXISTS documents (
+        digest TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        error TEXT,
+        progress_done INTEGER NOT NULL DEFAULT 0,
+        progress_total INTEGER NOT NULL DEFAULT 0,
+        chunk_count INTEGER NOT NULL DEFAULT 0,
+        token_count INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS document_chunks (
+        id INTEGER PRIMARY KEY,
+        digest TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        section TEXT,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        UNIQUE (digest, seq)
+    )""",
+    # Documents whose chunks are in the vector index, or being added to it by
+    # the worker holding the claim, and with which model
+    """CREATE TABLE IF NOT EXISTS document_embeddings (
+        digest TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        status TEXT NOT NULL,
+        worker TEXT,
+        lease_until REAL,
+        chunk_count INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )""",
+]
+
+# Document states; the last three are final
+DOCUMENT_PENDING = ("queued", "extracting", "chunking")
+DOCUMENT_FINAL = ("ready", "failed", "unsupported")
+
+CHUNK_SIZE = 1024 * 1024  # bytes held in memory per upload
+
+
+class FileTooLarge(Exception):
+    """The upload passed the size limit and was discarded"""
+    pass
+
+
+class FileStore:
+    """Content-addressed file storage with a SQLite metadata index
+
+    Each distinct content is stored once, under its SHA-256 digest, in
+    blobs/<first two hex digits>/<digest>. A file is an index row pointing at
+    a blob, so uploading the same content again only adds a row. Blobs count
+    the files referencing them and are removed with the last one.
+
+    Blob changes happen inside a write transaction, so workers sharing the
+    database never remove a blob another worker is adding a reference to.
+    """
+
+    def __init__(self, root: Path, database_url: str, chunk_size: int = CHUNK_SIZE):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        # On the same filesystem, so finished uploads are renamed into place
+        self.incoming_dir = self.root / ".incoming"
+        self.path = sqlite_path(database_url)
+        self.chunk_size = chunk_size
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+        self.deduplicated = 0
+
+    async def initialize(self) -> None:
+        """Open the index and move files from the old flat layout into it"""
+
+        self.db = await asyncio.to_thread(self._connect)
+        imported = await asyncio.to_thread(self._import_legacy)
+        if imported:
+            logger.info(f"Moved {imported} uploaded files into the blob store")
+
+    def _connect(self) -> sqlite3.Connection:
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        # Uploads interrupted by a crash
+        for leftover in self.incoming_dir.glob("*.part"):
+            leftover.unlink(missing_ok=True)
+
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        for statement in FILE_SCHEMA:
+            db.execute(statement)
+        db.commit()
+        return db
+
+    async def close(self) -> None:
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+            self.db = None
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    def _transaction(self, fn: Callable, *args) -> Any:
+        # IMMEDIATE takes the write lock up front, serializing blob changes across workers
+        with self.db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+            return result
+
+    # Writes
+
+    async def put(
+        self,
+        read: Callable[[int], Awaitable[bytes]],
+        filename: str,
+        content_type: Optional[str],
+        max_size: Optional[int] = None,
+        file_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Store content read in chunks from `read` and return the new file
+
+        The content is hashed while it's written to a temporary file from a
+        worker thread, so only one chunk is in memory at a time. Raises
+        FileTooLarge as soon as more than max_size bytes have been read.
+        """
+
+        temp = await asyncio.to_thread(
+            tempfile.NamedTemporaryFile, dir=self.incoming_dir, suffix=".part", delete=False
+        )
+        hasher = hashlib.sha256()
+        size = 0
+
+        def write(chunk: bytes) -> None:
+            hasher.update(chunk)
+            temp.write(chunk)
+
+        try:
+            while True:
+                chunk = await read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise FileTooLarge(f"File is larger than {max_size} bytes")
+                await asyncio.to_thread(write, chunk)
+            await asyncio.to_thread(temp.close)
+
+            record = {
+                "id": file_id or str(uuid.uuid4()),
+                "digest": hasher.hexdigest(),
+                "filename": filename,
+                "content_type": content_type,
+                "size": size,
+                "created_at": time.time()
+            }
+            await asyncio.to_thread(self._transaction, self._add, record, Path(temp.name))
+        finally:
+            await asyncio.to_thread(_discard, temp)
+
+        record["path"] = self.blob_path(record["digest"])
+        return record
+
+    def _add(self, record: Dict[str, Any], source: Path) -> None:
+        """Reference the blob for record's digest, moving source in if it's new"""
+
+        digest = record["digest"]
+        # First, so a duplicate id fails before anything is moved
+        self.db.execute(
+            "INSERT INTO files (id, digest, filename, content_type, size, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (record["id"], digest, record["filename"], record["content_type"],
+             record["size"], record["created_at"])
+        )
+        added = self.db.execute(
+            "UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,)
+        ).rowcount
+        if added:
+            self.deduplicated += 1
+        else:
+            path = self.blob_path(digest)
+            path.parent.mkdir(exist_ok=True)
+            os.replace(source, path)
+            self.db.execute(
+                "INSERT INTO blobs (digest, size, refcount, created_at) VALUES (?, ?, 1, ?)",
+                (digest, record["size"], record["created_at"])
+            )
+
+    async def delete(self, file_id: str) -> bool:
+        """Delete a file, and its blob if no other file uses it"""
+        return await asyncio.to_thread(self._transaction, self._delete, file_id)
+
+    def _delete(self, file_id: str) -> bool:
+        row = self.db.execute("SELECT digest FROM files WHERE id = ?", (file_id,)).fetchone()
+        if row is None:
+            return False
+        digest = row[0]
+        self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        self.db.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?", (digest,))
+        orphaned = self.db.execute(
+            "DELETE FROM blobs WHERE digest = ? AND refcount <= 0", (digest,)
+        ).rowcount
+        if orphaned:
+            self.db.execute("DELETE FROM document_chunks WHERE digest = ?", (digest,))
+            self.db.execute("DELETE FROM document_embeddings WHERE digest = ?", (digest,))
+            self.db.execute("DELETE FROM documents WHERE digest = ?", (digest,))
+            self.blob_path(digest).unlink(missing_ok=True)
+        return True
+
+    # Documents
+
+    async def begin_document(self, digest: str) -> bool:
+        """Queue a document for ingestion
+
+        Returns False when its text is already extracted or being extracted,
+        so there is nothing to do; a failed document is queued again.
+        """
+
+        def upsert() -> bool:
+            return bool(self.db.execute(
+                "INSERT INTO documents (digest, status, updated_at) VALUES (?, 'queued', ?) "
+                "ON CONFLICT(digest) DO UPDATE SET status = 'queued', error = NULL, "
+                "progress_done = 0, progress_total = 0, updated_at = excluded.updated_at "
+                "WHERE documents.status = 'failed'",
+                (digest, time.time())
+            ).rowcount)
+
+        return await asyncio.to_thread(self._transaction, upsert)
+
+    async def update_document(self, digest: str, **values: Any) -> None:
+        """Set a document's status, error or progress"""
+
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in values)
+
+        def update() -> None:
+            self.db.execute(
+                f"UPDATE documents SET {assignments} WHERE digest = ?",
+                (*values.values(), digest)
+            )
+
+        await asyncio.to_thread(self._transaction, update)
+
+    async def save_chunks(self, digest: str, chunks: List[Dict[str, Any]]) -> None:
+        """Replace a document's chunks and mark it ready"""
+
+        def write() -> None:
+            self.db.execute("DELETE FROM document_chunks WHERE digest = ?", (digest,))
+            self.db.execute("DELETE FROM document_embeddings WHERE digest = ?", (digest,))
+            self.db.executemany(
+                "INSERT INTO document_chunks (digest, seq, section, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                [(digest, seq, chunk["section"], chunk["content"], chunk["tokens"])
+                 for seq, chunk in enumerate(chunks)]
+            )
+            self.db.execute(
+                "UPDATE documents SET status = 'ready', error = NULL, chunk_count = ?, token_count = ?, "
+                "updated_at = ? WHERE digest = ?",
+                (len(chunks), sum(chunk["tokens"] for chunk in chunks), time.time(), digest)
+            )
+
+        await asyncio.to_thread(self._transaction, write)
+
+    async def get_document(self, digest: str) -> Optional[Dict[str, Any]]:
+        def select() -> Optional[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT status, error, progress_done, progress_total, chunk_count, token_count, updated_at "
+                    "FROM documents WHERE digest = ?",
+                    (digest,)
+                ).fetchone()
+
+        row = await asyncio.to_thread(select)
+        if row is None:
+            return None
+        return dict(zip(
+            ("status", "error", "progress_done", "progress_total", "chunk_count", "token_count", "updated_at"),
+            row
+        ))
+
+    async def get_chunks(self, digest: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT id, seq, section, content, tokens FROM document_chunks "
+                    "WHERE digest = ? ORDER BY seq LIMIT ? OFFSET ?",
+                    (digest, -1 if limit is None else limit, offset)
+                ).fetchall()
+
+        return [
+            dict(zip(("id", "seq", "section", "content", "tokens"), row))
+            for row in await asyncio.to_thread(select)
+        ]
+
+    async def pending_documents(self) -> List[Dict[str, Any]]:
+        """Documents whose ingestion was interrupted, with a file to read each from"""
+
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT f.id, f.digest, f.filename, f.content_type, f.size, f.created_at "
+                    "FROM documents d JOIN files f ON f.digest = d.digest "
+                    f"WHERE d.status IN ({', '.join('?' * len(DOCUMENT_PENDING))}) GROUP BY d.digest",
+                    DOCUMENT_PENDING
+                ).fetchall()
+
+        return [self._record(row) for row in await asyncio.to_thread(select)]
+
+    # Embeddings
+
+    async def unembedded_documents(self, model: str) -> List[str]:
+        """Digests of ready documents whose chunks aren't embedded with model
+
+        Documents another worker is embedding are left out until its claim
+        runs out.
+        """
+
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT d.digest FROM documents d "
+                    "LEFT JOIN document_embeddings e ON e.digest = d.digest AND e.model = ? "
+                    "WHERE d.status = 'ready' AND d.chunk_count > 0 "
+                    "AND (e.digest IS NULL OR e.status = 'embedding' AND e.lease_until < ?) "
+                    "ORDER BY d.updated_at",
+                    (model, time.time())
+                ).fetchall()
+
+        return [row[0] for row in await asyncio.to_thread(select)]
+
+    async def claim_embedding(self, digest: str, model: str, worker: str, lease: float) -> bool:
+        """Take on embedding a document for lease seconds
+
+        Returns False when it's already embedded with model or another
+        worker's claim on it hasn't run out, so only one worker adds a
+        document's chunks to the index.
+        """
+
+        def upsert() -> bool:
+            now = time.time()
+            return bool(self.db.execute(
+                "INSERT INTO document_embeddings (digest, model, status, worker, lease_until, updated_at) "
+                "VALUES (?, ?, 'embedding', ?, ?, ?) ON CONFLICT(digest) DO UPDATE SET "
+                "model = excluded.model, status = 'embedding', worker = excluded.worker, "
+                "lease_until = excluded.lease_until, chunk_count = 0, updated_at = excluded.updated_at "
+                "WHERE document_embeddings.model != excluded.model "
+                "OR document_embeddings.status = 'embedding' AND document_embeddings.lease_until < ?",
+                (digest, model, worker, now + lease, now, now)
+            ).rowcount)
+
+        return await asyncio.to_thread(self._transaction, upsert)
+
+    async def renew_embedding(self, digest: str, worker: str, lease: float) -> bool:
+        """Extend a claim; False if the worker no longer holds it"""
+
+        def update() -> bool:
+            return bool(self.db.execute(
+                "UPDATE document_embeddings SET lease_until = ? "
+                "WHERE digest = ? AND worker = ? AND status = 'embedding'",
+                (time.time() + lease, digest, worker)
+            ).rowcount)
+
+        return await asyncio.to_thread(self._transaction, update)
+
+    async def mark_embedded(self, digest: str, worker: str, chunk_count: int) -> bool:
+        """Turn a claim into a finished embedding; False if the worker no longer holds it"""
+
+        def update() -> bool:
+            return bool(self.db.execute(
+                "UPDATE document_embeddings SET status = 'embedded', worker = NULL, lease_until = NULL, "
+                "chunk_count = ?, updated_at = ? WHERE digest = ? AND worker = ? AND status = 'embedding'",
+                (chunk_count, time.time(), digest, worker)
+            ).rowcount)
+
+        return await asyncio.to_thread(self._transaction, update)
+
+    async def release_embedding(self, digest: str, worker: str) -> None:
+        """Give up a claim, so the document is embedded again later"""
+
+        def delete() -> None:
+            self.db.execute(
+                "DELETE FROM document_embeddings WHERE digest = ? AND worker = ? AND status = 'embedding'",
+                (digest, worker)
+            )
+
+        await asyncio.to_thread(self._transaction, delete)
+
+    async def clear_embeddings(self) -> None:
+        """Forget which documents are embedded, e.g. after the vector index is reset
+
+        Claims in progress are kept; their chunks go into the new index.
+        """
+
+        def delete() -> None:
+            self.db.execute("DELETE FROM document_embeddings WHERE status = 'embedded'")
+
+        await asyncio.to_thread(self._transaction, delete)
+
+    async def chunk_ids(self, file_ids: List[str]) -> List[int]:
+        """Ids of the chunks of these files' documents"""
+
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT c.id FROM document_chunks c WHERE c.digest IN "
+                    f"(SELECT digest FROM files WHERE id IN ({', '.join('?' * len(file_ids))}))",
+                    file_ids
+                ).fetchall()
+
+        return [row[0] for row in await asyncio.to_thread(select)] if file_ids else []
+
+    async def get_chunks_by_id(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Chunks by id, each with the name of a file it came from"""
+
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT c.id, c.digest, c.seq, c.section, c.content, c.tokens, "
+                    "(SELECT filename FROM files f WHERE f.digest = c.digest ORDER BY f.created_at LIMIT 1) "
+                    f"FROM document_chunks c WHERE c.id IN ({', '.join('?' * len(ids))})",
+                    ids
+                ).fetchall()
+
+        if not ids:
+            return {}
+        return {
+            row[0]: dict(zip(("id", "digest", "seq", "section", "content", "tokens", "filename"), row))
+            for row in await asyncio.to_thread(select)
+        }
+
+    # Reads
+
+    def _record(self, row: tuple) -> Dict[str, Any]:
+        record = dict(zip(("id", "digest", "filename", "content_type", "size", "created_at"), row))
+        record["path"] = self.blob_path(record["digest"])
+        return record
+
+    async def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Get a file's metadata and blob path"""
+
+        def select() -> Optional[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT id, digest, filename, content_type, size, created_at FROM files WHERE id = ?",
+                    (file_id,)
+                ).fetchone()
+
+        row = await asyncio.to_thread(select)
+        return self._record(row) if row else None
+
+    async def list_files(self) -> List[Dict[str, Any]]:
+        """All files, newest first"""
+
+        def select() -> List[tuple]:
+            with self.db_lock:
+                return self.db.execute(
+                    "SELECT f.id, f.digest, f.filename, f.content_type, f.size, f.created_at, d.status "
+                    "FROM files f LEFT JOIN documents d ON d.digest = f.digest "
+                    "ORDER BY f.created_at DESC"
+                ).fetchall()
+
+        records = []
+        for row in await asyncio.to_thread(select):
+            record = self._record(row[:6])
+            record["document_status"] = row[6]
+            records.append(record)
+        return records
+
+    async def get_stats(self) -> Dict[str, Any]:
+        def select() -> tuple:
+            with self.db_lock:
+                files, logical = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+                blobs, stored = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            return files, logical, blobs, stored
+
+        files, logical, blobs, stored = await asyncio.to_thread(select)
+        return {
+            "files": files,
+            "blobs": blobs,
+            "bytes_uploaded": logical,
+            "bytes_stored": stored,
+            "deduplicated_uploads": self.deduplicated
+        }
+
+    # Migration
+
+    def _import_legacy(self) -> int:
+        """Index files saved as <file id><extension> directly in the root"""
+
+        imported = 0
+        for path in self.root.iterdir():
+            if not path.is_file() or path.name.startswith("."):
+                continue
+            hasher = hashlib.sha256()
+            with open(path, "rb") as source:
+                while chunk := source.read(self.chunk_size):
+                    hasher.update(chunk)
+            stat = path.stat()
+            record = {
+                "id": path.stem,
+                "digest": hasher.hexdigest(),
+                "filename": path.name,
+                "content_type": mimetypes.guess_type(path.name)[0],
+                "size": stat.st_size,
+                "created_at": stat.st_ctime
+            }
+            try:
+                self._transaction(self._add, record, path)
+            except sqlite3.IntegrityError:
+                logger.warning(f"Skipping {path.name}: a file with id {path.stem} already exists")
+                continue
+            # Content that was already stored leaves the old copy behind
+            path.unlink(missing_ok=True)
+            imported += 1
+        return imported
+
+
+def _discard(temp: Any) -> None:
+    temp.close()
+    try:
+        os.unlink(temp.name)
+    except FileNotFoundError:
+        # Already moved into the blob store
+        pass
@@ -0,0 +1,525 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from typing import Any, Dict, Optional
+from .conversations import sqlite_path, from_epoch
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        request TEXT NOT NULL,
+        progress TEXT NOT NULL DEFAULT '{}',
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_until REAL,
+        available_at REAL NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )""",
+    # Workers claim the next due job in priority order
+    "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, available_at, created_at)",
+]
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """A job as returned by the API, without broker bookkeeping"""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "cancel_requested": job["cancel_requested"],
+        "created_at": from_epoch(job["created_at"]),
+        "started_at": from_epoch(job["started_at"]),
+        "finished_at": from_epoch(job["finished_at"])
+    }
+
+
+class SQLiteJobBroker:
+    """Durable job queue in a SQLite table
+
+    Works without any extra service and can be shared by several API workers
+    on one machine. A worker claims a job with a lease and renews it while the
+    job runs; a job whose lease runs out (its worker crashed or was restarted)
+    is claimed again, up to max_attempts times.
+    """
+
+    def __init__(self, database_url: str, max_attempts: int = 3, retention: float = 86400):
+        self.path = sqlite_path(database_url)
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+
+    async def initialize(self) -> None:
+        self.db = await asyncio.to_thread(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        for statement in JOB_SCHEMA:
+            db.execute(statement)
+        db.commit()
+        return db
+
+    async def close(self) -> None:
+        if self.db is not None:
+            with self.db_lock:
+                self.db.close()
+            self.db = None
+
+    async def _run(self, fn, *args) -> Any:
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+    def _locked(self, fn, *args) -> Any:
+        with self.db_lock:
+            with self.db:
+                return fn(*args)
+
+    def _job(self, row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(zip(
+            ("id", "status", "priority", "request", "progress", "result", "error", "attempts",
+             "cancel_requested", "worker", "lease_until", "available_at", "created_at",
+             "started_at", "finished_at"),
+            row
+        ))
+        job["request"] = json.loads(job["request"])
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def _select(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._job(self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    async def submit(self, request: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        """Queue a job and return it"""
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        def insert() -> Dict[str, Any]:
+            self.db.execute(
+                "INSERT INTO jobs (id, status, priority, request, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, priority, json.dumps(request, ensure_ascii=False), now, now)
+            )
+            return self._select(job_id)
+
+        return await self._run(insert)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._select, job_id)
+
+    async def claim(self, worker: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Take the next due job, or None when there's nothing to do"""
+        return await self._run(self._claim, worker, lease)
+
+    def _claim(self, worker: str, lease: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        self._recover(now)
+        while True:
+            row = self.db.execute(
+                "SELECT id FROM jobs WHERE status = ? AND available_at <= ? "
+                "ORDER BY priority DESC, available_at, created_at LIMIT 1",
+                (QUEUED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            # Another process may have claimed it between the two statements
+            claimed = self.db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ? AND status = ?",
+                (RUNNING, worker, now + lease, now, row[0], QUEUED)
+            ).rowcount
+            if claimed:
+                return self._select(row[0])
+
+    def _recover(self, now: float) -> None:
+        """Requeue jobs whose worker stopped renewing their lease"""
+
+        expired = self.db.execute(
+            "SELECT id, attempts, cancel_requested FROM jobs WHERE status = ? AND lease_until < ?",
+            (RUNNING, now)
+        ).fetchall()
+        for job_id, attempts, cancel_requested in expired:
+            if cancel_requested:
+                self._finish(job_id, CANCELLED, None, None, now)
+            elif attempts >= self.max_attempts:
+                self._finish(job_id, FAILED, None, f"Worker lost after {attempts} attempt(s)", now)
+            else:
+                logger.info(f"Requeueing job {job_id}, its worker stopped")
+                self.db.execute(
+                    "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL "
+                    "WHERE id = ? AND status = ? AND lease_until < ?",
+                    (QUEUED, job_id, RUNNING, now)
+                )
+
+    async def heartbeat(self, job_id: str, worker: str, progress: Dict[str, Any], lease: float) -> bool:
+        """Renew the lease and save progress
+
+        Returns False when the job was cancelled or is no longer this
+        worker's, so the worker should stop.
+        """
+
+        def update() -> bool:
+            updated = self.db.execute(
+                "UPDATE jobs SET progress = ?, lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                (json.dumps(progress, ensure_ascii=False), time.time() + lease, job_id, worker, RUNNING)
+            ).rowcount
+            if not updated:
+                return False
+            row = self.db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return not row[0]
+
+        return await self._run(update)
+
+    async def complete(self, job_id: str, worker: str, result: Dict[str, Any], progress: Dict[str, Any]) -> None:
+        def update() -> None:
+            self.db.execute(
+                "UPDATE jobs SET progress = ? WHERE id = ? AND worker = ?",
+                (json.dumps(progress, ensure_ascii=False), job_id, worker)
+            )
+            self._finish(job_id, SUCCEEDED, result, None, time.time(), worker)
+
+        await self._run(update)
+
+    async def fail(self, job_id: str, worker: str, error: str, cancelled: bool = False) -> None:
+        status = CANCELLED if cancelled else FAILED
+        await self._run(self._finish, job_id, status, None, error, time.time(), worker)
+
+    async def retry(self, job_id: str, worker: str, delay: float) -> None:
+        """Put a claimed job back in the queue, due after `delay` seconds
+
+        The attempt isn't counted, since the job didn't fail.
+        """
+
+        def update() -> None:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, available_at = ?, "
+                "attempts = attempts - 1 "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (QUEUED, time.time() + delay, job_id, worker, RUNNING)
+            )
+
+        await self._run(update)
+
+    def _finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]],
+        error: Optional[str],
+        now: float,
+        worker: Optional[str] = None
+    ) -> None:
+        sql = (
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+            "worker = NULL, lease_until = NULL WHERE id = ? AND status NOT IN (?, ?, ?)"
+        )
+        params = (
+            status,
+            json.dumps(result, ensure_ascii=False) if result is not None else None,
+            error,
+            now,
+            job_id,
+            *FINISHED
+        )
+        if worker is not None:
+            sql += " AND worker = ?"
+            params += (worker,)
+        self.db.execute(sql, params)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued job, or ask the worker running it to stop"""
+
+        def update() -> Optional[Dict[str, Any]]:
+            job = self._select(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            if job["status"] == QUEUED:
+                self._finish(job_id, CANCELLED, None, None, time.time())
+            else:
+                self.db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return self._select(job_id)
+
+        return await self._run(update)
+
+    async def purge(self) -> int:
+        """Delete finished jobs older than the retention period"""
+
+        def delete() -> int:
+            return self.db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+                (*FINISHED, time.time() - self.retention)
+            ).rowcount
+
+        return await self._run(delete)
+
+    async def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+
+        def count() -> Dict[str, int]:
+            rows = self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            return dict(rows)
+
+        return await self._run(count)
+
+
+class RedisJobBroker:
+    """Job queue in Redis, for API workers spread over several machines
+
+    Each job is a hash; queued job ids sit in a sorted set ordered by
+    priority then age, jobs waiting for a retry in a set scored by when they
+    are due, and running jobs in a set scored by their lease deadline, so
+    expired leases are found the same way as with the SQLite broker.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        max_attempts: int = 3,
+        retention: float = 86400,
+        prefix: str = "swift_neethi:jobs:"
+    ):
+        if aioredis is None:
+            raise RuntimeError("The redis job broker needs the redis package (pip install redis)")
+        self.redis_url = redis_url
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.prefix = prefix
+        self.client = None
+
+    async def initialize(self) -> None:
+        self.client = aioredis.from_url(self.redis_url, decode_responses=True)
+        await self.client.ping()
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def _key(self, name: str) -> str:
+        return self.prefix + name
+
+    def _score(self, priority: int, created_at: float) -> float:
+        # Higher priority first, then oldest first
+        return -priority * 1e10 + created_at
+
+    async def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        data = await self.client.hgetall(self._key(job_id))
+        if not data:
+            return None
+        job = {key: json.loads(value) for key, value in data.items()}
+        job.setdefault("result", None)
+        job.setdefault("error", None)
+        job.setdefault("worker", None)
+        return job
+
+    async def _save(self, job_id: str, **values: Any) -> None:
+        await self.client.hset(
+            self._key(job_id),
+            mapping={key: json.dumps(value, ensure_ascii=False) for key, value in values.items()}
+        )
+
+    async def submit(self, request: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "priority": priority,
+            "request": request,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "cancel_requested": False,
+            "worker": None,
+            "lease_until": None,
+            "available_at": now,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None
+        }
+        await self._save(job_id, **job)
+        await self.client.zadd(self._key("queue"), {job_id: self._score(priority, now)})
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._load(job_id)
+
+    async def claim(self, worker: str, lease: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        await self._recover(now)
+
+        while True:
+            popped = await self.client.zpopmin(self._key("queue"))
+            if not popped:
+                return None
+            job_id = popped[0][0]
+            job = await self._load(job_id)
+            if job is None or job["status"] != QUEUED:
+                continue
+
+            await self._save(
+                job_id,
+                status=RUNNING,
+                worker=worker,
+                lease_until=now + lease,
+                attempts=job["attempts"] + 1,
+                started_at=job["started_at"] or now
+            )
+            await self.client.zadd(self._key("running"), {job_id: now + lease})
+            return await self._load(job_id)
+
+    async def _recover(self, now: float) -> None:
+        # Retries that are due go back in the queue
+        for job_id in await self.client.zrangebyscore(self._key("delayed"), "-inf", now):
+            if await self.client.zrem(self._key("delayed"), job_id):
+                job = await self._load(job_id)
+                if job and job["status"] == QUEUED:
+                    await self.client.zadd(
+                        self._key("queue"),
+                        {job_id: self._score(job["priority"], job["created_at"])}
+                    )
+
+        # Whoever removes an expired job from the running set handles it
+        for job_id in await self.client.zrangebyscore(self._key("running"), "-inf", now):
+            if not await self.client.zrem(self._key("running"), job_id):
+                continue
+            job = await self._load(job_id)
+            if job is None or job["status"] != RUNNING:
+                continue
+            if job["cancel_requested"]:
+                await self._finish(job_id, CANCELLED, None, None)
+            elif job["attempts"] >= self.max_attempts:
+                await self._finish(job_id, FAILED, None, f"Worker lost after {job['attempts']} attempt(s)")
+            else:
+                logger.info(f"Requeueing job {job_id}, its worker stopped")
+                await self._save(job_id, status=QUEUED, worker=None, lease_until=None)
+                await self.client.zadd(
+                    self._key("queue"),
+                    {job_id: self._score(job["priority"], job["created_at"])}
+                )
+
+    async def _owned(self, job_id: str, worker: str) -> Optional[Dict[str, Any]]:
+        job = await self._load(job_id)
+        if job is None or job["status"] != RUNNING or job["worker"] != worker:
+            return None
+        return job
+
+    async def heartbeat(self, job_id: str, worker: str, progress: Dict[str, Any], lease: float) -> bool:
+        job = await self._owned(job_id, worker)
+        if job is None:
+            return False
+        lease_until = time.time() + lease
+        await self._save(job_id, progress=progress, lease_until=lease_until)
+        await self.client.zadd(self._key("running"), {job_id: lease_until})
+        return not job["cancel_requested"]
+
+    async def complete(self, job_id: str, worker: str, result: Dict[str, Any], progress: Dict[str, Any]) -> None:
+        if await self._owned(job_id, worker) is not None:
+            await self._save(job_id, progress=progress)
+            await self._finish(job_id, SUCCEEDED, result, None)
+
+    async def fail(self, job_id: str, worker: str, error: str, cancelled: bool = False) -> None:
+        if await self._owned(job_id, worker) is not None:
+            await self._finish(job_id, CANCELLED if cancelled else FAILED, None, error)
+
+    async def retry(self, job_id: str, worker: str, delay: float) -> None:
+        job = await self._owned(job_id, worker)
+        if job is None:
+            return
+        await self.client.zrem(self._key("running"), job_id)
+        await self._save(job_id, status=QUEUED, worker=None, lease_until=None, attempts=job["attempts"] - 1)
+        await self.client.zadd(self._key("delayed"), {job_id: time.time() + delay})
+
+    async def _finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]],
+        error: Optional[str]
+    ) -> None:
+        await self._save(
+            job_id,
+            status=status,
+            result=result,
+            error=error,
+            finished_at=time.time(),
+            worker=None,
+            lease_until=None
+        )
+        await self.client.zrem(self._key("running"), job_id)
+        await self.client.zrem(self._key("queue"), job_id)
+        await self.client.zrem(self._key("delayed"), job_id)
+        await self.client.expire(self._key(job_id), int(self.retention))
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self._load(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        if job["status"] == QUEUED:
+            await self._finish(job_id, CANCELLED, None, None)
+        else:
+            await self._save(job_id, cancel_requested=True)
+        return await self._load(job_id)
+
+    async def purge(self) -> int:
+        # Finished jobs expire on their own
+        return 0
+
+    async def counts(self) -> Dict[str, int]:
+        return {
+            QUEUED: await self.client.zcard(self._key("queue")) + await self.client.zcard(self._key("delayed")),
+            RUNNING: await self.client.zcard(self._key("running"))
+        }
+
+
+def create_job_broker(
+    backend: str,
+    database_url: Optional[str] = None,
+    redis_url: Optional[str] = None,
+    max_attempts: int = 3,
+    retention: float = 86400
+) -> Any:
+    """Build the configured job broker ("sqlite" or "redis")"""
+
+    if backend == "redis":
+        if not redis_url:
+            raise ValueError("The redis job broker needs REDIS_URL to be set")
+        return RedisJobBroker(redis_url, max_attempts=max_attempts, retention=retention)
+    if backend == "sqlite":
+        return SQLiteJobBroker(database_url, max_attempts=max_attempts, retention=retention)
+    raise ValueError(f"Unknown job broker: {backend}")
@@ -0,0 +1,388 @@
+import fcntl
+import json
+import os
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ROWS = 65536  # rows scored per matrix multiply; bounds the temporary score matrix
+MIN_CAPACITY = 4096
+
+
+class VectorIndex:
+    """Memory-mapped embedding index with exact (brute-force) top-k search
+
+    Vectors are stored L2-normalized as float32 rows in one file and their
+    ids as int64 in another, so the operating system pages them in and out
+    and the index can be much larger than the memory it uses. A query is a
+    matrix multiply over blocks of rows, so a batch of queries costs one
+    pass over the vectors. Removed rows are tombstoned (id -1) and dropped
+    when more than half the rows are dead.
+
+    meta.json holds the row count and the generation of the data files.
+    Rows are written and flushed before the count that makes them visible,
+    and rewrites (compaction, a new embedding model) go to new generation
+    files that meta.json is switched to, so a reader in another process
+    always sees a consistent index. Writers across processes are serialized
+    with a lock file.
+    """
+
+    def __init__(self, path: Path, block_rows: int = BLOCK_ROWS):
+        if np is None:
+            raise RuntimeError("The vector index needs the numpy package (pip install numpy)")
+        self.path = Path(path)
+        self.meta_path = self.path / "meta.json"
+        self.block_rows = block_rows
+        self.lock = threading.RLock()
+        self.meta: Dict[str, Any] = {"generation": 0, "model": None, "dim": 0, "count": 0, "deleted": 0}
+        self.stamp: Optional[Tuple[int, int]] = None
+        self.vectors: Optional["np.memmap"] = None
+        self.ids: Optional["np.memmap"] = None
+
+    # Files
+
+    def _files(self, generation: int) -> Tuple[Path, Path]:
+        return self.path / f"vectors-{generation}.f32", self.path / f"ids-{generation}.i64"
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.meta_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def _sync(self) -> None:
+        """Reload if another process (or a crash recovery) changed the index"""
+
+        stamp = self._stat()
+        if stamp is not None and stamp == self.stamp:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        if stamp is not None:
+            with open(self.meta_path) as file:
+                self.meta = json.load(file)
+        self.stamp = stamp
+        self._map()
+
+    def _map(self) -> None:
+        self.vectors = self.ids = None
+        dim = self.meta["dim"]
+        if not dim:
+            return
+        vector_file, id_file = self._files(self.meta["generation"])
+        if not vector_file.exists():
+            return
+        capacity = vector_file.stat().st_size // (dim * 4)
+        if capacity:
+            self.vectors = np.memmap(vector_file, dtype=np.float32, mode="r+", shape=(capacity, dim))
+            self.ids = np.memmap(id_file, dtype=np.int64, mode="r+", shape=(capacity,))
+
+    def _capacity(self) -> int:
+        return 0 if self.ids is None else len(self.ids)
+
+    def _resize(self, generation: int, capacity: int) -> None:
+        # Sparse on most filesystems: unused capacity takes no disk space
+        vector_file, id_file = self._files(generation)
+        for file, row_bytes in ((vector_file, self.meta["dim"] * 4), (id_file, 8)):
+            with open(file, "ab") as handle:
+                handle.truncate(capacity * row_bytes)
+
+    def _write_meta(self) -> None:
+        temp = self.meta_path.with_suffix(".tmp")
+        with open(temp, "w") as file:
+            json.dump(self.meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.meta_path)
+        self.stamp = self._stat()
+
+    def _flush(self) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.ids.flush()
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / "index.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._sync()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _switch(self, generation: int) -> None:
+        """Point meta.json at a new generation of files and remove the old one"""
+
+        old = self.meta["generation"]
+        self.meta["generation"] = generation
+        self._write_meta()
+        self._map()
+        # Readers that still map the old files keep them until they reload
+        for file in self._files(old):
+            file.unlink(missing_ok=True)
+
+    # Writes
+
+    def open(self) -> None:
+        with self.lock:
+            self._sync()
+
+    def close(self) -> None:
+        with self.lock:
+            self._flush()
+            self.vectors = self.ids = None
+            self.stamp = None
+
+    @staticmethod
+    def normalize(vectors: Any) -> "np.ndarray":
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def reset(self, model: Optional[str] = None) -> None:
+        """Drop every vector, e.g. when switching to another embedding model"""
+
+        with self._writing():
+            self.meta.update(model=model, dim=0, count=0, deleted=0)
+            self._switch(self.meta["generation"] + 1)
+
+    def use_model(self, model: str) -> bool:
+        """Hold embeddings from model, dropping any from another model
+
+        Checked and reset under the writer lock, so vectors another process
+        adds meanwhile are never lost. Returns True when the index is empty.
+        """
+
+        with self._writing():
+            if self.meta["model"] not in (None, model):
+                logger.info(f"Embedding model changed from {self.meta['model']} to {model}, rebuilding the index")
+                self.meta.update(model=model, dim=0, count=0, deleted=0)
+                self._switch(self.meta["generation"] + 1)
+            return self.meta["count"] == self.meta["deleted"]
+
+    def add(self, ids: Sequence[int], vectors: Any, model: Optional[str] = None) -> None:
+        """Append vectors; their ids are returned by search"""
+
+        vectors = self.normalize(vectors)
+        if len(ids) != len(vectors):
+            raise ValueError(f"{len(ids)} ids for {len(vectors)} vectors")
+        if not len(ids):
+            return
+
+        with self._writing():
+            if model and self.meta["model"] not in (None, model):
+                raise ValueError(f"Index holds {self.meta['model']} embeddings, not {model}")
+            if self.meta["count"] == 0 and self.meta["dim"] != vectors.shape[1]:
+                self.meta["dim"] = vectors.shape[1]
+                self._switch(self.meta["generation"] + 1)
+            elif self.meta["dim"] != vectors.shape[1]:
+                raise ValueError(f"Index holds {self.meta['dim']}-dimensional vectors, not {vectors.shape[1]}")
+            self.meta["model"] = model or self.meta["model"]
+
+            start = self.meta["count"]
+            end = start + len(vectors)
+            if end > self._capacity():
+                self._flush()
+                self._resize(self.meta["generation"], max(end, self._capacity() * 2, MIN_CAPACITY))
+                self._map()
+
+            self.vectors[start:end] = vectors
+            self.ids[start:end] = np.asarray(ids, dtype=np.int64)
+            # Rows reach the disk before the count that makes them visible
+            self._flush()
+            self.meta["count"] = end
+            self._write_meta()
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """Tombstone the rows with these ids and return how many there were"""
+
+        if not len(ids):
+            return 0
+        with self._writing():
+            count = self.meta["count"]
+            if not count:
+                return 0
+            rows = np.flatnonzero(np.isin(self.ids[:count], np.asarray(ids, dtype=np.int64)))
+            if not len(rows):
+                return 0
+            self.ids[rows] = -1
+            self.ids.flush()
+            self.meta["deleted"] += len(rows)
+            if self.meta["deleted"] * 2 > count:
+                self._compact()
+            else:
+                self._write_meta()
+            return len(rows)
+
+    def _compact(self) -> None:
+        # Copy live rows block by block into the next generation's files
+        count, dim = self.meta["count"], self.meta["dim"]
+        live = count - self.meta["deleted"]
+        generation = self.meta["generation"] + 1
+        self._resize(generation, max(live, MIN_CAPACITY))
+        vector_file, id_file = self._files(generation)
+        vectors = np.memmap(vector_file, dtype=np.float32, mode="r+", shape=(max(live, MIN_CAPACITY), dim))
+        ids = np.memmap(id_file, dtype=np.int64, mode="r+", shape=(max(live, MIN_CAPACITY),))
+
+        written = 0
+        for start in range(0, count, self.block_rows):
+            end = min(start + self.block_rows, count)
+            block_ids = np.asarray(self.ids[start:end])
+            keep = block_ids >= 0
+            kept = int(keep.sum())
+            vectors[written:written + kept] = self.vectors[start:end][keep]
+            ids[written:written + kept] = block_ids[keep]
+            written += kept
+        vectors.flush()
+        ids.flush()
+        del vectors, ids
+
+        logger.info(f"Compacted vector index from {count} to {written} rows")
+        self.meta.update(count=written, deleted=0)
+        self._switch(generation)
+
+    # Reads
+
+    def search(
+        self,
+        queries: Any,
+        k: int,
+        within: Optional[Sequence[int]] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """Top k (id, cosine similarity) pairs for each query, best first
+
+        within restricts the search to rows with those ids. An id stored in
+        more than one row is returned once, with its best score.
+        """
+
+        queries = self.normalize(queries)
+        with self.lock:
+            self._sync()
+            # Rows past count are never read, and rewrites go to new files, so
+            # these maps stay valid for the search without holding the lock
+            count, dim, vectors, ids = self.meta["count"], self.meta["dim"], self.vectors, self.ids
+        if not count or k <= 0 or dim != queries.shape[1]:
+            return [[] for _ in queries]
+
+        if within is None:
+            blocks = (
+                (vectors[start:end], np.asarray(ids[start:end]))
+                for start, end in (
+                    (start, min(start + self.block_rows, count)) for start in range(0, count, self.block_rows)
+                )
+            )
+        else:
+            rows = np.flatnonzero(np.isin(ids[:count], np.asarray(within, dtype=np.int64)))
+            blocks = (
+                (vectors[part], np.asarray(ids[part]))
+                for part in (rows[start:start + self.block_rows] for start in range(0, len(rows), self.block_rows))
+            )
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for block, block_ids in blocks:
+            scores = queries @ block.T
+            scores[:, block_ids < 0] = -np.inf
+            if best_scores.shape[1] < k:
+                best_scores, best_ids = _top_k(
+                    np.concatenate([best_scores, scores], axis=1),
+                    np.concatenate([best_ids, np.broadcast_to(block_ids, scores.shape)], axis=1),
+                    k
+                )
+            else:
+                best_scores, best_ids = _merge(best_scores, best_ids, scores, block_ids)
+
+        return [
+            [(int(i), float(s)) for i, s in zip(row_ids, row_scores) if s > -np.inf]
+            for row_ids, row_scores in zip(best_ids, best_scores)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self._sync()
+            return {
+                "model": self.meta["model"],
+                "dimensions": self.meta["dim"],
+                "vectors": self.meta["count"] - self.meta["deleted"],
+                "deleted": self.meta["deleted"],
+                "capacity": self._capacity(),
+                "bytes": self._capacity() * (self.meta["dim"] * 4 + 8)
+            }
+
+
+def _top_k(scores: "np.ndarray", ids: "np.ndarray", k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    if scores.shape[1] > k:
+        top = np.argpartition(scores, -k, axis=1)[:, -k:]
+        scores, ids = np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+    queries, columns = scores.shape
+    return _select(np.repeat(np.arange(queries), columns), scores.ravel(), ids.ravel(), queries, k)
+
+
+def _merge(
+    best_scores: "np.ndarray",
+    best_ids: "np.ndarray",
+    scores: "np.ndarray",
+    block_ids: "np.ndarray"
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Fold a block's scores into each query's current top k
+
+    Only scores above a query's k-th best can enter it, and past the first
+    few blocks there are very few, so they are gathered and merged instead
+    of partitioning the whole block.
+    """
+
+    queries, k = best_scores.shape
+    rows, columns = np.nonzero(scores > best_scores.min(axis=1, keepdims=True))
+    if not len(rows):
+        return best_scores, best_ids
+
+    return _select(
+        np.concatenate([np.repeat(np.arange(queries), k), rows]),
+        np.concatenate([best_scores.ravel(), scores[rows, columns]]),
+        np.concatenate([best_ids.ravel(), block_ids[columns]]),
+        queries,
+        k
+    )
+
+
+def _select(
+    rows: "np.ndarray",
+    scores: "np.ndarray",
+    ids: "np.ndarray",
+    queries: int,
+    k: int
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Each query's k best (score, id) entries, best first
+
+    rows gives the query of each entry. Only an id's best entry counts, so
+    a chunk stored twice doesn't take two places; queries with fewer than k
+    ids are padded with (-inf, -1).
+    """
+
+    order = np.lexsort((-scores, ids, rows))
+    rows, scores, ids = rows[order], scores[order], ids[order]
+    best = np.ones(len(rows), dtype=bool)
+    best[1:] = (rows[1:] != rows[:-1]) | (ids[1:] != ids[:-1])
+
+    rows = np.concatenate([rows[best], np.repeat(np.arange(queries), k)])
+    scores = np.concatenate([scores[best], np.full(queries * k, -np.inf, dtype=np.float32)])
+    ids = np.concatenate([ids[best], np.full(queries * k, -1, dtype=np.int64)])
+    # Grouped by query, best first; the padding gives every query k entries
+    order = np.lexsort((-scores, rows))
+    starts = np.searchsorted(rows[order], np.arange(queries))
+    keep = order[(starts[:, None] + np.arange(k)).ravel()]
+    return scores[keep].reshape(queries, k), ids[keep].reshape(queries, k)
+
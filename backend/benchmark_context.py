@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Microbenchmark for MemoryAgent.manage_context
+
+Compares the previous trimming loop (list filtering, token sums and
+insert(0) on every call) with the prefix-sum index, for a cold call on a
+new conversation and for a warm call that appends one turn to an indexed one.
+"""
+
+import asyncio
+import sys
+import time
+sys.path.append('.')
+
+from app.agents import MemoryAgent
+from app.models import Message, Role
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+MAX_TOKENS = 4096
+REPEATS = 5
+
+
+def make_history(size: int):
+    messages = [Message(role=Role.SYSTEM, content="You are a helpful assistant.")]
+    for i in range(size):
+        role = Role.USER if i % 2 == 0 else Role.ASSISTANT
+        messages.append(Message(role=role, content=f"Message {i}: " + "lorem ipsum dolor " * 10))
+    return messages
+
+
+def legacy_manage_context(messages, max_tokens, threshold=0.8):
+    """The original trimming loop, kept for comparison"""
+    total_tokens = sum(len(msg.content) // 4 for msg in messages)
+    if total_tokens <= max_tokens:
+        return messages
+    system_messages = [msg for msg in messages if msg.role == Role.SYSTEM]
+    other_messages = [msg for msg in messages if msg.role != Role.SYSTEM]
+    system_tokens = sum(len(msg.content) // 4 for msg in system_messages)
+    available_tokens = max_tokens - system_tokens
+    kept_messages = []
+    current_tokens = 0
+    for msg in reversed(other_messages):
+        msg_tokens = len(msg.content) // 4
+        if current_tokens + msg_tokens <= available_tokens * threshold:
+            kept_messages.insert(0, msg)
+            current_tokens += msg_tokens
+        else:
+            break
+    return system_messages + kept_messages
+
+
+def best_of(func, repeats: int = REPEATS) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+async def benchmark():
+    print("📏 manage_context benchmark (best of %d, milliseconds)" % REPEATS)
+    print("=" * 66)
+    print(f"{'messages':>10} {'legacy':>12} {'index cold':>12} {'index warm':>12} {'kept':>8}")
+
+    for size in SIZES:
+        history = make_history(size)
+
+        legacy_ms = best_of(lambda: legacy_manage_context(history, MAX_TOKENS))
+
+        # Cold: a fresh agent has to count and index the whole history
+        cold_timings = []
+        for _ in range(REPEATS):
+            agent = MemoryAgent()
+            start = time.perf_counter()
+            await agent.manage_context(history, MAX_TOKENS, conversation_id="bench")
+            cold_timings.append(time.perf_counter() - start)
+        cold_ms = min(cold_timings) * 1000
+
+        # Warm: the conversation is indexed, each call appends one turn
+        agent = MemoryAgent()
+        await agent.manage_context(history, MAX_TOKENS, conversation_id="bench")
+        warm_timings = []
+        for i in range(REPEATS):
+            history.append(Message(role=Role.USER, content=f"Follow-up {i}"))
+            start = time.perf_counter()
+            kept = await agent.manage_context(history, MAX_TOKENS, conversation_id="bench")
+            warm_timings.append(time.perf_counter() - start)
+        warm_ms = min(warm_timings) * 1000
+
+        print(f"{size:>10} {legacy_ms:>12.3f} {cold_ms:>12.3f} {warm_ms:>12.3f} {len(kept):>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Benchmark for the SSE streaming pipeline
+
+Starts a uvicorn server that streams fake generations through
+generate_stream, opens STREAMS concurrent streams against it and reports
+SSE events per second and the server's CPU time per 1k streams. The
+previous one-event-per-token encoder is measured for comparison, then
+coalescing windows of various sizes.
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+sys.path.append('.')
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from app.routes.chat import generate_stream
+
+STREAMS = 1000
+CONCURRENCY = 100  # streams open at once; more than this saturates a single worker
+TOKENS = 200
+TOKEN_INTERVAL = 0.002  # ~500 tokens/s per stream
+WINDOWS_MS = [0, 10, 25, 50]
+PORT = 8765
+
+app = FastAPI()
+
+
+async def fake_generation():
+    for i in range(TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        yield f" tok{i}"
+
+
+async def legacy_generate_stream(generator):
+    """The original encoder, kept for comparison"""
+    async for chunk in generator:
+        yield f"data: {json.dumps({'content': chunk})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stream")
+async def stream():
+    if os.environ.get("BENCH_LEGACY"):
+        body = legacy_generate_stream(fake_generation())
+    else:
+        body = generate_stream(fake_generation())
+    return StreamingResponse(body, media_type="text/event-stream")
+
+
+@app.get("/cpu")
+async def cpu():
+    return {"seconds": time.process_time()}
+
+
+async def wait_until_up(client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            await client.get(f"http://127.0.0.1:{PORT}/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("benchmark server did not start")
+
+
+async def run(env: dict) -> dict:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmark_streaming:app",
+         "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, **env}
+    )
+    events = 0
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        await wait_until_up(client)
+
+        limit = asyncio.Semaphore(CONCURRENCY)
+
+        async def one_stream():
+            # Raw socket client, so the client isn't the bottleneck
+            nonlocal events
+            async with limit:
+                reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+                writer.write(b"GET /stream HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    events += data.count(b"data: ")
+                writer.close()
+
+        cpu_url = f"http://127.0.0.1:{PORT}/cpu"
+        cpu_before = (await client.get(cpu_url)).json()["seconds"]
+        start = time.perf_counter()
+        await asyncio.gather(*(one_stream() for _ in range(STREAMS)))
+        wall = time.perf_counter() - start
+        cpu = (await client.get(cpu_url)).json()["seconds"] - cpu_before
+
+    server.terminate()
+    server.wait()
+
+    return {
+        "events": events,
+        "events_per_sec": events / wall,
+        "cpu_ms_per_1k": cpu * 1000 * 1000 / STREAMS,
+        "wall": wall
+    }
+
+
+def report(label: str, result: dict) -> None:
+    print(
+        f"{label:>16} {result['events']:>10} {result['events_per_sec']:>12.0f} "
+        f"{result['cpu_ms_per_1k']:>14.0f} {result['wall']:>8.2f}"
+    )
+
+
+async def benchmark():
+    try:
+        import orjson  # noqa: F401
+        encoder = "orjson"
+    except ImportError:
+        encoder = "json"
+
+    print(
+        f"📡 SSE streaming benchmark: {STREAMS} streams x {TOKENS} tokens, "
+        f"{CONCURRENCY} at a time (encoder: {encoder})"
+    )
+    print("   CPU is the server process's time while streaming")
+    print("=" * 66)
+    print(f"{'pipeline':>16} {'events':>10} {'events/s':>12} {'CPU ms/1k':>14} {'wall s':>8}")
+
+    report("legacy", await run({"BENCH_LEGACY": "1", "STREAM_FLUSH_INTERVAL_MS": "0"}))
+
+    for window in WINDOWS_MS:
+        report(f"window {window} ms", await run({"STREAM_FLUSH_INTERVAL_MS": str(window)}))
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
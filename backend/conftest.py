@@ -0,0 +1,84 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+
+class ASGIResult:
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+        self.chunks: List[bytes] = []
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(self.chunks)
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+async def asgi_request(
+    app,
+    method: str,
+    path: str,
+    headers: Optional[Dict[str, str]] = None,
+    body: bytes = b"",
+    disconnect_after: Optional[int] = None,
+    timeout: float = 10.0
+) -> ASGIResult:
+    """Call an ASGI app directly, optionally disconnecting after some body chunks
+
+    httpx's ASGI transport buffers the whole response, so it can't show a
+    client going away in the middle of a stream.
+    """
+
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    result = ASGIResult()
+    disconnected = asyncio.Event()
+    sent_body = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            result.status = message["status"]
+            result.headers = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                result.chunks.append(message["body"])
+            if disconnect_after is not None and len(result.chunks) >= disconnect_after:
+                disconnected.set()
+                # Give the app a chance to notice, as a real server would
+                await asyncio.sleep(0.05)
+            if not message.get("more_body", False):
+                disconnected.set()
+
+    await asyncio.wait_for(app(scope, receive, send), timeout)
+    return result
+
+
+@pytest.fixture
+def asgi():
+    return asgi_request
@@ -2,9 +2,9 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 import logging
 from app.config import settings
-from app.routes import chat_router, models_router, prompts_router, files_router
+from app.routes import chat_router, models_router, prompts_router, files_router, metrics_router, websocket_router, jobs_router
+from app.routes import chat as chat_routes, jobs as job_routes, files as file_routes
 from app.middleware import setup_cors, setup_rate_limit, setup_exception_handlers
-from app.agents import ChatAgent
 
 # Configure logging
 logging.basicConfig(
@@ -14,9 +14,6 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# Global chat agent
-chat_agent = None
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -24,25 +21,34 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Swift Neethi Backend...")
     
-    # Initialize chat agent
-    global chat_agent
-    from app.routes.chat import chat_agent as route_agent
+    # Initialize the chat agent the routes use
+    logger.info("Initializing chat agent...")
+    await chat_routes.get_chat_agent()
+    logger.info("Chat agent initialized successfully")
+    
+    # Start job workers now, so jobs queued before a restart resume
+    await job_routes.get_job_queue()
+    
+    # Embed documents not yet in the vector index (when retrieval is enabled)
+    await file_routes.get_retriever()
     
-    # Ensure the agent is initialized
-    if route_agent:
-        logger.info("Chat agent already initialized")
-    else:
-        logger.info("Initializing chat agent...")
-        chat_agent = ChatAgent()
-        await chat_agent.initialize()
-        logger.info("Chat agent initialized successfully")
+    # Resume document ingestion interrupted by the last shutdown
+    await file_routes.get_document_ingester()
     
     yield
     
     # Shutdown
     logger.info("Shutting down Swift Neethi Backend...")
-    if chat_agent:
-        await chat_agent.cleanup()
+    if job_routes.job_queue:
+        await job_routes.job_queue.stop()
+    if file_routes.document_ingester:
+        await file_routes.document_ingester.close()
+    if file_routes.retriever:
+        await file_routes.retriever.close()
+    if chat_routes.chat_agent:
+        await chat_routes.chat_agent.cleanup()
+    if file_routes.file_store:
+        await file_routes.file_store.close()
     logger.info("Shutdown complete")
 
 
@@ -64,6 +70,9 @@ app.include_router(chat_router)
 app.include_router(models_router)
 app.include_router(prompts_router)
 app.include_router(files_router)
+app.include_router(metrics_router)
+app.include_router(websocket_router)
+app.include_router(jobs_router)
 
 
 @app.get("/")
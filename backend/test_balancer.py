@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.models import Message, Role
+from app.providers.balancer import LoadBalancedLlamaCppProvider
+
+
+class FakeBackend:
+    """Stands in for a LlamaCppProvider, failing with the given error"""
+
+    base_url = "http://fake:8080"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def chat(self, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {"content": "ok"}
+
+    def get_stats(self):
+        return {}
+
+
+def balancer(*providers) -> LoadBalancedLlamaCppProvider:
+    urls = [f"http://backend-{i}:8080" for i in range(len(providers))]
+    provider = LoadBalancedLlamaCppProvider(urls)
+    for backend, fake in zip(provider.backends, providers):
+        backend.provider = fake
+    return provider
+
+
+MESSAGES = [Message(role=Role.USER, content="hi")]
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectError("refused"),
+    httpx.ConnectTimeout("timed out"),
+    httpx.RemoteProtocolError("server disconnected"),
+])
+def test_unreachable_backend_fails_over(error):
+    down, up = FakeBackend(error), FakeBackend()
+    provider = balancer(down, up)
+    assert asyncio.run(provider.chat(MESSAGES, "model"))["content"] == "ok"
+    assert [b.healthy for b in provider.backends] == [False, True]
+    assert provider.backends[0].failures == 1
+
+
+def test_read_timeout_fails_only_the_request():
+    slow, other = FakeBackend(httpx.ReadTimeout("slow generation")), FakeBackend()
+    provider = balancer(slow, other)
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(provider.chat(MESSAGES, "model"))
+    assert [b.healthy for b in provider.backends] == [True, True]
+    assert other.calls == 0
+    stats = provider.get_stats()["backends"][0]
+    assert stats["request_errors"] == 1 and stats["failures"] == 0
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import json
+
+from fastapi import FastAPI, UploadFile
+
+from app.agents import AdmissionRejected, BatchRunner
+from app.config import settings
+from app.models import Message, Provider, Role
+from app.routes import chat
+
+
+class FakeAgent:
+    """Answers every request, except "fail" ones, and rejects "busy" ones once"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = set()
+
+    async def process_messages(self, messages, context):
+        self.calls += 1
+        content = messages[-1].content
+        if content == "fail":
+            raise RuntimeError("upstream error")
+        if content.startswith("busy") and content not in self.rejected:
+            self.rejected.add(content)
+            raise AdmissionRejected("queue full", retry_after=0)
+        return {
+            "message": Message(role=Role.ASSISTANT, content=f"re: {content}"),
+            "conversation_id": None,
+            "provider": Provider.LLAMACPP,
+            "model": "test",
+            "usage": {"completion_tokens": 2}
+        }
+
+
+def make_app(agent: FakeAgent) -> FastAPI:
+    app = FastAPI()
+    app.include_router(chat.router)
+    app.dependency_overrides[chat.get_chat_agent] = lambda: agent
+    return app
+
+
+def upload(content: bytes):
+    boundary = "batchboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="batch.jsonl"\r\n'
+        "Content-Type: application/x-ndjson\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return {"content-type": f"multipart/form-data; boundary={boundary}"}, body
+
+
+def request_line(content: str, custom_id: str) -> bytes:
+    return json.dumps({"custom_id": custom_id, "messages": [{"role": "user", "content": content}]}).encode()
+
+
+def test_partial_failure(asgi):
+    async def run():
+        agent = FakeAgent()
+        lines = [
+            request_line("one", "a"),
+            b"",
+            request_line("fail", "b"),
+            b"{not json",
+            request_line("busy two", "c"),
+        ]
+        headers, body = upload(b"\n".join(lines) + b"\n")
+        result = await asgi(make_app(agent), "POST", "/api/chat/batch/upload?concurrency=2", headers, body)
+        assert result.status == 200
+
+        *items, last = [json.loads(line) for line in result.body.splitlines()]
+        by_index = {item["index"]: item for item in items}
+        assert sorted(by_index) == [0, 1, 2, 3]
+        assert by_index[0]["status"] == "succeeded" and by_index[0]["custom_id"] == "a"
+        assert by_index[0]["response"]["message"]["content"] == "re: one"
+        assert by_index[1]["status"] == "failed" and by_index[1]["error"] == "upstream error"
+        assert by_index[2]["status"] == "failed" and "line 4" in by_index[2]["error"]
+        # Retried after the admission rejection
+        assert by_index[3]["status"] == "succeeded" and by_index[3]["attempts"] == 2
+        summary = last["summary"]
+        assert (summary["total"], summary["succeeded"], summary["failed"]) == (4, 2, 2)
+        assert summary["usage"] == {"completion_tokens": 4}
+
+    asyncio.run(run())
+
+
+def test_upload_limits(asgi, monkeypatch):
+    monkeypatch.setattr(settings, "batch_max_items", 2)
+
+    async def run():
+        app = make_app(FakeAgent())
+        headers, body = upload(b"\n".join(request_line(str(i), str(i)) for i in range(3)))
+        assert (await asgi(app, "POST", "/api/chat/batch/upload", headers, body)).status == 413
+        headers, body = upload(b"\n\n")
+        assert (await asgi(app, "POST", "/api/chat/batch/upload", headers, body)).status == 400
+
+    asyncio.run(run())
+
+
+def test_jobs_are_read_as_workers_free_up():
+    async def run():
+        read = []
+
+        async def jobs():
+            for index in range(20):
+                read.append(index)
+                yield {"index": index, "messages": [Message(role=Role.USER, content="hi")], "context": {}}
+
+        results = BatchRunner(FakeAgent(), concurrency=2).run(jobs())
+        await results.__anext__()
+        # Only what the workers have taken so far, not the whole input
+        assert len(read) <= 4
+        remaining = [result async for result in results]
+        assert remaining[-1]["summary"]["succeeded"] == 20
+
+    asyncio.run(run())
+
+
+def test_upload_lines_across_chunks():
+    async def run():
+        text = b'{"a": 1}\n\n{"b": "' + b"x" * 50 + b'"}\r\nlast'
+        file = UploadFile(io.BytesIO(text))
+        lines = [line async for line in chat.upload_lines(file, chunk_size=7)]
+        assert lines == text.split(b"\n")
+
+    asyncio.run(run())
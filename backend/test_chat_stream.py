@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from fastapi import FastAPI
+
+from app.agents import StreamRegistry
+from app.config import settings
+from app.routes import chat
+
+
+class FakeAgent:
+    """Streams numbered tokens and records whether the upstream was closed"""
+
+    def __init__(self, tokens: int = 50, delay: float = 0.01):
+        self.tokens = tokens
+        self.delay = delay
+        self.closed = asyncio.Event()
+        self.produced = 0
+        # As the chat agent builds it
+        self.streams = StreamRegistry(buffer_size=1024, idle_timeout=settings.stream_resume_timeout)
+
+    async def upstream(self):
+        try:
+            for i in range(self.tokens):
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield f"t{i} "
+        finally:
+            self.closed.set()
+
+    async def process_messages(self, messages, context):
+        return {"stream": self.upstream(), "conversation_id": "c1"}
+
+
+def make_app(agent: FakeAgent) -> FastAPI:
+    app = FastAPI()
+    app.include_router(chat.router)
+    app.dependency_overrides[chat.get_chat_agent] = lambda: agent
+    return app
+
+
+BODY = json.dumps({"messages": [{"role": "user", "content": "hi"}], "stream": True}).encode()
+HEADERS = {"content-type": "application/json"}
+
+
+def events(chunks):
+    """(id, data) of each SSE event"""
+    parsed = []
+    for block in b"".join(chunks).decode().split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        parsed.append((int(fields["id"]) if "id" in fields else None, fields["data"]))
+    return parsed
+
+
+def test_resume_is_opt_in():
+    assert settings.stream_resume_timeout == 0
+
+
+def test_disconnect_cancels_upstream_by_default(asgi, monkeypatch):
+    monkeypatch.setattr(settings, "stream_flush_interval_ms", 0)
+
+    async def run():
+        agent = FakeAgent(tokens=1000)
+        result = await asgi(make_app(agent), "POST", "/api/chat/stream", HEADERS, BODY, disconnect_after=3)
+        assert result.status == 200
+        await asyncio.wait_for(agent.closed.wait(), 1)
+        produced = agent.produced
+        await asyncio.sleep(0.1)
+        # Nothing keeps generating after the client left
+        assert agent.produced == produced < 1000
+        assert not agent.streams.streams
+
+    asyncio.run(run())
+
+
+def test_resume_with_last_event_id(asgi, monkeypatch):
+    monkeypatch.setattr(settings, "stream_flush_interval_ms", 0)
+    monkeypatch.setattr(settings, "stream_resume_timeout", 5.0)
+
+    async def run():
+        agent = FakeAgent(tokens=20)
+        app = make_app(agent)
+        first = await asgi(app, "POST", "/api/chat/stream", HEADERS, BODY, disconnect_after=4)
+        stream_id = first.headers["x-stream-id"]
+        seen = [event for event in events(first.chunks) if event[0] is not None]
+        last_id = seen[-1][0]
+
+        # The generation went on without a reader
+        await asyncio.wait_for(agent.closed.wait(), 2)
+        assert agent.produced == 20
+
+        resumed = await asgi(app, "GET", f"/api/chat/stream/{stream_id}", {"last-event-id": str(last_id)})
+        assert resumed.status == 200
+        rest = events(resumed.chunks)
+        assert [event_id for event_id, _ in rest] == list(range(last_id + 1, 22))
+        contents = [json.loads(data)["content"] for _, data in seen + rest[:-1]]
+        assert "".join(contents) == "".join(f"t{i} " for i in range(20))
+        assert rest[-1][1] == "[DONE]"
+
+        gone = await asgi(app, "GET", "/api/chat/stream/unknown")
+        assert gone.status == 410
+        await agent.streams.close()
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+import asyncio
+
+from app.agents.streaming import coalesce_chunks
+
+
+class Upstream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.produced = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            self.produced += 1
+            yield chunk
+
+
+def test_stalled_consumer_stops_the_upstream():
+    async def run():
+        upstream = Upstream(["0123456789"] * 100)
+        stream = coalesce_chunks(upstream.stream(), 10.0, 50)
+        assert await stream.__anext__() == "0123456789"
+
+        # The client stalls: reading stops once max_bytes are waiting
+        await asyncio.sleep(0.1)
+        assert upstream.produced == 6
+
+        assert await stream.__anext__() == "0123456789" * 5
+        pieces = [piece async for piece in stream]
+        assert "".join(pieces) == "0123456789" * 94
+        assert all(len(piece) <= 50 for piece in pieces)
+
+    asyncio.run(run())
+
+
+def test_limit_counts_utf8_bytes():
+    async def run():
+        # 10 characters, 20 bytes each
+        upstream = Upstream(["é" * 10] * 9)
+        pieces = [piece async for piece in coalesce_chunks(upstream.stream(), 10.0, 40)]
+        assert pieces == ["é" * 10] + ["é" * 20] * 4
+
+    asyncio.run(run())
+
+
+def test_interval_flushes_small_chunks():
+    async def run():
+        async def slow():
+            for i in range(6):
+                await asyncio.sleep(0.02)
+                yield f"t{i} "
+
+        pieces = [piece async for piece in coalesce_chunks(slow(), 0.05, 1024)]
+        assert pieces[0] == "t0 "
+        assert 1 < len(pieces) < 6
+        assert "".join(pieces) == "".join(f"t{i} " for i in range(6))
+
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+from urllib.parse import quote
+
+from fastapi import FastAPI
+
+from app.models import Message, Role
+from app.routes import chat
+from app.storage import ConversationStore
+
+
+async def app_with_store(tmp_path):
+    store = ConversationStore(f"sqlite:///{tmp_path}/conversations.db")
+    await store.initialize()
+    app = FastAPI()
+    app.include_router(chat.router)
+    app.dependency_overrides[chat.get_chat_agent] = lambda: SimpleNamespace(store=store)
+    return app, store
+
+
+def test_search_counts_every_match(asgi, tmp_path):
+    async def run():
+        app, store = await app_with_store(tmp_path)
+        for i in range(5):
+            await store.append_messages(f"c{i}", [
+                Message(role=Role.USER, content=f"what does the court say about bail {i}"),
+                Message(role=Role.ASSISTANT, content="the bail application is heard by a magistrate"),
+            ])
+        await store.append_messages("tamil", [Message(role=Role.USER, content="நீதிமன்றத்தில் பிணை மனு")])
+
+        first = (await asgi(app, "GET", "/api/chat/search?query=bail&limit=4")).json()
+        assert first["total"] == 10
+        assert len(first["results"]) == 4 and first["has_more"]
+        last = (await asgi(app, "GET", "/api/chat/search?query=bail&limit=4&offset=8")).json()
+        assert len(last["results"]) == 2 and not last["has_more"]
+
+        scoped = (await asgi(app, "GET", "/api/chat/search?query=bail%20court&chat_id=c3")).json()
+        assert scoped["total"] == 1
+        assert scoped["results"][0]["conversation_id"] == "c3"
+        assert "<mark>" in scoped["results"][0]["snippet"]
+
+        # Prefix matching keeps Indic words whole
+        tamil = (await asgi(app, "GET", f"/api/chat/search?query={quote('நீதி')}")).json()
+        assert tamil["total"] == 1 and tamil["results"][0]["conversation_id"] == "tamil"
+
+        none = (await asgi(app, "GET", "/api/chat/search?query=habeas")).json()
+        assert none == {"results": [], "total": 0, "limit": 20, "offset": 0, "has_more": False}
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_listing_pages_and_etags(asgi, tmp_path):
+    async def run():
+        app, store = await app_with_store(tmp_path)
+        for i in range(7):
+            await store.append_messages(f"c{i}", [Message(role=Role.USER, content=f"question {i}")])
+
+        ids, cursor = [], None
+        while True:
+            path = "/api/chat/conversations?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            page = (await asgi(app, "GET", path)).json()
+            assert len(page["conversations"]) <= 3
+            ids += [conversation["id"] for conversation in page["conversations"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        # Newest first, every conversation exactly once
+        assert ids == [f"c{i}" for i in reversed(range(7))]
+
+        first = await asgi(app, "GET", "/api/chat/conversations?limit=3")
+        etag = first.headers["etag"]
+        unchanged = await asgi(app, "GET", "/api/chat/conversations?limit=3", {"if-none-match": etag})
+        assert unchanged.status == 304 and unchanged.body == b""
+        other_page = await asgi(app, "GET", "/api/chat/conversations?limit=4", {"if-none-match": etag})
+        assert other_page.status == 200
+
+        await store.append_messages("c0", [Message(role=Role.ASSISTANT, content="an answer")])
+        changed = await asgi(app, "GET", "/api/chat/conversations?limit=3", {"if-none-match": etag})
+        assert changed.status == 200 and changed.headers["etag"] != etag
+        assert changed.json()["conversations"][0]["id"] == "c0"
+
+        bad = await asgi(app, "GET", "/api/chat/conversations?cursor=not-a-cursor")
+        assert bad.status == 400
+        await store.close()
+
+    asyncio.run(run())
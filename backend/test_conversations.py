@@ -0,0 +1,79 @@
+import asyncio
+import sqlite3
+
+from app.models import Message, Role
+from app.storage import ConversationStore
+from app.storage import conversations
+
+
+def store_at(tmp_path, **options) -> ConversationStore:
+    return ConversationStore(f"sqlite:///{tmp_path}/conversations.db", flush_interval=60, **options)
+
+
+def rows(tmp_path, sql: str):
+    db = sqlite3.connect(tmp_path / "conversations.db")
+    try:
+        return db.execute(sql).fetchall()
+    finally:
+        db.close()
+
+
+def test_reads_do_not_create_conversations(tmp_path):
+    async def run():
+        store = store_at(tmp_path)
+        await store.initialize()
+        conversation = await store.get_or_create("c1")
+        assert conversation["messages"] == []
+        await store.flush()
+        assert rows(tmp_path, "SELECT id FROM conversations") == []
+
+        await store.append_messages("c1", [Message(role=Role.USER, content="hello")])
+        await store.flush()
+        assert rows(tmp_path, "SELECT id, message_count FROM conversations") == [("c1", 1)]
+        await store.close()
+
+        reopened = store_at(tmp_path)
+        await reopened.initialize()
+        assert [m.content for m in (await reopened.get("c1"))["messages"]] == ["hello"]
+        await reopened.close()
+
+    asyncio.run(run())
+
+
+def test_failing_write_does_not_block_the_queue(tmp_path):
+    async def run():
+        store = store_at(tmp_path)
+        await store.initialize()
+        await store.append_messages("c1", [Message(role=Role.USER, content="before")])
+        await store.get_or_create("c2")
+        # A write that can never succeed (role is NOT NULL)
+        store._queue(
+            "INSERT INTO messages (conversation_id, seq, role, content) VALUES (?, ?, ?, ?)",
+            ("c1", 99, None, "poison")
+        )
+        await store.append_messages("c2", [Message(role=Role.USER, content="after")])
+
+        for _ in range(conversations.MAX_BATCH_ATTEMPTS - 1):
+            try:
+                await store.flush()
+            except sqlite3.IntegrityError:
+                pass
+            else:
+                raise AssertionError("the batch should fail")
+        assert len(store.pending) == 3
+
+        await store.flush()
+        assert store.pending == []
+        stats = store.get_stats()
+        assert stats["dropped_writes"] == 1
+        assert stats["failed_flushes"] == conversations.MAX_BATCH_ATTEMPTS
+        assert rows(tmp_path, "SELECT content FROM messages ORDER BY pk") == [("before",), ("after",)]
+
+        # Later batches go through as one transaction again
+        await store.append_messages("c2", [Message(role=Role.ASSISTANT, content="reply")])
+        await store.flush()
+        assert store.get_stats()["dropped_writes"] == 1
+        assert [m.content for m in (await store.get("c2"))["messages"]] == ["after", "reply"]
+        await store.close()
+
+    asyncio.run(run())
@@ -0,0 +1,104 @@
+import asyncio
+import io
+
+from fastapi import FastAPI
+
+from app.routes import files
+from app.storage import FileStore
+
+DATA = bytes(range(48, 48 + 64))  # 64 printable bytes
+
+
+async def app_with_file(tmp_path):
+    store = FileStore(tmp_path / "files", f"sqlite:///{tmp_path}/files.db")
+    await store.initialize()
+    source = io.BytesIO(DATA)
+
+    async def read(size: int) -> bytes:
+        return source.read(size)
+
+    record = await store.put(read, "notes.txt", "text/plain")
+    app = FastAPI()
+    app.include_router(files.router)
+    app.dependency_overrides[files.get_file_store] = lambda: store
+    return app, store, f"/api/files/{record['id']}", f'"{record["digest"]}"'
+
+
+def byteranges(result):
+    """(Content-Range, body) of each part of a multipart/byteranges response"""
+    boundary = result.headers["content-type"].split("boundary=")[1]
+    parts = []
+    for part in result.body.split(f"--{boundary}".encode())[1:-1]:
+        head, _, body = part.strip(b"\r\n").partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append((headers["Content-Range"], body))
+    return parts
+
+
+def test_ranges(asgi, tmp_path):
+    async def run():
+        app, store, path, etag = await app_with_file(tmp_path)
+
+        whole = await asgi(app, "GET", path)
+        assert whole.status == 200 and whole.body == DATA
+        assert whole.headers["etag"] == etag and whole.headers["accept-ranges"] == "bytes"
+        head = await asgi(app, "HEAD", path)
+        assert head.status == 200 and head.body == b"" and head.headers["content-length"] == "64"
+
+        single = await asgi(app, "GET", path, {"range": "bytes=2-5"})
+        assert single.status == 206 and single.body == DATA[2:6]
+        assert single.headers["content-range"] == "bytes 2-5/64"
+        assert single.headers["content-length"] == "4"
+
+        suffix = await asgi(app, "GET", path, {"range": "bytes=-3"})
+        assert suffix.body == DATA[-3:] and suffix.headers["content-range"] == "bytes 61-63/64"
+        open_ended = await asgi(app, "GET", path, {"range": "bytes=60-"})
+        assert open_ended.body == DATA[60:]
+
+        # Overlapping ranges are merged into one
+        merged = await asgi(app, "GET", path, {"range": "bytes=0-3,2-5"})
+        assert merged.status == 206 and merged.body == DATA[0:6]
+
+        multi = await asgi(app, "GET", path, {"range": "bytes=0-1,10-12,60-100"})
+        assert multi.status == 206
+        assert multi.headers["content-type"].startswith("multipart/byteranges")
+        assert int(multi.headers["content-length"]) == len(multi.body)
+        assert byteranges(multi) == [
+            ("bytes 0-1/64", DATA[0:2]),
+            ("bytes 10-12/64", DATA[10:13]),
+            ("bytes 60-63/64", DATA[60:64]),
+        ]
+
+        unsatisfiable = await asgi(app, "GET", path, {"range": "bytes=100-200"})
+        assert unsatisfiable.status == 416
+        assert unsatisfiable.headers["content-range"] == "bytes */64"
+        # Malformed ranges are ignored
+        assert (await asgi(app, "GET", path, {"range": "bytes=5-2"})).body == DATA
+        assert (await asgi(app, "GET", path, {"range": "lines=1-2"})).status == 200
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_conditional_requests(asgi, tmp_path):
+    async def run():
+        app, store, path, etag = await app_with_file(tmp_path)
+
+        current = await asgi(app, "GET", path, {"range": "bytes=0-9", "if-range": etag})
+        assert current.status == 206 and current.body == DATA[:10]
+        # The client's copy is another version: send the whole file instead
+        changed = await asgi(app, "GET", path, {"range": "bytes=0-9", "if-range": '"older"'})
+        assert changed.status == 200 and changed.body == DATA
+
+        cached = await asgi(app, "GET", path, {"if-none-match": etag})
+        assert cached.status == 304 and cached.body == b""
+        assert cached.headers["etag"] == etag
+        stale = await asgi(app, "GET", path, {"if-none-match": '"older"'})
+        assert stale.status == 200
+
+        since = await asgi(app, "GET", path, {"if-modified-since": current.headers["last-modified"]})
+        assert since.status == 304
+        assert (await asgi(app, "GET", "/api/files/missing")).status == 404
+        await store.close()
+
+    asyncio.run(run())
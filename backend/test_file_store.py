@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+from app.storage import FileStore
+from app.storage.files import FileTooLarge
+
+
+def reader(data: bytes):
+    source = io.BytesIO(data)
+
+    async def read(size: int) -> bytes:
+        return source.read(size)
+
+    return read
+
+
+async def store_at(tmp_path) -> FileStore:
+    store = FileStore(tmp_path / "files", f"sqlite:///{tmp_path}/files.db", chunk_size=4)
+    await store.initialize()
+    return store
+
+
+def blobs(store: FileStore):
+    return sorted(path.name for path in store.blob_dir.rglob("*") if path.is_file())
+
+
+def test_duplicate_content_shares_one_blob(tmp_path):
+    async def run():
+        store = await store_at(tmp_path)
+        data = b"the same judgment, uploaded twice"
+        digest = hashlib.sha256(data).hexdigest()
+        first = await store.put(reader(data), "a.txt", "text/plain")
+        second = await store.put(reader(data), "b.txt", "text/plain")
+        other = await store.put(reader(b"something else"), "c.txt", "text/plain")
+
+        assert first["digest"] == second["digest"] == digest
+        assert first["id"] != second["id"]
+        assert blobs(store) == sorted([digest, other["digest"]])
+        assert store.deduplicated == 1
+        assert first["path"].read_bytes() == data
+
+        # The blob stays while another file refers to it
+        await store.begin_document(digest)
+        assert await store.delete(first["id"])
+        assert digest in blobs(store)
+        assert await store.get(first["id"]) is None
+        assert (await store.get(second["id"]))["filename"] == "b.txt"
+        assert await store.get_document(digest) is not None
+
+        # The last reference takes the blob and its extracted text with it
+        assert await store.delete(second["id"])
+        assert blobs(store) == [other["digest"]]
+        assert await store.get_document(digest) is None
+        assert not await store.delete(second["id"])
+
+        # Uploading it again starts a fresh blob
+        again = await store.put(reader(data), "a.txt", "text/plain")
+        assert again["path"].read_bytes() == data
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_oversized_upload_leaves_nothing_behind(tmp_path):
+    async def run():
+        store = await store_at(tmp_path)
+        with pytest.raises(FileTooLarge):
+            await store.put(reader(b"x" * 100), "big.bin", None, max_size=10)
+        assert blobs(store) == []
+        assert list(store.incoming_dir.iterdir()) == []
+        assert await store.list_files() == []
+        await store.close()
+
+    asyncio.run(run())
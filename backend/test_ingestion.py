@@ -0,0 +1,58 @@
+import asyncio
+import os
+from pathlib import Path
+
+from app.agents import ingestion
+from app.agents.extraction import extract_sections
+from app.agents.ingestion import DocumentIngester
+from app.storage import FileStore
+
+
+def extract_or_die(path: str, content_type: str):
+    """Kills its worker process for poison documents (and once for flaky ones)"""
+
+    text = Path(path).read_text()
+    if text.startswith("poison"):
+        os._exit(1)
+    if text.startswith("flaky"):
+        marker = Path(path + ".died")
+        if not marker.exists():
+            marker.touch()
+            os._exit(1)
+    return extract_sections(path, content_type)
+
+
+async def ingest(tmp_path, documents):
+    store = FileStore(tmp_path / "files", f"sqlite:///{tmp_path}/files.db")
+    await store.initialize()
+    ingester = DocumentIngester(store, workers=2)
+    records = []
+    for name, text in documents.items():
+        path = tmp_path / name
+        path.write_text(text)
+        records.append({"digest": name, "path": path, "content_type": "text/plain", "filename": name})
+        await ingester.submit(records[-1])
+    await asyncio.gather(*list(ingester.tasks.values()))
+    statuses = {record["digest"]: (await store.get_document(record["digest"]))["status"] for record in records}
+    await ingester.close()
+    await store.close()
+    return statuses, ingester.stats
+
+
+def test_dead_worker_fails_only_its_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "extract_sections", extract_or_die)
+    statuses, stats = asyncio.run(ingest(tmp_path, {
+        "poison": "poison " * 10,
+        "good": "a perfectly ordinary document " * 50,
+    }))
+    assert statuses == {"poison": "failed", "good": "ready"}
+    assert stats["pool_restarts"] == 1
+    assert stats["failed"] == 1 and stats["ingested"] == 1
+
+
+def test_dead_worker_is_retried_on_a_new_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "extract_sections", extract_or_die)
+    statuses, stats = asyncio.run(ingest(tmp_path, {"flaky": "flaky " * 10}))
+    assert statuses == {"flaky": "ready"}
+    assert stats["pool_restarts"] == 1
+
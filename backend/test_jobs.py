@@ -0,0 +1,89 @@
+import asyncio
+
+from app.storage.jobs import SQLiteJobBroker
+
+LEASE = 0.05
+
+
+async def broker_at(tmp_path, **options) -> SQLiteJobBroker:
+    broker = SQLiteJobBroker(f"sqlite:///{tmp_path}/jobs.db", **options)
+    await broker.initialize()
+    return broker
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    async def run():
+        broker = await broker_at(tmp_path)
+        job = await broker.submit({"messages": []})
+        first = await broker.claim("w1", LEASE)
+        assert first["id"] == job["id"] and first["attempts"] == 1
+        assert await broker.claim("w2", LEASE) is None
+
+        # w1 stops renewing: the job goes to the next worker that asks
+        await asyncio.sleep(LEASE * 2)
+        second = await broker.claim("w2", 10)
+        assert second["id"] == job["id"] and second["attempts"] == 2 and second["worker"] == "w2"
+
+        # The old worker finds out it lost the job and can't finish it
+        assert not await broker.heartbeat(job["id"], "w1", {}, 10)
+        await broker.complete(job["id"], "w1", {"content": "stale"}, {})
+        assert (await broker.get(job["id"]))["status"] == "running"
+
+        assert await broker.heartbeat(job["id"], "w2", {"tokens": 5}, 10)
+        await broker.complete(job["id"], "w2", {"content": "done"}, {"tokens": 9})
+        done = await broker.get(job["id"])
+        assert (done["status"], done["result"], done["progress"]) == ("succeeded", {"content": "done"}, {"tokens": 9})
+        await broker.close()
+
+    asyncio.run(run())
+
+
+def test_lost_jobs_fail_after_max_attempts(tmp_path):
+    async def run():
+        broker = await broker_at(tmp_path, max_attempts=2)
+        job = await broker.submit({"messages": []})
+        for _ in range(2):
+            assert (await broker.claim("w", LEASE))["id"] == job["id"]
+            await asyncio.sleep(LEASE * 2)
+
+        assert await broker.claim("w", LEASE) is None
+        failed = await broker.get(job["id"])
+        assert failed["status"] == "failed"
+        assert failed["error"] == "Worker lost after 2 attempt(s)"
+        await broker.close()
+
+    asyncio.run(run())
+
+
+def test_cancelled_job_with_expired_lease_is_not_requeued(tmp_path):
+    async def run():
+        broker = await broker_at(tmp_path)
+        job = await broker.submit({"messages": []})
+        await broker.claim("w", LEASE)
+        assert (await broker.cancel(job["id"]))["cancel_requested"]
+
+        await asyncio.sleep(LEASE * 2)
+        assert await broker.claim("w", LEASE) is None
+        assert (await broker.get(job["id"]))["status"] == "cancelled"
+        await broker.close()
+
+    asyncio.run(run())
+
+
+def test_retry_is_not_an_attempt(tmp_path):
+    async def run():
+        broker = await broker_at(tmp_path, max_attempts=1)
+        low = await broker.submit({"n": 1}, priority=0)
+        high = await broker.submit({"n": 2}, priority=5)
+        assert (await broker.claim("w", 10))["id"] == high["id"]
+
+        # Rejected by admission control: back in the queue after a delay
+        await broker.retry(high["id"], "w", LEASE)
+        assert (await broker.claim("w", 10))["id"] == low["id"]
+        await asyncio.sleep(LEASE * 2)
+        again = await broker.claim("w", 10)
+        assert again["id"] == high["id"] and again["attempts"] == 1
+        assert await broker.counts() == {"running": 2}
+        await broker.close()
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.providers.pool import CountingTransport, HTTPPoolManager
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/down":
+        raise httpx.ConnectError("refused", request=request)
+    return httpx.Response(200, content=b"data: token\n\n" * 3)
+
+
+def test_counts_requests_until_the_body_is_closed():
+    async def run():
+        transport = CountingTransport(httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=transport) as client:
+            async with client.stream("GET", "http://upstream/stream") as response:
+                assert transport.in_flight == 1
+                assert [line async for line in response.aiter_lines() if line] == ["data: token"] * 3
+            assert transport.in_flight == 0
+
+            await client.get("http://upstream/complete")
+            with pytest.raises(httpx.ConnectError):
+                await client.get("http://upstream/down")
+            assert transport.in_flight == 0
+            assert transport.requests == 3
+
+    asyncio.run(run())
+
+
+def test_stats_follow_shared_clients():
+    async def run():
+        pools = HTTPPoolManager()
+        client = pools.acquire("http://localhost:8080/")
+        assert pools.acquire("http://localhost:8080") is client
+
+        stats = pools.get_stats()["http://localhost:8080"]
+        assert stats["providers"] == 2
+        assert stats["in_flight"] == stats["in_use"] == stats["waiting"] == stats["requests"] == 0
+
+        await pools.release("http://localhost:8080")
+        await pools.release("http://localhost:8080")
+        assert pools.get_stats() == {}
+        assert client.is_closed
+
+    asyncio.run(run())
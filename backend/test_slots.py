@@ -0,0 +1,52 @@
+import asyncio
+
+from app.providers.slots import SlotManager
+
+
+def test_busy_slots_send_unpinned_after_the_timeout():
+    async def run():
+        slots = SlotManager(1, wait_timeout=0.05)
+        assert await slots.acquire("c1", ["a"]) == 0
+
+        # c1 is still generating: c2 waits, then goes unpinned
+        assert await slots.acquire("c2", ["b"]) is None
+        stats = slots.get_stats()
+        assert stats["slot_wait_timeouts"] == 1 and stats["waiting_requests"] == 0
+
+        slots.release(0)
+        assert await slots.acquire("c2", ["b"]) == 0
+        assert slots.get_stats()["evictions"] == 1
+
+    asyncio.run(run())
+
+
+def test_slot_freed_in_time_is_taken():
+    async def run():
+        slots = SlotManager(1, wait_timeout=1.0)
+        assert await slots.acquire("c1", ["a"]) == 0
+        waiting = asyncio.create_task(slots.acquire("c2", ["b"]))
+        await asyncio.sleep(0.01)
+        assert slots.get_stats()["waiting_requests"] == 1
+
+        slots.release(0)
+        assert await asyncio.wait_for(waiting, 1) == 0
+        assert slots.get_stats()["slot_wait_timeouts"] == 0
+
+    asyncio.run(run())
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def run():
+        slots = SlotManager(1, wait_timeout=0.05)
+        await slots.acquire("c1", ["a"])
+        late = asyncio.create_task(slots.acquire("c2", ["b"]))
+        await asyncio.sleep(0.01)
+        slots.wait_timeout = 1.0
+        waiting = asyncio.create_task(slots.acquire("c3", ["c"]))
+
+        assert await late is None
+        # The idle slot goes to the request still waiting
+        slots.release(0)
+        assert await asyncio.wait_for(waiting, 1) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+import asyncio
+
+from app.agents.context_index import ContextIndex
+from app.agents.memory_agent import MemoryAgent
+from app.agents.summarizer import ConversationSummarizer
+from app.models import Message, Role
+
+
+class FakeCounter:
+    async def count_messages(self, messages):
+        return [10] * len(messages)
+
+
+def history(n: int, edited: int = -1):
+    return [
+        Message(
+            role=Role.USER if i % 2 == 0 else Role.ASSISTANT,
+            content=f"message {i}" + (" (edited)" if i == edited else "")
+        )
+        for i in range(n)
+    ]
+
+
+def indexed(messages):
+    index = ContextIndex()
+    index.extend(messages, [10] * len(messages))
+    return index
+
+
+def summarizer():
+    async def generate(messages):
+        return f"folded {messages[-1].content.count('USER:') + messages[-1].content.count('ASSISTANT:')}"
+
+    return ConversationSummarizer(generate, min_new_messages=2)
+
+
+async def summarize(summaries, conversation_id, messages, end):
+    index = indexed(messages)
+    summaries.schedule(conversation_id, end, index.prefix_hashes, lambda start, stop: messages[start:stop])
+    await summaries.tasks[conversation_id]
+
+
+def test_edited_history_is_summarized_again():
+    async def run():
+        summaries = summarizer()
+        messages = history(10)
+        await summarize(summaries, "c1", messages, 6)
+        assert summaries.get("c1", 8, indexed(messages).prefix_hashes) == (6, "folded 6")
+
+        # Appending keeps the summary; editing what it covers doesn't
+        assert summaries.get("c1", 8, indexed(history(12)).prefix_hashes) is not None
+        edited = indexed(history(10, edited=3))
+        assert summaries.get("c1", 8, edited.prefix_hashes) is None
+
+        segments = []
+        summaries.schedule("c1", 8, edited.prefix_hashes, lambda start, stop: segments.append((start, stop)) or [])
+        await summaries.tasks["c1"]
+        assert segments == [(0, 8)]
+
+    asyncio.run(run())
+
+
+def test_summary_is_not_reused_past_a_gap(tmp_path):
+    async def run():
+        summaries = summarizer()
+        agent = MemoryAgent(config={
+            "database_url": f"sqlite:///{tmp_path}/conversations.db",
+            "token_counter": FakeCounter(),
+            "summarizer": summaries
+        })
+        messages = history(20)
+
+        # 200 tokens into 100: 8 messages fit the trim budget, 10 the limit
+        await summarize(summaries, "c1", messages, 10)
+        context = await agent.manage_context(messages, 100, "c1")
+        assert context[0].content.startswith("[Summary of the first 10 messages")
+        assert context[1:] == messages[10:]
+
+        # Messages 6-9 wouldn't fit next to the summary: don't drop them silently
+        summaries.summaries.clear()
+        await summarize(summaries, "c2", messages, 6)
+        context = await agent.manage_context(messages, 100, "c2")
+        assert context[0].content.startswith("[Previous conversation summary: 12 messages")
+        assert context[1:] == messages[12:]
+        await agent.cleanup()
+
+    asyncio.run(run())
+
+
+def test_clear_conversation_forgets_summary(tmp_path):
+    async def run():
+        summaries = summarizer()
+        agent = MemoryAgent(config={
+            "database_url": f"sqlite:///{tmp_path}/conversations.db",
+            "token_counter": FakeCounter(),
+            "summarizer": summaries
+        })
+        await agent.initialize()
+        messages = history(10)
+        await summarize(summaries, "c1", messages, 6)
+
+        await agent.clear_conversation("c1")
+        assert summaries.get("c1", 8, indexed(messages).prefix_hashes) is None
+        assert "c1" not in summaries.tasks
+        await agent.cleanup()
+
+    asyncio.run(run())
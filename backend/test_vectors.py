@@ -0,0 +1,91 @@
+import numpy as np
+
+from app.storage.vectors import VectorIndex
+
+DIM = 16
+K = 10
+
+
+def brute_force(vectors: dict, queries, k: int, within=None):
+    """Exact top k by cosine similarity over {id: vector}"""
+    ids = [i for i in vectors if within is None or i in within]
+    matrix = VectorIndex.normalize([vectors[i] for i in ids])
+    scores = VectorIndex.normalize(queries) @ matrix.T
+    return [
+        [(ids[column], float(row[column])) for column in np.argsort(-row)[:k]]
+        for row in scores
+    ]
+
+
+def assert_same(found, expected):
+    assert len(found) == len(expected)
+    for got, want in zip(found, expected):
+        assert [i for i, _ in got] == [i for i, _ in want]
+        assert np.allclose([s for _, s in got], [s for _, s in want], atol=1e-5)
+
+
+def test_matches_brute_force_through_remove_and_compact(tmp_path):
+    rng = np.random.default_rng(7)
+    stored = {i: rng.standard_normal(DIM) for i in range(3000)}
+    queries = rng.standard_normal((5, DIM))
+
+    index = VectorIndex(tmp_path / "index", block_rows=256)
+    index.open()
+    ids = list(stored)
+    # Several appends, so the files grow past their first capacity
+    for start in range(0, len(ids), 700):
+        batch = ids[start:start + 700]
+        index.add(batch, [stored[i] for i in batch], model="embed")
+    assert_same(index.search(queries, K), brute_force(stored, queries, K))
+
+    within = set(rng.choice(ids, 200, replace=False).tolist())
+    assert_same(index.search(queries, K, within=list(within)), brute_force(stored, queries, K, within))
+
+    # Tombstoned rows drop out of results
+    removed = ids[:1200]
+    assert index.remove(removed) == 1200
+    for i in removed:
+        del stored[i]
+    assert index.get_stats()["deleted"] == 1200
+    assert_same(index.search(queries, K), brute_force(stored, queries, K))
+
+    # Past half dead, the index is compacted
+    removed = ids[1200:1700]
+    assert index.remove(removed) == 500
+    for i in removed:
+        del stored[i]
+    stats = index.get_stats()
+    assert stats["deleted"] == 0 and stats["vectors"] == len(stored)
+    assert_same(index.search(queries, K), brute_force(stored, queries, K))
+
+    for i in range(5000, 5100):
+        stored[i] = rng.standard_normal(DIM)
+    index.add(list(range(5000, 5100)), [stored[i] for i in range(5000, 5100)], model="embed")
+    index.close()
+
+    # Another process (or a restart) sees the same index
+    reopened = VectorIndex(tmp_path / "index", block_rows=256)
+    reopened.open()
+    assert_same(reopened.search(queries, K), brute_force(stored, queries, K))
+    assert reopened.search(queries, K, within=[99999]) == [[] for _ in queries]
+    reopened.close()
+
+
+def test_duplicate_ids_are_returned_once(tmp_path):
+    index = VectorIndex(tmp_path / "index")
+    index.open()
+    index.add([1, 2, 1], [[1, 0], [0.9, 0.1], [0.5, 0.5]])
+    results = index.search([[1, 0]], 3)[0]
+    assert [i for i, _ in results] == [1, 2]
+    assert np.isclose(results[0][1], 1.0)
+    index.close()
+
+
+def test_new_model_empties_the_index(tmp_path):
+    index = VectorIndex(tmp_path / "index")
+    index.open()
+    index.add([1], [[1, 0]], model="a")
+    assert not index.use_model("a")
+    assert index.use_model("b")
+    assert index.search([[1, 0]], 1) == [[]]
+    index.close()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+from fastapi import WebSocketDisconnect
+
+from app.config import settings
+from app.routes.websocket import ChatSession
+
+
+class FakeSocket:
+    """Feeds client frames to a session and collects what it sends"""
+
+    def __init__(self):
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+
+    def client_send(self, message) -> None:
+        self.inbox.put_nowait(message if isinstance(message, str) else json.dumps(message))
+
+    def client_close(self) -> None:
+        self.inbox.put_nowait(None)
+
+    async def receive_text(self) -> str:
+        text = await self.inbox.get()
+        if text is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def send_text(self, text: str) -> None:
+        self.outbox.put_nowait(json.loads(text))
+
+    async def next(self, timeout: float = 1.0):
+        return await asyncio.wait_for(self.outbox.get(), timeout)
+
+
+class FakeAgent:
+    def __init__(self, tokens: int = 20):
+        self.tokens = tokens
+        self.produced = 0
+        self.closed = asyncio.Event()
+
+    async def upstream(self):
+        try:
+            for i in range(self.tokens):
+                await asyncio.sleep(0)
+                self.produced += 1
+                yield f"t{i} "
+        finally:
+            self.closed.set()
+
+    async def process_messages(self, messages, context):
+        return {"stream": self.upstream(), "conversation_id": "c1"}
+
+
+REQUEST = {"messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_invalid_ids_keep_the_session(monkeypatch):
+    monkeypatch.setattr(settings, "stream_flush_interval_ms", 0)
+
+    async def run():
+        socket = FakeSocket()
+        session = asyncio.create_task(ChatSession(socket, FakeAgent(tokens=2)).run())
+
+        for stream_id in ([1], {}, "", None, 7):
+            socket.client_send({"type": "start", "id": stream_id, "request": REQUEST})
+            error = await socket.next()
+            assert error["type"] == "error" and error["id"] is None
+        socket.client_send({"type": "credit", "id": {"a": 1}, "credits": 1})
+        assert (await socket.next())["type"] == "error"
+
+        # Still serving after the bad frames
+        socket.client_send({"type": "start", "id": "s1", "request": REQUEST})
+        kinds = [(await socket.next())["type"] for _ in range(4)]
+        assert kinds == ["started", "chunk", "chunk", "done"]
+
+        socket.client_close()
+        await asyncio.wait_for(session, 1)
+
+    asyncio.run(run())
+
+
+def test_credit_window_and_cancel(monkeypatch):
+    monkeypatch.setattr(settings, "stream_flush_interval_ms", 0)
+    monkeypatch.setattr(settings, "websocket_stream_window", 2)
+
+    async def run():
+        socket = FakeSocket()
+        agent = FakeAgent(tokens=1000)
+        session = asyncio.create_task(ChatSession(socket, agent).run())
+
+        socket.client_send({"type": "start", "id": "s1", "request": REQUEST})
+        assert (await socket.next())["type"] == "started"
+        assert [(await socket.next())["content"] for _ in range(2)] == ["t0 ", "t1 "]
+
+        # Out of credits: nothing more is sent until the client grants some
+        await asyncio.sleep(0.05)
+        assert socket.outbox.empty()
+
+        socket.client_send({"type": "credit", "id": "s1", "credits": 3})
+        assert [(await socket.next())["content"] for _ in range(3)] == ["t2 ", "t3 ", "t4 "]
+        await asyncio.sleep(0.05)
+        assert socket.outbox.empty()
+
+        socket.client_send({"type": "credit", "id": "s1", "credits": -1})
+        assert (await socket.next())["type"] == "error"
+
+        socket.client_send({"type": "cancel", "id": "s1"})
+        done = await socket.next()
+        assert done == {"type": "done", "id": "s1", "cancelled": True}
+        await asyncio.wait_for(agent.closed.wait(), 1)
+        assert agent.produced < 1000
+
+        socket.client_close()
+        await asyncio.wait_for(session, 1)
+
+    asyncio.run(run())
+
+
+def test_disconnect_cancels_streams(monkeypatch):
+    monkeypatch.setattr(settings, "stream_flush_interval_ms", 0)
+    monkeypatch.setattr(settings, "websocket_stream_window", 1)
+
+    async def run():
+        socket = FakeSocket()
+        agent = FakeAgent(tokens=1000)
+        session = asyncio.create_task(ChatSession(socket, agent).run())
+
+        socket.client_send({"type": "start", "id": "s1", "request": REQUEST})
+        assert (await socket.next())["type"] == "started"
+        assert (await socket.next())["type"] == "chunk"
+
+        socket.client_close()
+        await asyncio.wait_for(session, 1)
+        assert agent.closed.is_set()
+
+    asyncio.run(run())